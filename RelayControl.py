@@ -1,39 +1,14 @@
 # Script for 3-ch RPi Relay Board
-import RPi.GPIO as GPIO
-from time import sleep
-import datetime
-import csv
+#
+# Cycles relay 1 (BCM 26): released for 3 s, pressed for 5 s, until Ctrl-C.  Pins and
+# timing are in rigs/relay.json; this is the same as `python -m vbreathe relay rigs/relay.json`.
+# Add the "relay" section to a sensor rig config to cycle the relay while recording.
 import os
-import keyboard
+import sys
 
+from vbreathe.cli import main
 
-pressCounter = 0
+RIG_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rigs', 'relay.json')
 
-# Relay channel definitions
-relay1 = 26
-#relay2 = 20 but not in use
-#relay3 = 21 but not in use
-
-# Initialise GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(relay1,GPIO.OUT)
-#GPIO.setup(relay2,GPIO.OUT) but relay 2 not in use
-#GPIO.setup(relay3,GPIO.OUT) but relay 3 not in use
-
-
-try:
-    while True:
-        
-        # Relays are active-low
-        GPIO.output(relay1,True)
-        sleep(3)
-
-        print("Cycling relays #", pressCounter)
-        GPIO.output(relay1,False)
-        sleep(5)
-        pressCounter = pressCounter + 1
-    
-except KeyboardInterrupt:
-    print("Buttons were pressed", pressCounter, "times")
-    GPIO.cleanup()
+if __name__ == '__main__':
+    sys.exit(main(['relay', RIG_CONFIG] + sys.argv[1:]))
@@ -1237,3 +1237,69 @@ def aa_gpio_change (aardvark, timeout):
     return api.py_aa_gpio_change(aardvark, timeout)
 
 
+#==========================================================================
+# I2C FAST-PATH SESSION
+#==========================================================================
+# The wrappers above check the library, inspect and convert their array
+# arguments and may allocate a new array on every call.  For a polling
+# loop that repeats the same transaction thousands of times per second,
+# AardvarkI2cSession validates everything once, keeps preallocated
+# buffers and binds the raw api.py_aa_i2c_* calls with all their
+# arguments, so each transaction is a single call into the extension.
+#
+#   session = AardvarkI2cSession(handle, 0x28, 4)
+#   count = session.read()              # bytes land in session.data_in
+#
+#   session = AardvarkI2cSession(handle, 0x55, 3, write_data=b'\x36\x24')
+#   status, num_written, num_read = session.write_read()
+#
+# Results are the raw API returns: read() returns the byte count (or a
+# negative status code), write() the bytes written, and write_read() the
+# tuple (status, num_written, num_read) without the array.
+class AardvarkI2cSession:
+    def __init__ (self, aardvark, slave_addr, read_length=0, write_data=None, flags=AA_I2C_NO_FLAGS):
+        if not AA_LIBRARY_LOADED:
+            raise IOError("Aardvark library not loaded (status %d)" % AA_INCOMPATIBLE_LIBRARY)
+        if aardvark <= 0:
+            raise ValueError("invalid Aardvark handle %d" % aardvark)
+        if not 0 <= slave_addr <= 0x3ff:
+            raise ValueError("invalid slave address 0x%x" % slave_addr)
+        read_length = int(read_length)
+        if not 0 <= read_length <= 65535:
+            raise ValueError("read length must be 0..65535")
+
+        self.aardvark   = aardvark
+        self.slave_addr = slave_addr
+        self.flags      = flags
+        self.data_in    = array_u08(read_length)
+        self.data_out   = array('B', write_data) if write_data else array_u08(0)
+        out_length      = len(self.data_out)
+
+        # Bound transactions: every argument fixed, one extension call each
+        from functools import partial
+        self.read = partial(api.py_aa_i2c_read, aardvark, slave_addr, flags,
+                            read_length, self.data_in)
+        self.write = partial(api.py_aa_i2c_write, aardvark, slave_addr, flags,
+                             out_length, self.data_out)
+        self.write_read = partial(api.py_aa_i2c_write_read, aardvark, slave_addr, flags,
+                                  out_length, self.data_out, read_length, self.data_in)
+
+    # Replace the command written by write() / write_read() in place.  The
+    # length is bound, so the new command must be the same size.
+    def set_write_data (self, data):
+        if len(data) != len(self.data_out):
+            raise ValueError("command must be %d bytes" % len(self.data_out))
+        self.data_out[:] = array('B', data)
+
+    # `n` reads into `out`, a writable buffer of n * read_length bytes
+    # (e.g. memoryview(numpy_frames).cast('B')).  Returns the list of
+    # per-read counts.
+    def read_many (self, n, out):
+        read = self.read
+        data_in = self.data_in
+        length = len(data_in)
+        counts = [0] * n
+        for i in range(n):
+            counts[i] = read()
+            out[i * length:(i + 1) * length] = data_in
+        return counts
@@ -0,0 +1,14 @@
+#==========================================================================
+# VBreathe acquisition package
+#--------------------------------------------------------------------------
+# Shared building blocks and the core acquisition loop behind the sensor
+# scripts (Microforce.py, Pressure_sensor.py, WSEN_0.1_i2c_binho_readings.py,
+# RelayControl.py).  Run `python -m vbreathe --help` for the modes.
+#
+# Modules in this package must not open an adapter at import time so that
+# they can be used from other processes (live view, analysis) without
+# touching the hardware.
+#==========================================================================
+
+from .ringbuffer import SampleRing, RingReader
+from .status import StatusLine
@@ -0,0 +1,331 @@
+#==========================================================================
+# Alarm rules on the live stream
+#--------------------------------------------------------------------------
+# For unattended endurance runs: rules from the rig config's "alarms"
+# section are compiled into arrays once and evaluated on every block,
+# vectorized over rules and channels, so checking costs a few NumPy
+# operations per block whatever the number of rules.
+#
+#   "alarms": {
+#     "budget_ms": 100,
+#     "webhook": "http://127.0.0.1:8765/alarm",
+#     "rules": [
+#       {"name": "pressure range", "channel": "pressure (Pa)", "above": 500, "below": -500},
+#       {"name": "force saturating", "channel": "force (counts)", "above": 13000, "actions": ["log", "relay_off"]},
+#       {"name": "pressure jump", "channel": "pressure (Pa)", "rate_above": 2000},
+#       {"name": "noisy force", "channel": "force (N)", "window_s": 2, "stat": "std", "above": 0.5},
+#       {"name": "bus errors", "channel": "errors/s", "above": 5, "actions": ["log", "stop"]}
+#     ]
+#   }
+#
+# Conditions: value outside above/below; |rate of change| above
+# rate_above (units/s); or a window statistic (mean, std, min, max over
+# the last window_s seconds) outside above/below.  The pseudo-channel
+# 'errors/s' is the adapter's transfer error rate.
+#
+# Rules are edge-triggered: a rule fires when its condition becomes true
+# and re-arms once a block clears it.  Actions (default ["log"]):
+#   log        status line message and a row in the alarm log
+#   stop       ends the acquisition loop
+#   relay_off  releases the relay and stops cycling it
+#   webhook    POSTs the alarm as JSON to the configured URL
+#
+# stop and relay_off run in the acquisition loop as soon as the block is
+# checked.  Logging and the webhook are I/O, so they go through a bounded
+# queue to a worker thread.  A full queue drops the alarm (counted in
+# `missed`) rather than stalling acquisition.  The webhook timeout is the
+# latency budget; actions finishing later than budget_ms after detection
+# are counted in `overruns`.
+#
+# Usage: python -m vbreathe.alarms serve [--port 8765]   local webhook stand-in
+#==========================================================================
+import argparse
+import collections
+import csv
+import datetime
+import json
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+BUDGET_MS    = 100
+QUEUE_DEPTH  = 64
+WEBHOOK_PORT = 8765
+ERRORS       = 'errors/s'
+STATS        = ('mean', 'std', 'min', 'max')
+ALARM_FIELDS = ['timestamp', 'rule', 'channel', 'condition', 'value', 'delay (ms)']
+
+
+#==========================================================================
+# RULES
+#==========================================================================
+# One kind of condition over the rules that use it: the columns they
+# watch and their limits, as arrays
+class _Group:
+    def __init__ (self, rules, columns):
+        self.rules = np.array(rules, dtype=np.intp)
+        self.cols  = np.array(columns, dtype=np.intp)
+        self.lo    = np.full(len(rules), -np.inf)
+        self.hi    = np.full(len(rules), np.inf)
+
+
+class AlarmEngine:
+    def __init__ (self, rules, channels):
+        self.specs    = list(rules)
+        self.channels = list(channels) + [ERRORS]
+        self.names    = [r.get('name', r['channel']) for r in self.specs]
+        self.actions  = [tuple(r.get('actions', ['log'])) for r in self.specs]
+        self.active   = np.zeros(len(self.specs), dtype=bool)
+        self.fired    = 0
+
+        def column (rule):
+            try:
+                return self.channels.index(rule['channel'])
+            except ValueError:
+                raise ValueError("alarm %r: no channel %r" % (rule.get('name'), rule['channel']))
+
+        levels = [i for i, r in enumerate(self.specs) if 'rate_above' not in r and 'window_s' not in r]
+        rates  = [i for i, r in enumerate(self.specs) if 'rate_above' in r]
+        window = [i for i, r in enumerate(self.specs) if 'window_s' in r]
+
+        self._levels = _Group(levels, [column(self.specs[i]) for i in levels])
+        self._rates  = _Group(rates, [column(self.specs[i]) for i in rates])
+        self._window = _Group(window, [column(self.specs[i]) for i in window])
+        for group in (self._levels, self._window):
+            for k, i in enumerate(group.rules):
+                group.lo[k] = float(self.specs[i].get('below', -np.inf))
+                group.hi[k] = float(self.specs[i].get('above', np.inf))
+        self._rates.hi[:] = [float(self.specs[i]['rate_above']) for i in rates]
+        for i in window:
+            if self.specs[i].get('stat', 'mean') not in STATS:
+                raise ValueError("alarm %r: stat must be one of %s" % (self.names[i], ", ".join(STATS)))
+        self._stat = np.array([STATS.index(self.specs[i].get('stat', 'mean')) for i in window], dtype=np.intp)
+        self._span = np.array([float(self.specs[i]['window_s']) for i in window])
+
+        # Per-block summaries of the window columns: (t_end, n, sum, sumsq, min, max)
+        self._blocks = collections.deque()
+        self._last = None           # Last (time, row) for rates across blocks
+
+    # Check one block (with the errors/s column appended).  Returns the
+    # indices of the rules that fired and the value that tripped each.
+    def evaluate (self, times, values):
+        hit = np.zeros(len(self.specs), dtype=bool)
+        value = np.full(len(self.specs), np.nan)
+
+        g = self._levels
+        if len(g.rules):
+            v = values[:, g.cols]
+            out = (v > g.hi) | (v < g.lo)
+            hit[g.rules] = out.any(axis=0)
+            value[g.rules] = v[out.argmax(axis=0), np.arange(len(g.rules))]
+
+        g = self._rates
+        if len(g.rules):
+            t, v = times, values[:, g.cols]
+            if self._last is not None:
+                t = np.concatenate(([self._last[0]], t))
+                v = np.vstack((self._last[1][g.cols], v))
+            if len(t) > 1:
+                rate = np.abs(np.diff(v, axis=0) / np.maximum(np.diff(t), 1e-9)[:, None])
+                out = rate > g.hi
+                hit[g.rules] = out.any(axis=0)
+                value[g.rules] = rate[out.argmax(axis=0), np.arange(len(g.rules))]
+            self._last = (times[-1], values[-1].copy())
+
+        g = self._window
+        if len(g.rules):
+            stat = self._window_stats(times, values[:, g.cols])
+            out = (stat > g.hi) | (stat < g.lo)
+            hit[g.rules] = out
+            value[g.rules] = stat
+
+        fired = np.flatnonzero(hit & ~self.active)
+        self.active = hit
+        self.fired += len(fired)
+        return fired, value[fired]
+
+    # Window statistics of every window rule, from per-block sums
+    def _window_stats (self, times, v):
+        blocks = self._blocks
+        blocks.append((times[-1], len(v), v.sum(axis=0), (v * v).sum(axis=0), v.min(axis=0), v.max(axis=0)))
+        while blocks[0][0] < times[-1] - self._span.max():
+            blocks.popleft()
+        t_end = np.array([b[0] for b in blocks])
+        inside = t_end[:, None] >= times[-1] - self._span[None, :]        # blocks x rules
+        n = (np.array([b[1] for b in blocks])[:, None] * inside).sum(axis=0)
+        s = np.where(inside, np.array([b[2] for b in blocks]), 0.0).sum(axis=0)
+        ss = np.where(inside, np.array([b[3] for b in blocks]), 0.0).sum(axis=0)
+        mean = s / n
+        std = np.sqrt(np.maximum(ss / n - mean * mean, 0.0))
+        lo = np.where(inside, np.array([b[4] for b in blocks]), np.inf).min(axis=0)
+        hi = np.where(inside, np.array([b[5] for b in blocks]), -np.inf).max(axis=0)
+        return np.choose(self._stat, (mean, std, lo, hi))
+
+    # Human-readable condition of rule i
+    def condition (self, i):
+        r = self.specs[i]
+        parts = []
+        if 'rate_above' in r:
+            parts.append("|d/dt| > %g/s" % r['rate_above'])
+        else:
+            what = "%s over %g s" % (r.get('stat', 'mean'), r['window_s']) if 'window_s' in r else "value"
+            if 'above' in r:
+                parts.append("%s > %g" % (what, r['above']))
+            if 'below' in r:
+                parts.append("%s < %g" % (what, r['below']))
+        return " or ".join(parts)
+
+
+#==========================================================================
+# SINK
+#==========================================================================
+# Core loop sink running an AlarmEngine.  `errors` returns the adapter's
+# error count, `relay` is the RelayCycle for relay_off, `log_path` the
+# alarm log (CSV).  `stopped` is set by the stop action; pass
+# stopped.is_set as the core loop's stop().
+class AlarmSink:
+    def __init__ (self, engine, log_path=None, status=None, errors=None, relay=None,
+                  webhook=None, budget_ms=BUDGET_MS, depth=QUEUE_DEPTH):
+        self.engine   = engine
+        self.status   = status
+        self.errors   = errors
+        self.relay    = relay
+        self.webhook  = webhook
+        self.budget   = budget_ms / 1000.0
+        self.stopped  = threading.Event()
+        self.missed   = 0
+        self.overruns = 0
+        self.worst    = 0.0         # Slowest detection-to-action time (s)
+        self._error_count = errors() if errors is not None else 0
+        self._error_time  = None
+        self._notices = collections.deque()     # Status messages for the acquisition thread
+        self._queue  = queue.Queue(depth)
+        self._file   = open(log_path, 'w', newline='') if log_path else None
+        self._log    = csv.writer(self._file) if self._file else None
+        if self._log:
+            self._log.writerow(ALARM_FIELDS)
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def _error_rate (self, times):
+        if self.errors is None:
+            return 0.0
+        count, t = self.errors(), times[-1]
+        rate = 0.0
+        if self._error_time is not None and t > self._error_time:
+            rate = (count - self._error_count) / (t - self._error_time)
+        self._error_count, self._error_time = count, t
+        return rate
+
+    def write (self, times, values):
+        while self._notices:
+            self.status.message(self._notices.popleft())
+        values = np.column_stack((values, np.full(len(times), self._error_rate(times))))
+        fired, tripped = self.engine.evaluate(times, values)
+        if not len(fired):
+            return
+        detected = time.perf_counter()
+        delay = time.time() - times[-1]
+        for i, value in zip(fired.tolist(), tripped.tolist()):
+            actions = self.engine.actions[i]
+            if 'stop' in actions:
+                self.stopped.set()
+            if 'relay_off' in actions and self.relay is not None:
+                self.relay.halt()
+            try:
+                self._queue.put_nowait((i, value, times[-1], delay, detected))
+            except queue.Full:
+                self.missed += 1
+
+    # I/O actions, off the acquisition thread
+    def _work (self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            i, value, t, delay, detected = item
+            engine = self.engine
+            name, actions = engine.names[i], engine.actions[i]
+            row = [datetime.datetime.fromtimestamp(t), name, engine.specs[i]['channel'],
+                   engine.condition(i), value, round(delay * 1000, 1)]
+            if 'log' in actions:
+                if self.status is not None:
+                    self._notices.append("ALARM %s: %s = %g (%s)" % (name, row[2], value, row[3]))
+                if self._log:
+                    self._log.writerow(row)
+                    self._file.flush()
+            if 'webhook' in actions and self.webhook:
+                self._post(dict(zip(ALARM_FIELDS, [str(row[0])] + row[1:]), actions=list(actions)))
+            elapsed = time.perf_counter() - detected
+            self.worst = max(self.worst, elapsed)
+            if elapsed > self.budget:
+                self.overruns += 1
+
+    def _post (self, alarm):
+        import urllib.request
+        request = urllib.request.Request(self.webhook, json.dumps(alarm).encode(),
+                                         {'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=self.budget).close()
+        except OSError:
+            self.missed += 1
+
+    def close (self):
+        self._queue.put(None)
+        self._worker.join(max(1.0, 10 * self.budget))
+        if self._file:
+            self._file.close()
+        while self._notices:
+            self.status.message(self._notices.popleft())
+        if self.status is not None and self.engine.fired:
+            self.status.message("%d alarm(s), slowest action %.1f ms (budget %.0f ms), %d over budget, %d missed"
+                                % (self.engine.fired, self.worst * 1000, self.budget * 1000,
+                                   self.overruns, self.missed))
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+# Local stand-in for the alarm webhook: prints every alarm it receives
+def serve (port=WEBHOOK_PORT):
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler (BaseHTTPRequestHandler):
+        def do_POST (self):
+            alarm = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            print("%s  %s" % (datetime.datetime.now().isoformat(' ', 'milliseconds'), json.dumps(alarm)))
+            sys.stdout.flush()
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message (self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', port), Handler)
+    print("Alarm webhook stand-in on http://127.0.0.1:%d/alarm" % port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Alarm webhook stand-in")
+    parser.add_argument('command', choices=['serve'])
+    parser.add_argument('--port', type=int, default=WEBHOOK_PORT)
+    args = parser.parse_args(argv)
+    serve(args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+#==========================================================================
+# Cross-adapter time alignment
+#--------------------------------------------------------------------------
+# Pressure (Aardvark), WSEN (Binho) and force readings come from different
+# adapters at different, jittery rates.  To compare them sample by sample
+# every channel is resampled onto one uniform time grid.
+#
+# AdapterClock
+#   Host-clock bookkeeping per adapter feed.  None of the adapters has a
+#   clock of its own: sample times are taken on the host's monotonic
+#   clock (transports interpolate them across each burst, at the midpoint
+#   of every read, which already splits the round trip evenly).  The
+#   monotonic-to-wall offset is the host's, the same for every adapter;
+#   it is measured once per feed, bracketed by monotonic_ns reads (the
+#   tightest bracket of a few tries, as NTP does), and kept for the whole
+#   run so wall times never step: the monotonic time of a logged sample is
+#   its wall time minus offset_ns plus delay_ns, both in the session
+#   manifest (describe()).  The only per-adapter correction is the
+#   configured sensor delay ("delay_ms" in the adapter section, e.g. half
+#   a sensor update period).  The adapter latency (the fastest per-read
+#   transaction time seen recently) is tracked for the session manifest
+#   only: it is not split evenly enough to correct times with.
+#
+# Resampler
+#   Streams blocks from several sources onto a grid of `period` s kept in
+#   int64 ns.  Grid points are emitted once every live source has data
+#   past them.  Interpolation is linear and vectorized over grid points
+#   and channels.  Only the samples still needed are kept per source, and
+#   each source is capped at `max_rows`, so memory stays bounded even when
+#   one source stalls.  Points outside a source's data or inside a gap
+#   longer than `max_gap` s are NaN.
+#
+# AlignedSource
+#   A core loop source built on the Resampler, fed by live rigs (one
+#   reader thread per adapter) or by replayed recordings (pulled in time
+#   order).  See `python -m vbreathe align`.
+#==========================================================================
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+OFFSET_TRIES  = 16          # Bracketed reads per clock offset estimate
+LATENCY_BURSTS = 64         # Bursts over which the adapter latency is tracked
+MAX_GAP_S     = 0.5         # Longest gap interpolated across (s)
+MAX_ROWS      = 65536       # Rows buffered per source before the oldest are dropped
+
+
+#==========================================================================
+# CLOCKS
+#==========================================================================
+# Offset from time.monotonic_ns() to time.time_ns(), from the tightest of
+# `tries` bracketed reads.  Returns (offset_ns, uncertainty_ns).
+def clock_offset_ns (tries=OFFSET_TRIES):
+    monotonic_ns = time.monotonic_ns
+    time_ns = time.time_ns
+    best = None
+    for _ in range(tries):
+        a = monotonic_ns()
+        w = time_ns()
+        b = monotonic_ns()
+        if best is None or b - a < best[1]:
+            best = (w - (a + b) // 2, b - a)
+    return best[0], best[1] // 2
+
+
+# Host clock mapping and latency statistics of one adapter feed
+class AdapterClock:
+    def __init__ (self, name, delay_s=0.0, bursts=LATENCY_BURSTS):
+        self.name     = name
+        self.delay_ns = int(round(delay_s * 1e9))
+        self.offset_ns, self.uncertainty_ns = clock_offset_ns()
+        self.rows     = 0
+        self._reads   = collections.deque(maxlen=bursts)
+
+    # Per-read transaction time of the last burst (s), or None
+    def observe (self, read_time, rows=0):
+        if read_time:
+            self._reads.append(read_time)
+        self.rows += rows
+
+    # Fastest per-read transaction time over the recent bursts (s)
+    @property
+    def latency (self):
+        return min(self._reads) if self._reads else None
+
+    # How far the wall clock has moved from the monotonic clock since the
+    # offset was taken (NTP slew or steps), in ns
+    def drift_ns (self):
+        return clock_offset_ns()[0] - self.offset_ns
+
+    # Monotonic seconds to POSIX seconds, sensor delay removed
+    def to_wall (self, times):
+        return times + (self.offset_ns - self.delay_ns) * 1e-9
+
+    # For the session manifest
+    def describe (self):
+        latency = self.latency
+        return {'adapter': self.name, 'offset_ns': self.offset_ns, 'uncertainty_ns': self.uncertainty_ns,
+                'delay_ns': self.delay_ns, 'latency_us': None if latency is None else latency * 1e6,
+                'drift_ns': self.drift_ns(), 'rows': self.rows}
+
+
+#==========================================================================
+# RESAMPLER
+#==========================================================================
+# Linear interpolation of (t, v) at `grid` (all ns), NaN outside the data
+# and across gaps longer than `max_gap`
+def _interpolate (t, v, grid, max_gap):
+    out = np.full((len(grid), v.shape[1]), np.nan)
+    if len(t) == 0:
+        return out
+    if len(t) == 1:
+        out[grid == t[0]] = v[0]
+        return out
+    i1 = np.clip(np.searchsorted(t, grid, side='right'), 1, len(t) - 1)
+    i0 = i1 - 1
+    dt = t[i1] - t[i0]
+    w = (grid - t[i0]) / np.where(dt == 0, 1, dt)
+    out = v[i0] + w[:, None] * (v[i1] - v[i0])
+    out[(grid < t[0]) | (grid > t[-1]) | (dt > max_gap)] = np.nan
+    return out
+
+
+class Resampler:
+    def __init__ (self, widths, period_s, max_gap_s=MAX_GAP_S, max_rows=MAX_ROWS):
+        self.widths    = list(widths)
+        self.period_ns = int(round(period_s * 1e9))
+        self.max_gap   = int(round(max_gap_s * 1e9))
+        self.max_rows  = max_rows
+        self.dropped   = 0
+        self._t = [np.empty(0, dtype=np.int64) for _ in self.widths]
+        self._v = [np.empty((0, w)) for w in self.widths]
+        self._done = [False] * len(self.widths)
+        self._next = None
+
+    def push (self, k, times, values):
+        t = np.round(np.asarray(times) * 1e9).astype(np.int64)
+        self._t[k] = np.concatenate((self._t[k], t))
+        self._v[k] = np.concatenate((self._v[k], np.asarray(values, dtype=np.float64).reshape(len(t), -1)))
+        excess = len(self._t[k]) - self.max_rows
+        if excess > 0:
+            self._t[k] = self._t[k][excess:]
+            self._v[k] = self._v[k][excess:]
+            self.dropped += excess
+
+    # No more data from source k: the grid no longer waits for it
+    def finish (self, k):
+        self._done[k] = True
+
+    @property
+    def finished (self):
+        return all(self._done)
+
+    # The live source with the least data, to be read next
+    def behind (self):
+        live = [k for k, done in enumerate(self._done) if not done]
+        return min(live, key=lambda k: self._t[k][-1] if len(self._t[k]) else -1) if live else None
+
+    # Last time (ns) up to which every live source has data, or None
+    def watermark (self):
+        live = [t[-1] for t, done in zip(self._t, self._done) if not done and len(t)]
+        if any(not done and not len(t) for t, done in zip(self._t, self._done)):
+            return None
+        if live:
+            return min(live)
+        ends = [t[-1] for t in self._t if len(t)]
+        return max(ends) if ends else None
+
+    # Grid points now covered by every source: (POSIX s, values N x sum(widths))
+    def pop (self):
+        empty = np.empty(0), np.empty((0, sum(self.widths)))
+        end = self.watermark()
+        if end is None:
+            return empty
+        p = self.period_ns
+        if self._next is None:
+            # Start at the first grid point where every source has begun
+            first = max(t[0] for t in self._t if len(t))
+            self._next = -(-first // p) * p
+        if end < self._next:
+            return empty
+
+        n = (end - self._next) // p + 1
+        grid = self._next + np.arange(n, dtype=np.int64) * p
+        out = np.hstack([_interpolate(t, v, grid, self.max_gap) for t, v in zip(self._t, self._v)])
+        self._next += n * p
+
+        # Keep from the last sample before the next grid point on
+        for k, t in enumerate(self._t):
+            keep = max(np.searchsorted(t, self._next, side='right') - 1, 0)
+            if keep:
+                self._t[k] = t[keep:]
+                self._v[k] = self._v[k][keep:]
+        return grid * 1e-9, out
+
+
+#==========================================================================
+# SOURCE
+#==========================================================================
+# `feeds` are core loop sources (callables returning (times, values) or
+# None), `widths` their column counts.  With threaded=True every feed runs
+# in its own reader thread (live adapters); otherwise the feed furthest
+# behind is pulled next (replayed recordings).
+class AlignedSource:
+    def __init__ (self, feeds, widths, period_s, threaded=False, max_gap_s=MAX_GAP_S, max_rows=MAX_ROWS):
+        self.feeds     = list(feeds)
+        self.resampler = Resampler(widths, period_s, max_gap_s, max_rows)
+        self.threaded  = threaded
+        self._queue    = queue.Queue()
+        self._stop     = threading.Event()
+        self._threads  = []
+        if threaded:
+            for k, feed in enumerate(self.feeds):
+                thread = threading.Thread(target=self._read_loop, args=(k, feed), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _read_loop (self, k, feed):
+        try:
+            while not self._stop.is_set():
+                block = feed()
+                if block is None:
+                    break
+                self._queue.put((k, block))
+        finally:
+            self._queue.put((k, None))
+
+    def _take (self, k, block):
+        if block is None:
+            self.resampler.finish(k)
+        elif len(block[0]):
+            self.resampler.push(k, *block)
+
+    def __call__ (self):
+        resampler = self.resampler
+        if self.threaded:
+            try:
+                self._take(*self._queue.get(timeout=0.05))
+                while True:
+                    self._take(*self._queue.get_nowait())
+            except queue.Empty:
+                pass
+        elif not resampler.finished:
+            k = resampler.behind()
+            self._take(k, self.feeds[k]())
+
+        times, values = resampler.pop()
+        if not len(times) and resampler.finished:
+            return None
+        return times, values
+
+    # Blocks still held after the loop stops: queued reads and the grid
+    # points up to the end of the data
+    def drain (self):
+        self.close()
+        while True:
+            try:
+                self._take(*self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for k in range(len(self.feeds)):
+            self.resampler.finish(k)
+        times, values = self.resampler.pop()
+        if len(times):
+            yield times, values
+
+    def close (self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(1.0)
@@ -0,0 +1,276 @@
+#==========================================================================
+# Compressed sample archive
+#--------------------------------------------------------------------------
+# Compact long-term storage for raw sensor counts.  Samples are cut into
+# fixed-size chunks; in each chunk the nanosecond timestamps and the
+# integer counts are delta encoded along time (small, repetitive numbers)
+# and the result is compressed with zlib or lzma.  A sidecar chunk index
+# holds the time span and file offset of every chunk, so a range read only
+# decompresses the chunks it touches.
+#
+# Files:
+#   <name>.vba        magic 'VBA1', uint32 length, JSON metadata, chunks
+#   <name>.vba.idx    CHUNK_DTYPE records, one per chunk
+#
+# Compression runs in a background thread so the acquisition loop only
+# copies its block into a buffer.
+#
+# Usage: python -m vbreathe.archive pack WSEN_readings_x.csv 1 3
+#        python -m vbreathe.archive info WSEN_readings_x.csv.vba
+#==========================================================================
+import argparse
+import json
+import lzma
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+
+import numpy as np
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+MAGIC       = b'VBA1'
+CHUNK_ROWS  = 4096
+CODECS      = {
+    'zlib': (lambda b: zlib.compress(b, 6), zlib.decompress),
+    'lzma': (lambda b: lzma.compress(b, preset=6), lzma.decompress),
+    'none': (bytes, bytes),
+}
+WRITE_QUEUE = 64           # Chunks waiting for compression before append() blocks
+
+# Chunk index record: first and last timestamp (ns), file offset and size
+# of the compressed chunk, and the number of rows in it
+CHUNK_DTYPE = np.dtype([('t_first', '<i8'), ('t_last', '<i8'), ('offset', '<i8'),
+                        ('size', '<i8'), ('rows', '<i8')])
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# Seconds (float) to integer nanoseconds
+def to_ns (times):
+    return np.round(np.asarray(times, dtype=np.float64) * 1e9).astype(np.int64)
+
+
+# Chunk payload: timestamp deltas followed by the per-channel count deltas,
+# channel by channel so that similar numbers sit next to each other
+def encode_chunk (t_ns, counts):
+    dt = np.diff(t_ns, prepend=np.int64(0))
+    dc = np.diff(counts, axis=0, prepend=np.zeros((1, counts.shape[1]), dtype=counts.dtype))
+    return dt.astype('<i8').tobytes() + np.ascontiguousarray(dc.T).tobytes()
+
+
+def decode_chunk (payload, rows, dtype, width):
+    t_ns = np.cumsum(np.frombuffer(payload, dtype='<i8', count=rows))
+    dc = np.frombuffer(payload, dtype=dtype, offset=rows * 8).reshape(width, rows).T
+    return t_ns, np.cumsum(dc, axis=0, dtype=dtype)
+
+
+#==========================================================================
+# ARCHIVE WRITER
+#==========================================================================
+class ArchiveWriter:
+    def __init__ (self, path, channels, dtype='<i4', codec='zlib', chunk_rows=CHUNK_ROWS, meta=None):
+        if codec not in CODECS:
+            raise ValueError("unknown codec %r" % codec)
+        self.path       = path
+        self.channels   = list(channels)
+        self.dtype      = np.dtype(dtype)
+        self.codec      = codec
+        self.chunk_rows = chunk_rows
+        self.rows       = 0
+        self.chunks     = 0
+        if self.dtype.kind not in 'iu':
+            raise ValueError("the archive stores integer counts, not %s" % self.dtype)
+
+        header = dict(meta or {})
+        header.update({'channels': self.channels, 'dtype': self.dtype.str,
+                       'codec': codec, 'chunk_rows': chunk_rows})
+        header = json.dumps(header).encode()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._index = open(path + '.idx', 'wb')
+
+        width = len(self.channels)
+        self._t = np.empty(chunk_rows, dtype=np.int64)
+        self._v = np.empty((chunk_rows, width), dtype=self.dtype)
+        self._fill = 0
+
+        self._queue = queue.Queue(WRITE_QUEUE)
+        self._error = None
+        self._thread = threading.Thread(target=self._compress_loop, daemon=True)
+        self._thread.start()
+
+    # Append a block: `times` in seconds, `counts` (N x channels) integers
+    def append (self, times, counts):
+        if self._error is not None:
+            raise self._error
+        t_ns = to_ns(times)
+        counts = np.asarray(counts).reshape(len(t_ns), -1)
+        done = 0
+        while done < len(t_ns):
+            take = min(len(t_ns) - done, self.chunk_rows - self._fill)
+            self._t[self._fill:self._fill + take] = t_ns[done:done + take]
+            self._v[self._fill:self._fill + take] = counts[done:done + take]
+            self._fill += take
+            done += take
+            if self._fill == self.chunk_rows:
+                self._submit()
+        self.rows += len(t_ns)
+
+    def _submit (self):
+        if self._fill:
+            self._queue.put((self._t[:self._fill].copy(), self._v[:self._fill].copy()))
+            self._fill = 0
+
+    def _compress_loop (self):
+        compress = CODECS[self.codec][0]
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                t_ns, counts = item
+                payload = compress(encode_chunk(t_ns, counts))
+                offset = self._file.tell()
+                self._file.write(payload)
+                record = np.array([(t_ns[0], t_ns[-1], offset, len(payload), len(t_ns))], dtype=CHUNK_DTYPE)
+                self._file.flush()
+                self._index.write(record.tobytes())
+                self._index.flush()
+                self.chunks += 1
+            except Exception as error:
+                self._error = error
+
+    # Push the partial chunk out; a new chunk starts with the next append
+    def flush (self):
+        self._submit()
+
+    def close (self):
+        if self._file is None:
+            return
+        self._submit()
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        self._index.close()
+        self._file = None
+        if self._error is not None:
+            raise self._error
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+#==========================================================================
+# ARCHIVE READER
+#==========================================================================
+class ArchiveReader:
+    def __init__ (self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        magic, length = struct.unpack('<4sI', self._file.read(8))
+        if magic != MAGIC:
+            raise ValueError("%s is not a VBreathe archive" % path)
+        self.meta     = json.loads(self._file.read(length).decode())
+        self.channels = self.meta['channels']
+        self.dtype    = np.dtype(self.meta['dtype'])
+        self._decompress = CODECS[self.meta['codec']][1]
+
+        # A crash can leave a partial record at the end of the index
+        index_path = path + '.idx'
+        size = os.path.getsize(index_path) // CHUNK_DTYPE.itemsize if os.path.exists(index_path) else 0
+        self.index = np.fromfile(index_path, dtype=CHUNK_DTYPE, count=size) if size else np.zeros(0, CHUNK_DTYPE)
+
+    @property
+    def rows (self):
+        return int(self.index['rows'].sum())
+
+    # Time span of the archive in seconds
+    @property
+    def span (self):
+        if not len(self.index):
+            return None
+        return self.index['t_first'][0] / 1e9, self.index['t_last'][-1] / 1e9
+
+    def chunk (self, i):
+        record = self.index[i]
+        self._file.seek(int(record['offset']))
+        payload = self._decompress(self._file.read(int(record['size'])))
+        return decode_chunk(payload, int(record['rows']), self.dtype, len(self.channels))
+
+    # Yield (times in seconds, counts) per touched chunk for [t0, t1)
+    def iter_range (self, t0=None, t1=None):
+        first = 0 if t0 is None else int(np.searchsorted(self.index['t_last'], to_ns(t0), side='left'))
+        last = len(self.index) if t1 is None else int(np.searchsorted(self.index['t_first'], to_ns(t1), side='left'))
+        for i in range(first, last):
+            t_ns, counts = self.chunk(i)
+            keep = slice(None)
+            if t0 is not None or t1 is not None:
+                lo = 0 if t0 is None else np.searchsorted(t_ns, to_ns(t0), side='left')
+                hi = len(t_ns) if t1 is None else np.searchsorted(t_ns, to_ns(t1), side='left')
+                keep = slice(lo, hi)
+            if len(t_ns[keep]):
+                yield t_ns[keep] / 1e9, counts[keep]
+
+    # All rows in [t0, t1) as one (times, counts) pair
+    def query (self, t0=None, t1=None):
+        parts = list(self.iter_range(t0, t1))
+        if not parts:
+            return np.empty(0), np.empty((0, len(self.channels)), dtype=self.dtype)
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+
+    def close (self):
+        self._file.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Pack session CSV logs into compressed archives")
+    sub = parser.add_subparsers(dest='command', required=True)
+    pack = sub.add_parser('pack', help="archive integer columns of a session CSV")
+    pack.add_argument('csv')
+    pack.add_argument('columns', type=int, nargs='+', help="indexes of the raw count columns")
+    pack.add_argument('--codec', choices=sorted(CODECS), default='zlib')
+    info = sub.add_parser('info', help="describe an archive")
+    info.add_argument('archive')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        from .csvlog import read_csv_blocks
+        with open(args.csv, newline='') as file:
+            header = file.readline().rstrip('\r\n').split(',')
+        names = [header[c] if c < len(header) else "ch%d" % c for c in args.columns]
+        out = args.csv + '.vba'
+        with ArchiveWriter(out, names, codec=args.codec, meta={'source': os.path.basename(args.csv)}) as archive:
+            for times, values in read_csv_blocks(args.csv, args.columns):
+                archive.append(times, np.round(values).astype(np.int32))
+        ratio = os.path.getsize(args.csv) / max(1, os.path.getsize(out))
+        print("%s: %d rows in %d chunks, %.1fx smaller than the CSV" % (out, archive.rows, archive.chunks, ratio))
+    else:
+        with ArchiveReader(args.archive) as archive:
+            print("Channels: %s" % ", ".join(archive.channels))
+            print("Codec %s, %d rows in %d chunks" % (archive.meta['codec'], archive.rows, len(archive.index)))
+            if archive.span:
+                print("Span %.3f s" % (archive.span[1] - archive.span[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+#==========================================================================
+# Benchmarks
+#--------------------------------------------------------------------------
+# Latency and throughput of the processing stages on synthetic data, so
+# changes to the hot path can be compared without the hardware attached.
+#
+# Usage: python -m vbreathe.benchmark [RIG_CONFIG]
+#        python -m vbreathe benchmark [--rig RIG_CONFIG] [--aardvark PORT | --aardvark-overhead]
+#==========================================================================
+import contextlib
+import sys
+import time
+
+import numpy as np
+
+from . import emulator
+from . import filters
+from . import transport
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+BLOCK_SIZES = (1, 16, 256, 4096)
+DURATION_S  = 0.2     # Time spent per measurement
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# Call fn(block) repeatedly for about `duration` seconds.  Returns the
+# median latency per call (s) and the throughput in samples per second.
+def measure (fn, block, duration=DURATION_S):
+    times = []
+    end = time.perf_counter() + duration
+    while True:
+        start = time.perf_counter()
+        fn(block)
+        stop = time.perf_counter()
+        times.append(stop - start)
+        if stop >= end and len(times) >= 5:
+            break
+    latency = float(np.median(times))
+    return latency, len(block) / latency
+
+
+def report (name, rows, out=sys.stdout):
+    out.write("%s\n" % name)
+    out.write("  %8s %14s %16s\n" % ("block", "latency (us)", "throughput (S/s)"))
+    for size, latency, rate in rows:
+        out.write("  %8d %14.1f %16.0f\n" % (size, latency * 1e6, rate))
+    out.write("\n")
+
+
+def bench_filters (fs=200.0, channels=1, sizes=BLOCK_SIZES, out=sys.stdout):
+    chains = [
+        ("low-pass 10 Hz", lambda: filters.LowPass(10.0, fs)),
+        ("notch 50 Hz", lambda: filters.Notch(50.0, fs)),
+        ("moving average 8", lambda: filters.MovingAverage(8)),
+        ("median despike 5", lambda: filters.MedianDespike(5)),
+        ("despike + notch + low-pass", lambda: filters.FilterChain(
+            filters.MedianDespike(5), filters.Notch(50.0, fs), filters.LowPass(10.0, fs))),
+    ]
+    backend = "scipy.signal.lfilter" if filters._lfilter is not None else "NumPy fallback"
+    out.write("Filter bank (%s, %d channel(s), fs = %.0f Hz)\n\n" % (backend, channels, fs))
+    for name, make in chains:
+        f = make()
+        rows = []
+        for size in sizes:
+            block = np.random.randn(size, channels) if channels > 1 else np.random.randn(size)
+            latency, rate = measure(f.process, block)
+            rows.append((size, latency, rate))
+        report(name, rows, out)
+
+
+# Transaction rate against the software sensor stand-in, with and without
+# a modelled adapter round trip
+def bench_emulated_reads (latencies=(0.0, 0.001), reads=2000, out=sys.stdout):
+    frames = emulator.encode_honeywell(emulator.breathing_waveform())
+    out.write("Emulated sensor reads (%d reads)\n" % reads)
+    out.write("  %12s %14s %14s\n" % ("latency (ms)", "per read (us)", "reads/s"))
+    for latency in latencies:
+        bus = emulator.SoftwareBus({0x28: emulator.SoftwareSensor(frames)}, latency=latency)
+        start = time.perf_counter()
+        for _ in range(reads):
+            bus.read(0x28, 4)
+        elapsed = time.perf_counter() - start
+        out.write("  %12.3f %14.1f %14.0f\n" % (latency * 1e3, elapsed / reads * 1e6, reads / elapsed))
+    out.write("\n")
+
+
+# Burst reads over the software bus, with a modelled 1 ms adapter round
+# trip.  "per read" pays the round trip on every read, as the Aardvark and
+# the binho library do, so it is what bursts give on real adapters (less
+# Python per read, no bus time saved).  "batched" answers a whole burst in
+# one round trip, which only the emulator can do.
+def bench_burst_reads (sizes=(1, 16, 64, 256), latency=0.001, reads=2048, out=sys.stdout):
+    frames = emulator.encode_honeywell(emulator.breathing_waveform())
+    out.write("Burst reads (%.1f ms round trip, %d reads)\n" % (latency * 1e3, reads))
+    out.write("  %8s %24s %28s\n" % ("burst", "reads/s, per read (HW)", "reads/s, batched (emu only)"))
+    for size in sizes:
+        rates = []
+        for batched in (False, True):
+            bus = emulator.SoftwareBus({0x28: emulator.SoftwareSensor(frames)}, latency=latency)
+            link = transport.SoftwareTransport(bus, batched=batched)
+            start = time.perf_counter()
+            for _ in range(reads // size):
+                link.read_burst(0x28, 4, size)
+            rates.append((reads // size) * size / (time.perf_counter() - start))
+        out.write("  %8d %24.0f %28.0f\n" % (size, rates[0], rates[1]))
+    out.write("\n")
+
+
+# Stand-in for the aardvark extension whose I2C read returns at once, so
+# the Python cost of a call can be measured with no adapter and no bus
+# time.  py_version reports the versions aardvark_py requires.
+class _NullAardvarkApi:
+    @staticmethod
+    def py_version ():
+        return (0x0532 << 16) | 0x050a
+
+    @staticmethod
+    def py_aa_i2c_read (aardvark, slave_addr, flags, num_bytes, data_in):
+        return num_bytes
+
+    @staticmethod
+    def py_aa_i2c_write (aardvark, slave_addr, flags, num_bytes, data_out):
+        return num_bytes
+
+    @staticmethod
+    def py_aa_i2c_write_read (aardvark, slave_addr, flags, out_bytes, data_out, in_bytes, data_in):
+        return 0, in_bytes, out_bytes
+
+
+# aardvark_py, loaded over the null extension when the real one is missing
+# and `null` is set.  The stub is only in sys.modules while the block
+# runs; afterwards both module entries are put back as they were.
+@contextlib.contextmanager
+def _aardvark_py (null=False):
+    try:
+        import aardvark_py
+    except (ImportError, SystemExit):
+        if not null:
+            raise
+    else:
+        yield aardvark_py
+        return
+    saved = {name: sys.modules.get(name) for name in ('aardvark', 'aardvark_py')}
+    sys.modules['aardvark'] = _NullAardvarkApi
+    try:
+        import aardvark_py
+        yield aardvark_py
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+# Generic aardvark_py wrappers against the AardvarkI2cSession fast path:
+# reads per second and mean time per read for the same `length`-byte read
+# of the sensor at `addr`.  On a real adapter (port) the bus time
+# dominates; with null=True every read goes to _NullAardvarkApi instead,
+# which leaves only the per-call wrapper overhead, on any machine.
+def bench_aardvark_session (port=0, addr=0x28, length=4, reads=2000, out=sys.stdout, null=False):
+    with _aardvark_py(null) as aa:
+        if null:
+            real, aa.api = aa.api, _NullAardvarkApi
+            handle = 1
+        else:
+            handle = aa.aa_open(port)
+            if handle <= 0:
+                out.write("Unable to open Aardvark device on port %d (error %d)\n\n" % (port, handle))
+                return
+        try:
+            if not null:
+                aa.aa_configure(handle, aa.AA_CONFIG_GPIO_I2C)
+                aa.aa_i2c_pullup(handle, aa.AA_I2C_PULLUP_BOTH)
+                aa.aa_gpio_set(handle, aa.AA_GPIO_SCK)
+            buf = aa.array_u08(length)
+            session = aa.AardvarkI2cSession(handle, addr, length)
+            frames = np.empty((reads, length), dtype=np.uint8)
+            view = memoryview(frames).cast('B')
+            cases = [
+                ("aa_i2c_read, new array", lambda: [aa.aa_i2c_read(handle, addr, aa.AA_I2C_NO_FLAGS, length) for _ in range(reads)]),
+                ("aa_i2c_read, reused array", lambda: [aa.aa_i2c_read(handle, addr, aa.AA_I2C_NO_FLAGS, buf) for _ in range(reads)]),
+                ("session.read", lambda: [session.read() for _ in range(reads)]),
+                ("session.read_many", lambda: session.read_many(reads, view)),
+            ]
+            out.write("Aardvark %s, %d-byte reads from 0x%02x\n"
+                      % ("no-op read (wrapper overhead only)" if null else "port %d" % port, length, addr))
+            out.write("  %-28s %12s %14s\n" % ("call", "reads/s", "us per read"))
+            for name, fn in cases:
+                start = time.perf_counter()
+                fn()
+                elapsed = time.perf_counter() - start
+                out.write("  %-28s %12.0f %14.2f\n" % (name, reads / elapsed, 1e6 * elapsed / reads))
+            out.write("\n")
+        finally:
+            if null:
+                aa.api = real
+            else:
+                aa.aa_close(handle)
+
+
+# Rows per second through the core loop for a rig (its stages, the
+# sample bus and the status line; no files), on the software adapter
+def bench_pipeline (config, duration=2.0, out=sys.stdout):
+    import io
+    from . import core
+    from .rig import compile_rig
+    from .ringbuffer import SampleRing
+    from .status import StatusLine
+
+    rig = compile_rig(config)
+    rig.adapter = dict(rig.adapter, type='software')
+    link, close = rig.open()
+    ring = SampleRing(capacity=262144, width=rig.width, channels=rig.channels)
+    sinks = [core.BusSink(ring, time.time()), core.StatusSink(StatusLine(stream=io.StringIO()), rig.name, rig.channels)]
+    pipeline = core.Pipeline(rig.stages, sinks)
+    start = time.perf_counter()
+    try:
+        rows = core.acquire(rig.source(link), pipeline, duration)
+    finally:
+        pipeline.close()
+        close()
+    elapsed = time.perf_counter() - start
+    out.write("Core loop, rig %s on the software adapter\n" % rig.name)
+    out.write("  %d rows in %.2f s: %.0f rows/s\n\n" % (rows, elapsed, rows / elapsed))
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+def main (rig=None, aardvark_port=None, addr=0x28, aardvark_overhead=False):
+    bench_filters()
+    bench_emulated_reads()
+    bench_burst_reads()
+    if rig:
+        bench_pipeline(rig)
+    if aardvark_overhead:
+        bench_aardvark_session(addr=addr, reads=200000, null=True)
+    if aardvark_port is not None:
+        bench_aardvark_session(aardvark_port, addr)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,199 @@
+#==========================================================================
+# Streaming breath detection
+#--------------------------------------------------------------------------
+# Online segmentation of a differential pressure stream into breaths.
+# Each block of samples is smoothed, converted to flow with the
+# flow-pressure relation of the flow element, and split into inspiration
+# and expiration phases with a hysteresis threshold on the flow.  A breath
+# is an inspiration followed by an expiration and is reported when the next
+# inspiration starts.
+#
+# Only a few scalars are carried between blocks (filter tail, current phase
+# accumulators, running summary), so memory stays flat however long the
+# recording runs.
+#==========================================================================
+import datetime
+import math
+
+import numpy as np
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+FLOW_COEFFICIENT = 1.0     # Flow = K * sign(dp) * |dp|**FLOW_EXPONENT
+FLOW_EXPONENT    = 0.5     # 0.5 for an orifice/venturi, 1.0 for a laminar pneumotach
+HYSTERESIS       = 0.05    # Flow threshold for a phase change (flow units)
+SMOOTH_SAMPLES   = 5       # Length of the moving-average pre-filter
+
+INSPIRATION =  1
+EXPIRATION  = -1
+
+BREATH_FIELDS = ['start', 'duration (s)', 'inspiration (s)', 'expiration (s)',
+                 'peak inspiratory flow', 'peak expiratory flow',
+                 'inspired volume', 'expired volume']
+
+
+#==========================================================================
+# BREATH RECORD
+#==========================================================================
+class Breath:
+    __slots__ = ('start', 't_insp', 't_exp', 'peak_insp', 'peak_exp', 'v_insp', 'v_exp')
+
+    def __init__ (self, start, t_insp, t_exp, peak_insp, peak_exp, v_insp, v_exp):
+        self.start     = start
+        self.t_insp    = t_insp
+        self.t_exp     = t_exp
+        self.peak_insp = peak_insp
+        self.peak_exp  = peak_exp
+        self.v_insp    = v_insp
+        self.v_exp     = v_exp
+
+    @property
+    def duration (self):
+        return self.t_insp + self.t_exp
+
+    # Row matching BREATH_FIELDS, timestamped like the sensor logs
+    def row (self):
+        return [datetime.datetime.fromtimestamp(self.start)] + \
+               [float(x) for x in (self.duration, self.t_insp, self.t_exp,
+                                   self.peak_insp, self.peak_exp, self.v_insp, self.v_exp)]
+
+
+#==========================================================================
+# RUNNING SUMMARY
+#==========================================================================
+# Count, mean and standard deviation of the per-breath metrics using
+# Welford's update, so the summary of a 24 h run costs constant memory.
+class BreathSummary:
+    KEYS = ('duration', 't_insp', 't_exp', 'peak_insp', 'peak_exp', 'v_insp', 'v_exp')
+
+    def __init__ (self):
+        self.count = 0
+        self._mean = dict.fromkeys(self.KEYS, 0.0)
+        self._m2   = dict.fromkeys(self.KEYS, 0.0)
+
+    def add (self, breath):
+        self.count += 1
+        for key in self.KEYS:
+            x = getattr(breath, key)
+            delta = x - self._mean[key]
+            self._mean[key] += delta / self.count
+            self._m2[key] += delta * (x - self._mean[key])
+
+    def mean (self, key):
+        return self._mean[key]
+
+    def std (self, key):
+        return math.sqrt(self._m2[key] / self.count) if self.count else 0.0
+
+    # Breaths per minute from the mean breath duration
+    @property
+    def rate (self):
+        d = self._mean['duration']
+        return 60.0 / d if d > 0 else 0.0
+
+
+#==========================================================================
+# DETECTOR
+#==========================================================================
+class BreathDetector:
+    def __init__ (self, k_flow=FLOW_COEFFICIENT, exponent=FLOW_EXPONENT,
+                  hysteresis=HYSTERESIS, smooth=SMOOTH_SAMPLES, invert=False):
+        self.k_flow     = -k_flow if invert else k_flow
+        self.exponent   = exponent
+        self.hysteresis = hysteresis
+        self.smooth     = max(1, int(smooth))
+        self.summary    = BreathSummary()
+
+        self._tail   = np.empty(0)   # Last smooth-1 raw samples for the moving average
+        self._prev_t = None          # Last sample time and flow for the trapezoid rule
+        self._prev_f = 0.0
+        self._state  = 0             # Current phase, 0 until the first threshold crossing
+
+        # Current phase accumulators
+        self._phase_start = None
+        self._phase_vol   = 0.0
+        self._phase_peak  = 0.0
+
+        # Inspiration waiting for its expiration: (start, duration, peak, volume)
+        self._insp = None
+
+    # Flow from (smoothed) differential pressure
+    def flow (self, dp):
+        return self.k_flow * np.sign(dp) * np.abs(dp) ** self.exponent
+
+    # Feed one block of samples.  Returns the breaths completed in it.
+    def process (self, times, dp):
+        times = np.asarray(times, dtype=np.float64)
+        dp = np.asarray(dp, dtype=np.float64)
+        n = len(times)
+        if n == 0:
+            return []
+
+        # Moving average carried across block boundaries
+        x = np.concatenate((self._tail, dp))
+        if len(x) >= self.smooth:
+            c = np.cumsum(np.concatenate(([0.0], x)))
+            smoothed = (c[self.smooth:] - c[:-self.smooth]) / self.smooth
+            smoothed = np.concatenate((np.full(n - len(smoothed), smoothed[0]), smoothed)) if len(smoothed) < n else smoothed[-n:]
+        else:
+            smoothed = np.full(n, x.mean())
+        self._tail = x[len(x) - (self.smooth - 1):] if self.smooth > 1 else np.empty(0)
+
+        f = self.flow(smoothed)
+
+        # Hysteresis: samples beyond the threshold set the phase, samples in
+        # the dead band keep the previous one (forward fill)
+        marks = np.where(f > self.hysteresis, INSPIRATION, np.where(f < -self.hysteresis, EXPIRATION, 0))
+        idx = np.where(marks != 0, np.arange(n), -1)
+        np.maximum.accumulate(idx, out=idx)
+        state = np.where(idx >= 0, marks[np.maximum(idx, 0)], self._state)
+
+        # Trapezoidal volume increment of each sample
+        t_prev = np.concatenate(([self._prev_t if self._prev_t is not None else times[0]], times[:-1]))
+        f_prev = np.concatenate(([self._prev_f], f[:-1]))
+        dv = 0.5 * (f + f_prev) * (times - t_prev)
+        self._prev_t = times[-1]
+        self._prev_f = f[-1]
+
+        # Split the block into runs of constant phase
+        changes = np.flatnonzero(np.diff(np.concatenate(([self._state], state))))
+        bounds = np.concatenate(([0], changes, [n]))
+        vol = np.add.reduceat(dv, bounds[:-1])
+        peak_hi = np.maximum.reduceat(f, bounds[:-1])
+        peak_lo = np.minimum.reduceat(f, bounds[:-1])
+
+        breaths = []
+        for k in range(len(bounds) - 1):
+            lo = bounds[k]
+            if lo == bounds[k + 1]:
+                continue
+            if k > 0:
+                self._end_phase(times[lo], breaths)
+                self._state = int(state[lo])
+                self._phase_start = times[lo]
+                self._phase_vol = 0.0
+                self._phase_peak = 0.0
+            self._phase_vol += vol[k]
+            if self._state == INSPIRATION:
+                self._phase_peak = max(self._phase_peak, peak_hi[k])
+            elif self._state == EXPIRATION:
+                self._phase_peak = min(self._phase_peak, peak_lo[k])
+
+        for breath in breaths:
+            self.summary.add(breath)
+        return breaths
+
+    # Close the current phase at time `t`
+    def _end_phase (self, t, breaths):
+        if self._state == 0 or self._phase_start is None:
+            return
+        phase = (self._phase_start, t - self._phase_start, self._phase_peak, self._phase_vol)
+        if self._state == INSPIRATION:
+            # A new inspiration after a full cycle completes the breath
+            self._insp = phase
+        elif self._insp is not None:
+            insp, exp = self._insp, phase
+            breaths.append(Breath(insp[0], insp[1], exp[1], insp[2], -exp[2], insp[3], -exp[3]))
+            self._insp = None
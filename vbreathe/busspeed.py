@@ -0,0 +1,157 @@
+#==========================================================================
+# I2C bus characterisation
+#--------------------------------------------------------------------------
+# Sweeps the adapter bitrate, measures the error rate and the achieved
+# transaction rate for a sensor at each setting, and stores the fastest
+# reliable bitrate in the device profile (see vbreathe.profile), where the
+# sensor scripts pick it up at connect time.
+#
+# Usage:
+#   python -m vbreathe.busspeed aardvark --port 0 --addr 0x28
+#   python -m vbreathe.busspeed aardvark --port 0 --addr 0x55 --command 3624 --length 3 --crc
+#   python -m vbreathe.busspeed binho --addr 0x28
+#==========================================================================
+import argparse
+import sys
+import time
+
+from . import profile
+from .emulator import crc8
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+AARDVARK_KHZ = (100, 200, 400, 800)           # Aardvark master range is 1-800 kHz
+BINHO_KHZ    = (100, 400, 1000, 3400)
+READS        = 500                            # Transactions per setting
+MAX_ERROR_RATE = 0.0                          # Errors tolerated for a "reliable" setting
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# Check a Sensirion style frame: every 2 data bytes are followed by a CRC
+def sensirion_crc_ok (data):
+    for i in range(0, len(data) - 2, 3):
+        if crc8(data[i:i + 2]) != data[i + 2]:
+            return False
+    return True
+
+
+# Run `reads` transactions at the current bitrate.  `command` is written
+# before each read (with `delay` seconds for the conversion) for sensors
+# that need a trigger.  Returns (error_rate, transactions per second).
+def measure (link, addr, length, reads=READS, command=None, delay=0.0, check=None):
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(reads):
+        if command is not None:
+            if link.write(addr, command) != len(command):
+                errors += 1
+                continue
+            if delay:
+                time.sleep(delay)
+        data = link.read(addr, length)
+        if len(data) != length or (check is not None and not check(data)):
+            errors += 1
+    elapsed = time.perf_counter() - start
+    return errors / reads, reads / elapsed
+
+
+# Sweep `bitrates` (kHz) and return one result dict per setting
+def sweep (link, addr, length, bitrates, reads=READS, command=None, delay=0.0, check=None, out=sys.stdout):
+    results = []
+    out.write("  %10s %10s %12s %14s\n" % ("requested", "actual", "error rate", "transactions/s"))
+    for khz in bitrates:
+        actual = link.set_bitrate(khz)
+        error_rate, rate = measure(link, addr, length, reads, command, delay, check)
+        results.append({'requested_khz': khz, 'actual_khz': actual,
+                        'error_rate': error_rate, 'rate': rate})
+        out.write("  %10d %10d %12.4f %14.0f\n" % (khz, actual, error_rate, rate))
+    return results
+
+
+# Fastest bitrate whose error rate is within `max_error_rate`, or None
+def fastest_reliable (results, max_error_rate=MAX_ERROR_RATE):
+    good = [r for r in results if r['error_rate'] <= max_error_rate]
+    if not good:
+        return None
+    return max(good, key=lambda r: (r['actual_khz'], r['rate']))
+
+
+# Sweep one sensor and store the result in the adapter's profile.  The
+# adapter-wide bitrate is the slowest of the per-sensor results, so every
+# characterised sensor on the bus stays reliable.
+def characterise (link, adapter_id, addr, length, bitrates, reads=READS, command=None,
+                  delay=0.0, check=None, path=profile.PROFILE_PATH, out=sys.stdout):
+    out.write("Sweeping sensor 0x%02x on %s\n" % (addr, adapter_id))
+    results = sweep(link, addr, length, bitrates, reads, command, delay, check, out)
+    best = fastest_reliable(results)
+    if best is None:
+        out.write("No reliable setting found; profile left unchanged\n")
+        return None
+
+    current = profile.get_profile(adapter_id, path)
+    sensors = dict(current.get('sensors', {}))
+    sensors["0x%02x" % addr] = {'i2c_khz': best['actual_khz'], 'rate': round(best['rate'], 1),
+                                'measured': time.strftime("%Y-%m-%d %H:%M:%S"), 'sweep': results}
+    khz = min(s['i2c_khz'] for s in sensors.values())
+    profile.update_profile(adapter_id, {'i2c_khz': khz, 'sensors': sensors}, path)
+    out.write("Fastest reliable setting %d kHz (%.0f transactions/s); adapter profile set to %d kHz\n"
+              % (best['actual_khz'], best['rate'], khz))
+    return khz
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Sweep the I2C bitrate and store the fastest reliable setting")
+    parser.add_argument('adapter', choices=['aardvark', 'binho'])
+    parser.add_argument('--port', type=int, default=0, help="Aardvark port")
+    parser.add_argument('--addr', type=lambda v: int(v, 0), required=True, help="sensor slave address")
+    parser.add_argument('--length', type=int, default=4, help="bytes per read")
+    parser.add_argument('--command', type=bytes.fromhex, default=None, help="hex command written before each read")
+    parser.add_argument('--delay-ms', type=float, default=0.0, help="wait after the command")
+    parser.add_argument('--crc', action='store_true', help="check Sensirion CRC bytes")
+    parser.add_argument('--reads', type=int, default=READS)
+    parser.add_argument('--khz', type=int, nargs='*', default=None, help="bitrates to try")
+    args = parser.parse_args(argv)
+
+    from .transport import AardvarkTransport, BinhoTransport
+    check = sensirion_crc_ok if args.crc else None
+
+    if args.adapter == 'aardvark':
+        import aardvark_py as aa
+        handle = aa.aa_open(args.port)
+        if handle <= 0:
+            print("Unable to open Aardvark device on port %d" % args.port)
+            print("Error code = %d" % handle)
+            return 1
+        try:
+            # Same setup as Microforce.py: GPIO 03 (pin 7) powers the sensor at 3.3 V
+            aa.aa_configure(handle, aa.AA_CONFIG_GPIO_I2C)
+            aa.aa_i2c_pullup(handle, aa.AA_I2C_PULLUP_BOTH)
+            aa.aa_gpio_set(handle, aa.AA_GPIO_SCK)
+            link = AardvarkTransport(handle)
+            characterise(link, profile.aardvark_id(handle), args.addr, args.length, args.khz or AARDVARK_KHZ,
+                         args.reads, args.command, args.delay_ms / 1000.0, check)
+        finally:
+            aa.aa_close(handle)
+    else:
+        from binho import binhoHostAdapter
+        binho = binhoHostAdapter()
+        try:
+            binho.operationMode = "I2C"
+            binho.i2c.useInternalPullUps = True
+            link = BinhoTransport(binho)
+            characterise(link, profile.binho_id(binho), args.addr, args.length, args.khz or BINHO_KHZ,
+                         args.reads, args.command, args.delay_ms / 1000.0, check)
+        finally:
+            binho.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
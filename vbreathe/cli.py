@@ -0,0 +1,494 @@
+#==========================================================================
+# VBreathe command line
+#--------------------------------------------------------------------------
+# One entry point for every rig (see vbreathe.rig and rigs/*.json), all
+# modes running the same core loop (vbreathe.core):
+#
+#   python -m vbreathe live      rigs/wsen.json             bus, live view and status only
+#   python -m vbreathe record    rigs/wsen.json             plus a session directory (vbreathe.session)
+#   python -m vbreathe replay    SESSION --rig rigs/wsen.json --speed 10   (or --max; also a CSV or .vba)
+#   python -m vbreathe calibrate rigs/microforce.json       gel weight procedure
+#   python -m vbreathe relay     rigs/relay.json            relay cycling only
+#   python -m vbreathe align     RIG|SESSION ... --rate 100 inputs resampled onto one time grid
+#   python -m vbreathe benchmark [--rig rigs/emulated.json]
+#
+# live, record and calibrate take --profile (SIGUSR1/SIGUSR2 start a
+# profile) and --control ADDRESS (also a control socket); see
+# vbreathe.profiling.
+#
+# Microforce.py, Pressure_sensor.py, WSEN_0.1_i2c_binho_readings.py and
+# RelayControl.py are thin wrappers around these modes.
+#==========================================================================
+import argparse
+import datetime
+import sys
+import time
+
+from . import core
+from .rig import compile_rig
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+RING_CAPACITY = 262144
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def _stamp ():
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+# Sinks shared by the modes: sample bus, live view, status line, relay.
+# Returns (sinks, viewer); the viewer must be terminated by the caller.
+def _common_sinks (rig, status, link=None, live_view=False, bus=None):
+    from . import dashboard
+    from .ringbuffer import SampleRing
+
+    ring = SampleRing(bus or rig.bus, capacity=RING_CAPACITY, width=rig.width, channels=rig.channels)
+    sinks = [core.BusSink(ring)]
+    viewer = dashboard.launch(ring, rig.channels) if live_view else None
+    if rig.channels:
+        errors = (lambda: link.errors) if link is not None else None
+        sinks.append(core.StatusSink(status, rig.name, rig.channels, errors))
+    if rig.relay:
+        sinks.append(_relay_cycle(rig.relay, status))
+    return sinks, viewer
+
+
+def _relay_cycle (spec, status):
+    from .relay import Relay, RelayCycle, RELAY1_PIN, RELEASE_S, PRESS_S
+    relay = Relay(int(spec.get('pin', RELAY1_PIN)), spec.get('active_low', True))
+    return RelayCycle(relay, float(spec.get('release_s', RELEASE_S)), float(spec.get('press_s', PRESS_S)), status)
+
+
+# Sinks that write session-wide sidecars: envelopes, archive, breaths
+def _record_sinks (rig, session, status):
+    sinks = []
+    if rig.record.get('envelope'):
+        sinks.append(core.EnvelopeSink(session.sidecar('readings'), rig.channels))
+    rollups = rig.record.get('rollups')
+    if rollups:
+        sinks.append(core.RollupSink(session.sidecar('readings'), rig.channels,
+                                     rollups if isinstance(rollups, list) else None))
+    archive = rig.record.get('archive')
+    if archive:
+        sinks.append(core.ArchiveSink(session.sidecar('readings.vba'), archive, [rig.column(c) for c in archive],
+                                      rig.record.get('codec', 'zlib'), {'rig': rig.name}))
+    breath = _breath_sink(rig, session.sidecar('breaths.csv'), status)
+    if breath is not None:
+        sinks.append(breath)
+    return sinks
+
+
+# Alarm rules of the rig (vbreathe.alarms), logged to `log_path`.  Goes
+# first so alarms are checked before the slower sinks.  Returns the sink
+# or None.
+def _alarm_sink (rig, status, sinks, log_path, link=None):
+    if not rig.alarms:
+        return None
+    from .alarms import AlarmEngine, AlarmSink, BUDGET_MS
+    from .relay import RelayCycle
+    spec = rig.alarms
+    relay = next((s for s in sinks if isinstance(s, RelayCycle)), None)
+    sink = AlarmSink(AlarmEngine(spec.get('rules', []), rig.channels), log_path, status,
+                     (lambda: link.errors) if link is not None else None, relay,
+                     spec.get('webhook'), float(spec.get('budget_ms', BUDGET_MS)))
+    sinks.insert(0, sink)
+    return sink
+
+
+# Profiling hook (vbreathe.profiling) writing to `prefix`_*, last so it
+# sees the whole block go through.  Returns the sink or None; attach the
+# pipeline once it is built.
+def _profile_sink (profile, control, prefix, status, sinks):
+    if not (profile or control):
+        return None
+    from .profiling import ProfileSink
+    sink = ProfileSink(prefix, status, control)
+    sinks.append(sink)
+    return sink
+
+
+def _pipeline (stages, sinks, profiler=None):
+    pipeline = core.Pipeline(stages, sinks)
+    if profiler is not None:
+        profiler.attach(pipeline)
+    return pipeline
+
+
+# Repair sessions of this rig left open by a crash
+def _recover_sessions (rig, status):
+    import glob
+    import os
+    from . import session as sessions
+    parent = os.path.dirname(rig.session) or '.'
+    for directory in sorted(glob.glob(os.path.join(parent, rig.name + '_*'))):
+        if sessions.is_session(directory) and not sessions.load_manifest(directory).get('closed'):
+            repaired = sessions.recover(directory)
+            status.message("Recovered %d segment(s) of an interrupted session in %s" % (len(repaired), directory))
+
+
+def _breath_sink (rig, path, status):
+    if not rig.breaths:
+        return None
+    from .breath import BreathDetector
+    spec = rig.breaths
+    detector = BreathDetector(smooth=int(spec.get('smooth', 1)), invert=bool(spec.get('invert', False)))
+    return core.BreathSink(rig.column(spec['channel']), path, detector, status)
+
+
+# Run the core loop until done, `stop()` or SIGINT/SIGTERM, then drain the
+# source and flush and close the sinks within core.CLOSE_TIMEOUT_S
+def _run (source, pipeline, viewer, duration=None, stop=None, status=None):
+    with core.Shutdown(status) as shutdown:
+        def stopped ():
+            return shutdown() or (stop is not None and stop())
+        try:
+            return core.acquire(source, pipeline, duration, stopped)
+        except KeyboardInterrupt:
+            return pipeline.rows
+        finally:
+            if viewer is not None:
+                viewer.terminate()
+            _report_close(pipeline.close(), status)
+
+
+def _report_close (failed, status=None):
+    if failed:
+        text = "Not closed cleanly: %s" % ", ".join(failed)
+        if status is not None:
+            status.message(text)
+        else:
+            sys.stderr.write(text + "\n")
+
+
+#==========================================================================
+# MODES
+#==========================================================================
+def live (rig, duration=None, bus=None, profile=False, control=None):
+    from .status import StatusLine
+    status = StatusLine()
+    with rig.connect() as link:
+        sinks, viewer = _common_sinks(rig, status, link, live_view=True, bus=bus)
+        alarms = _alarm_sink(rig, status, sinks, '%s_alarms_%s.csv' % (rig.name, _stamp()), link)
+        profiler = _profile_sink(profile, control, '%s_profile' % rig.name, status, sinks)
+        _run(rig.source(link), _pipeline(rig.stages, sinks, profiler), viewer, duration,
+             alarms.stopped.is_set if alarms else None, status)
+
+
+def record (rig, duration=None, live_view=True, directory=None, bus=None, profile=False, control=None):
+    import os
+    from . import profile as device_profile
+    from .session import SessionWriter, SEGMENT_BYTES, SEGMENT_SECONDS
+    from .status import StatusLine
+    status = StatusLine()
+    _recover_sessions(rig, status)
+    directory = directory or rig.session.format(name=rig.name, time=_stamp())
+    if os.path.exists(directory):
+        raise FileExistsError("session directory %s already exists" % directory)
+
+    with rig.connect() as link:
+        session = SessionWriter(directory, rig.channels, rig.config, rig.adapter_id,
+                                device_profile.get_profile(rig.adapter_id) if rig.adapter_id else None,
+                                max_bytes=float(rig.record.get('segment_mb', SEGMENT_BYTES / 2 ** 20)) * 2 ** 20,
+                                max_seconds=float(rig.record.get('segment_minutes', SEGMENT_SECONDS / 60)) * 60)
+        source = rig.source(link)
+        session.clocks.append(rig.clock)
+        sinks, viewer = _common_sinks(rig, status, link, live_view, bus)
+        sinks += [session] + _record_sinks(rig, session, status)
+        alarms = _alarm_sink(rig, status, sinks, session.sidecar('alarms.csv'), link)
+        profiler = _profile_sink(profile, control, session.sidecar('profile'), status, sinks)
+        rows = _run(source, _pipeline(rig.stages, sinks, profiler), viewer, duration,
+                    alarms.stopped.is_set if alarms else None, status)
+    print("%s: %d rows written to %s" % (rig.name, rows, directory))
+    return rows
+
+
+# Replay a recorded session, CSV log or .vba archive through the rig's stages and
+# sinks.  `speed` is the replay rate relative to real time; None replays as
+# fast as the pipeline can take it.  Prints the per-stage throughput.
+def replay (rig, log_path, speed=1.0, live_view=False, bus=None, t0=None, t1=None):
+    from . import replay as replay_engine
+    from .status import StatusLine
+    status = StatusLine()
+    source = replay_engine.open_source(log_path, rig.sensor_channels, speed, t0=t0, t1=t1, counts=rig.counts_decoder)
+    sinks, viewer = _common_sinks(rig, status, live_view=live_view, bus=bus)
+    import os
+    breath_path = os.path.join(log_path, 'breaths_replay.csv') if os.path.isdir(log_path) \
+        else os.path.splitext(log_path)[0] + '_breaths_replay.csv'
+    if os.path.abspath(breath_path) == os.path.abspath(log_path):
+        raise ValueError("replay would write breaths over its input %s" % log_path)
+    breath = _breath_sink(rig, breath_path, status)
+    if breath is not None:
+        sinks.append(breath)
+    pipeline = core.Pipeline(rig.stages, sinks, timed=True)
+    start = time.perf_counter()
+    _run(source, pipeline, viewer, status=status)
+    status.clear()
+    replay_engine.report(pipeline, time.perf_counter() - start, source)
+    return pipeline.rows
+
+
+# Resample several inputs onto one time grid of `rate_hz` and record the
+# aligned channels to a session.  An input is a rig config (read live, one
+# thread per adapter) or a recording (session directory or CSV, replayed
+# as fast as possible).  Channels are prefixed with the rig or file name.
+def align (inputs, rate_hz, duration=None, directory=None, max_gap_s=None):
+    import contextlib
+    import os
+    from . import replay as replay_engine
+    from .align import AlignedSource, MAX_GAP_S
+    from .session import SessionWriter, load_manifest
+    from .status import StatusLine
+    status = StatusLine()
+    recorded = [os.path.isdir(path) or path.endswith('.csv') for path in inputs]
+    if any(recorded) and not all(recorded):
+        raise ValueError("align either live rigs or recordings, not both")
+
+    feeds, widths, channels, clocks = [], [], [], []
+    with contextlib.ExitStack() as adapters:
+        for path in inputs:
+            if os.path.isdir(path) or path.endswith('.csv'):
+                names = load_manifest(path)['channels'] if os.path.isdir(path) else replay_engine.csv_channels(path)
+                feeds.append(replay_engine.open_source(path, names, None))
+                label = os.path.basename(os.path.normpath(path))
+            else:
+                rig = compile_rig(path)
+                link = adapters.enter_context(rig.connect())
+                feeds.append(_staged_source(rig, rig.source(link)))
+                clocks.append(rig.clock)
+                names, label = rig.channels, rig.name
+            widths.append(len(names))
+            channels += ["%s %s" % (label, name) for name in names]
+
+        directory = directory or 'Aligned_%s' % _stamp()
+        source = AlignedSource(feeds, widths, 1.0 / rate_hz, threaded=not all(recorded),
+                               max_gap_s=max_gap_s or MAX_GAP_S)
+        session = SessionWriter(directory, channels, {'inputs': inputs, 'rate_hz': rate_hz}, clocks=clocks)
+        try:
+            rows = _run(source, core.Pipeline((), [session, core.StatusSink(status, 'aligned', channels)]),
+                        None, duration, status=status)
+        finally:
+            source.close()
+    print("%d aligned rows at %g Hz written to %s (%d samples dropped)"
+          % (rows, rate_hz, directory, source.resampler.dropped))
+    return rows
+
+
+# A rig's source with its stages applied, for feeds read outside a pipeline
+def _staged_source (rig, source):
+    stages = rig.stages
+
+    def read ():
+        block = source()
+        if block is None:
+            return None
+        times, values = block
+        for stage in stages:
+            values = stage(times, values)
+        return times, values
+    return read
+
+
+# The Microforce calibration procedure: for each gel cup weight, show the
+# force for `settle_s` seconds, then record `record_s` seconds and append
+# the mean and standard deviation of force and counts to the results file
+def calibrate (rig, results_path=None, live_view=True, bus=None, profile=False, control=None):
+    import os
+    from .csvlog import IndexedCsvWriter
+    from .status import StatusLine
+    spec = rig.calibration or {}
+    force = rig.column(spec.get('channel', rig.channels[0]))
+    counts = rig.column(spec['counts']) if spec.get('counts') else None
+    settle_s = float(spec.get('settle_s', 20))
+    record_s = float(spec.get('record_s', 10))
+
+    results_path = results_path or '%s_readings_%s.csv' % (rig.name, _stamp())
+    fields = ['Time', 'Gel weight (g)', 'Average Force (N)', 'Standard Deviation (N)',
+              'Average Force (counts)', 'Standard Deviation (counts)']
+    status = StatusLine()
+    with rig.connect() as link, core.Shutdown(status, interrupt=True):
+        results = IndexedCsvWriter(results_path, fields, every=1)
+        sinks, viewer = _common_sinks(rig, status, link, live_view, bus)
+        window = CalibrationWindow(force, counts, spec.get('history_rows'), status)
+        sinks.append(window)
+        alarms = _alarm_sink(rig, status, sinks, os.path.splitext(results_path)[0] + '_alarms.csv', link)
+        profiler = _profile_sink(profile, control, os.path.splitext(results_path)[0] + '_profile', status, sinks)
+        pipeline = _pipeline(rig.stages, sinks, profiler)
+        source = rig.source(link)
+        try:
+            _calibration_steps(source, pipeline, window, results, status, settle_s, record_s,
+                               alarms.stopped.is_set if alarms else None)
+        except (KeyboardInterrupt, EOFError):
+            pass
+        finally:
+            if viewer is not None:
+                viewer.terminate()
+            _report_close(pipeline.close(), status)
+            results.close()
+
+
+# Prompt for gel cup weights and record one results row per weight, until
+# EOF, Ctrl-C or `stop()` (an alarm's stop action)
+def _calibration_steps (source, pipeline, window, results, status, settle_s, record_s, stop=None):
+    while stop is None or not stop():
+        status.message("For the first %d seconds, the values will be displayed but not recorded. "
+                       "For the last %d seconds, values will be recorded." % (settle_s, record_s))
+        weight = input("Enter the gel cup weight in grams: ")
+        window.start(time.time() + settle_s)
+        core.acquire(source, pipeline, settle_s + record_s, stop)
+        if stop is not None and stop():
+            status.message("Calibration stopped by an alarm")
+            break
+        row = window.result()
+        if row is None:
+            status.message("No data recorded")
+            continue
+        results.writerow([datetime.datetime.now(), weight] + row)
+        results.flush()
+        status.message("Data recorded in CSV file \n")
+
+
+# Collects force and counts after the settle time of a calibration step,
+# in a fixed-capacity history rather than growing lists
+class CalibrationWindow:
+    def __init__ (self, force, counts=None, capacity=None, status=None):
+        from .history import History, CAPACITY
+        self.status   = status
+        self.columns  = [force] + ([counts] if counts is not None else [])
+        self.history  = History(len(self.columns), capacity or CAPACITY)
+        self.begin    = None
+        self.announced = False
+
+    def start (self, begin):
+        self.begin = begin
+        self.history.clear()
+        self.history.dropped = 0
+        self.announced = False
+
+    def write (self, times, values):
+        keep = times >= self.begin
+        if not keep.any():
+            return
+        if not self.announced:
+            self.announced = True
+            if self.status is not None:
+                self.status.message("\n-------------------------- Data recording started -------------------------- ")
+        self.history.append(times[keep], values[keep][:, self.columns])
+
+    # [mean force, std force, mean counts, std counts] of the window
+    def result (self):
+        count, mean, std, _, _ = self.history.stats()
+        if not count:
+            return None
+        if self.history.dropped and self.status is not None:
+            self.status.message("Only the last %d samples of the window were kept (history_rows)" % count)
+        return [float(v) for pair in zip(mean, std) for v in pair]
+
+    def close (self):
+        self.history.close()
+
+
+def relay (rig):
+    from .relay import run
+    from .status import StatusLine
+    status = StatusLine()
+    with core.Shutdown(status) as shutdown:
+        presses = run(_relay_cycle(rig.relay or {}, status), shutdown)
+    print("Buttons were pressed", presses, "times")
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+def _profile_options (p):
+    p.add_argument('--profile', action='store_true', help="SIGUSR1/SIGUSR2 take a cProfile / tracemalloc profile")
+    p.add_argument('--control', default=None, metavar='ADDRESS',
+                   help="profiling control socket (host:port, :port or Unix socket path)")
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog='python -m vbreathe', description="VBreathe acquisition")
+    sub = parser.add_subparsers(dest='mode', required=True)
+
+    p = sub.add_parser('live', help="publish and display a rig, no files")
+    p.add_argument('config')
+    p.add_argument('--duration', type=float, default=None)
+    p.add_argument('--bus', default=None, help="sample bus name (default from the config)")
+    _profile_options(p)
+
+    p = sub.add_parser('record', help="record a rig to a session directory")
+    p.add_argument('config')
+    p.add_argument('--duration', type=float, default=None, help="seconds to record (default: until Ctrl-C)")
+    p.add_argument('--no-live', action='store_true', help="do not open the live view")
+    p.add_argument('--session', default=None, help="session directory (default from the config)")
+    p.add_argument('--bus', default=None)
+    _profile_options(p)
+
+    p = sub.add_parser('replay', help="replay a recorded session or log through the rig's pipeline")
+    p.add_argument('log', help="session directory, CSV log or .vba archive")
+    p.add_argument('--rig', required=True, help="rig config the log was recorded with")
+    p.add_argument('--speed', type=float, default=1.0, help="replay rate relative to real time")
+    p.add_argument('--max', action='store_true', help="replay as fast as possible")
+    p.add_argument('--live', action='store_true', help="open the live view")
+    p.add_argument('--bus', default=None)
+    p.add_argument('--start', type=float, default=None, help="first timestamp to replay (POSIX s)")
+    p.add_argument('--end', type=float, default=None, help="last timestamp to replay (POSIX s)")
+
+    p = sub.add_parser('calibrate', help="gel weight calibration procedure")
+    p.add_argument('config')
+    p.add_argument('--results', default=None, help="results CSV path")
+    p.add_argument('--no-live', action='store_true')
+    _profile_options(p)
+
+    p = sub.add_parser('relay', help="cycle the relay only")
+    p.add_argument('config', nargs='?', default=None)
+
+    p = sub.add_parser('align', help="resample rigs or recordings onto one time grid")
+    p.add_argument('inputs', nargs='+', help="rig configs (live) or session directories / CSV logs")
+    p.add_argument('--rate', type=float, default=100.0, help="grid rate (Hz)")
+    p.add_argument('--duration', type=float, default=None)
+    p.add_argument('--session', default=None, help="output session directory")
+    p.add_argument('--max-gap', type=float, default=None, help="longest gap interpolated across (s)")
+
+    p = sub.add_parser('benchmark', help="processing and emulated bus benchmarks")
+    p.add_argument('--rig', default=None, help="also measure the core loop on this rig config")
+    p.add_argument('--aardvark', type=int, default=None, metavar='PORT',
+                   help="also compare aardvark_py wrappers with the fast-path session on this adapter")
+    p.add_argument('--aardvark-overhead', action='store_true',
+                   help="compare the same calls against a no-op read (no adapter needed)")
+    p.add_argument('--addr', type=lambda v: int(v, 0), default=0x28, help="sensor address for --aardvark")
+
+    args = parser.parse_args(argv)
+
+    if args.mode == 'benchmark':
+        from . import benchmark
+        benchmark.main(args.rig, args.aardvark, args.addr, args.aardvark_overhead)
+        return 0
+
+    if args.mode == 'align':
+        align(args.inputs, args.rate, args.duration, args.session, args.max_gap)
+        return 0
+
+    if args.mode == 'relay':
+        rig = compile_rig(args.config) if args.config else None
+        relay(rig if rig is not None else compile_rig({'name': 'relay', 'relay': {}}))
+        return 0
+
+    rig = compile_rig(args.rig if args.mode == 'replay' else args.config)
+    if args.mode == 'live':
+        live(rig, args.duration, args.bus, args.profile, args.control)
+    elif args.mode == 'record':
+        record(rig, args.duration, not args.no_live, args.session, args.bus, args.profile, args.control)
+    elif args.mode == 'replay':
+        replay(rig, args.log, None if args.max else args.speed, args.live, args.bus, args.start, args.end)
+    elif args.mode == 'calibrate':
+        calibrate(rig, args.results, not args.no_live, profile=args.profile, control=args.control)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
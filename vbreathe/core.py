@@ -0,0 +1,328 @@
+#==========================================================================
+# Acquisition core loop
+#--------------------------------------------------------------------------
+# Every mode (live, record, replay, calibrate) runs the same loop:
+#
+#   source  ->  stages  ->  sinks
+#
+# A source is a callable returning the next (times, values) block, with
+# times in POSIX seconds and values an (N x channels) float64 array, or
+# None when it is exhausted (a replayed log).  Stages transform the block
+# (filters add columns); sinks consume it (sample bus, CSV log, envelopes,
+# archive, breath detector, relay).  Stages and sinks only see whole
+# blocks, so the per-sample cost stays in NumPy.
+#
+# A sink is any object with write(times, values) and close().  Blocks use
+# the layout of vbreathe.sample, which also gives structured and
+# per-sample views of them without copying.
+#
+# With timed=True the pipeline accumulates the time spent in every stage
+# and sink (Pipeline.timings), which replay mode reports as per-stage
+# throughput, and names the one running in Pipeline.current (None between
+# blocks), which the profiler (vbreathe.profiling) uses to tag samples.
+# `timed` can be switched on and off while running.
+#
+# Shutdown: Shutdown turns SIGINT/SIGTERM into a stop request for
+# acquire(), which then drains the source (blocks already read but not yet
+# processed) before returning.  Pipeline.close() flushes and closes every
+# sink, each on its own even if another fails, within a time limit, so
+# sinks may buffer aggressively without losing data on a clean stop.
+#==========================================================================
+import signal
+import threading
+import time
+
+import numpy as np
+
+from .sample import pack
+
+
+#==========================================================================
+# STAGES
+#==========================================================================
+# Run a FilterChain over one column and append the result as a new column
+class FilterStage:
+    def __init__ (self, column, chain):
+        self.column = column
+        self.chain  = chain
+
+    def __call__ (self, times, values):
+        return np.column_stack((values, self.chain.process(values[:, self.column])))
+
+
+#==========================================================================
+# SINKS
+#==========================================================================
+# Publish blocks on a sample bus, times relative to `t0` (by default the
+# first sample, so a replayed log starts at zero like a live run)
+class BusSink:
+    def __init__ (self, ring, t0=None):
+        self.ring = ring
+        self.t0   = t0
+
+    def write (self, times, values):
+        if self.t0 is None:
+            self.t0 = times[0]
+        self.ring.push_block(pack(times - self.t0, values))
+
+    def close (self):
+        self.ring.close()
+
+
+# One CSV row per sample, timestamp first, with the sparse time index
+class CsvSink:
+    def __init__ (self, path, channels):
+        from .csvlog import IndexedCsvWriter
+        self.path = path
+        self.log  = IndexedCsvWriter(path, ['timestamp'] + list(channels))
+
+    def write (self, times, values):
+        self.log.write_block(times, values)
+
+    def close (self):
+        self.log.close()
+
+
+class EnvelopeSink:
+    def __init__ (self, log_path, channels):
+        from .envelope import EnvelopeWriter
+        self.writer = EnvelopeWriter(log_path, channels)
+
+    def write (self, times, values):
+        self.writer.append(times, values)
+
+    def close (self):
+        self.writer.close()
+
+
+# Clock-aligned count/mean/std/min/max buckets of every channel
+class RollupSink:
+    def __init__ (self, prefix, channels, periods=None):
+        from .rollup import PERIODS, RollupWriter
+        self.writer = RollupWriter(prefix, channels, periods or PERIODS)
+
+    def write (self, times, values):
+        self.writer.append(times, values)
+
+    def close (self):
+        self.writer.close()
+
+
+# Selected columns as integer counts in a compressed archive
+class ArchiveSink:
+    def __init__ (self, path, channels, columns, codec='zlib', meta=None):
+        from .archive import ArchiveWriter
+        self.columns = list(columns)
+        self.writer  = ArchiveWriter(path, channels, codec=codec, meta=meta)
+
+    def write (self, times, values):
+        self.writer.append(times, np.round(values[:, self.columns]).astype(np.int32))
+
+    def close (self):
+        self.writer.close()
+
+
+# Breath segmentation on one (differential pressure) column
+class BreathSink:
+    def __init__ (self, column, log_path, detector, status=None):
+        from .breath import BREATH_FIELDS
+        from .csvlog import IndexedCsvWriter
+        self.column   = column
+        self.detector = detector
+        self.status   = status
+        self.log      = IndexedCsvWriter(log_path, BREATH_FIELDS, every=1)
+
+    def write (self, times, values):
+        for breath in self.detector.process(times, values[:, self.column]):
+            self.log.writerow(breath.row(), breath.start)
+            if self.status is not None:
+                summary = self.detector.summary
+                self.status.message("Breath: %.2f s, volume %.3f in / %.3f out   (%.1f breaths/min over %d breaths)"
+                                    % (breath.duration, breath.v_insp, breath.v_exp, summary.rate, summary.count))
+
+    def close (self):
+        self.log.close()
+
+
+# Rate-limited status line with the latest value of every channel
+class StatusSink:
+    def __init__ (self, status, name, channels, errors=None):
+        self.status  = status
+        self.name    = name
+        self.fmt     = "%s: " + "  ".join("%s %%.2f" % c for c in channels) + "   %.0f rows/s  errors %d"
+        self.errors  = errors or (lambda: 0)
+        self.rows    = 0
+        self.start   = time.monotonic()
+
+    def write (self, times, values):
+        self.rows += len(times)
+        rate = self.rows / max(time.monotonic() - self.start, 1e-9)
+        self.status.update(self.fmt, self.name, *values[-1].tolist(), rate, self.errors())
+
+    def close (self):
+        self.status.clear()
+
+
+#==========================================================================
+# SHUTDOWN
+#==========================================================================
+CLOSE_TIMEOUT_S = 10.0      # Longest a pipeline may take to flush and close
+
+
+# Context manager turning the first SIGINT or SIGTERM into a stop request
+# (call the object, or pass it as acquire()'s stop); a second signal
+# raises KeyboardInterrupt to abandon a shutdown that hangs.  With
+# interrupt=True every signal raises KeyboardInterrupt, for loops that
+# block outside acquire() (waiting for input).  Handlers are only
+# installed from the main thread, and restored on exit.
+class Shutdown:
+    SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+    def __init__ (self, status=None, interrupt=False):
+        self.status    = status
+        self.interrupt = interrupt
+        self.requested = threading.Event()
+        self.signal    = None
+        self._previous = {}
+
+    def _handle (self, signum, frame):
+        if self.requested.is_set() or self.interrupt:
+            self.requested.set()
+            raise KeyboardInterrupt
+        self.signal = signal.Signals(signum).name
+        self.requested.set()
+        if self.status is not None:
+            self.status.message("%s: stopping, flushing data (again to abort)" % self.signal)
+
+    def __call__ (self):
+        return self.requested.is_set()
+
+    def __enter__ (self):
+        if threading.current_thread() is threading.main_thread():
+            for signum in self.SIGNALS:
+                self._previous[signum] = signal.signal(signum, self._handle)
+        return self
+
+    def __exit__ (self, *exc):
+        for signum, handler in self._previous.items():
+            signal.signal(signum, handler)
+        self._previous.clear()
+
+
+# Call every closer in order, isolated from each other's failures, in a
+# worker thread given at most `timeout` seconds.  Returns the names of the
+# closers that failed or did not finish in time.
+def close_all (closers, timeout=CLOSE_TIMEOUT_S):
+    pending = dict(closers)
+    failed = []
+
+    def run ():
+        for name, close in closers:
+            try:
+                close()
+            except Exception as error:
+                failed.append("%s (%s)" % (name, error))
+            pending.pop(name, None)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    return failed + ["%s (timed out)" % name for name in list(pending) if worker.is_alive()]
+
+
+#==========================================================================
+# PIPELINE
+#==========================================================================
+# Display name of a stage or sink, numbered when a type appears twice
+def _names (items):
+    names = []
+    for item in items:
+        name = type(item).__name__
+        if name in names:
+            name = "%s #%d" % (name, sum(n.split(' #')[0] == name for n in names) + 1)
+        names.append(name)
+    return names
+
+
+class Pipeline:
+    def __init__ (self, stages=(), sinks=(), timed=False):
+        self.stages = list(stages)
+        self.sinks  = list(sinks)
+        self.rows   = 0
+        self.timed  = timed
+        self.timings = dict.fromkeys(_names(self.stages) + _names(self.sinks), 0.0)
+        self.current = None
+
+    def process (self, times, values):
+        if self.timed:
+            return self._process_timed(times, values)
+        for stage in self.stages:
+            values = stage(times, values)
+        for sink in self.sinks:
+            sink.write(times, values)
+        self.rows += len(times)
+        return values
+
+    def _process_timed (self, times, values):
+        clock = time.perf_counter
+        timings = self.timings
+        names = iter(timings)
+        for stage in self.stages:
+            name = self.current = next(names)
+            start = clock()
+            values = stage(times, values)
+            timings[name] += clock() - start
+        for sink in self.sinks:
+            name = self.current = next(names)
+            start = clock()
+            sink.write(times, values)
+            timings[name] += clock() - start
+        self.current = None
+        self.rows += len(times)
+        return values
+
+    # Flush and close every sink within `timeout` seconds.  Returns the
+    # sinks that failed or timed out (see close_all).  Sinks with a
+    # finish() method get it called first, from the calling thread, for
+    # teardown that has to happen there (signal handlers, per-thread
+    # profilers); close() itself runs in close_all's worker thread.
+    def close (self, timeout=CLOSE_TIMEOUT_S):
+        failed = []
+        for name, sink in zip(_names(self.sinks), self.sinks):
+            if hasattr(sink, 'finish'):
+                try:
+                    sink.finish()
+                except Exception as error:
+                    failed.append("%s (%s)" % (name, error))
+        return failed + close_all(list(zip(_names(self.sinks), (sink.close for sink in self.sinks))), timeout)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+# The core loop.  Pulls blocks from `source` until it is exhausted,
+# `duration` seconds have passed or `stop()` returns True, and pushes them
+# through `pipeline`.  A source with a drain() method then yields the
+# blocks it still holds.  Returns the number of rows processed.
+def acquire (source, pipeline, duration=None, stop=None):
+    end = time.monotonic() + duration if duration else None
+    process = pipeline.process
+    rows = pipeline.rows
+    while end is None or time.monotonic() < end:
+        if stop is not None and stop():
+            break
+        block = source()
+        if block is None:
+            break
+        times, values = block
+        if len(times):
+            process(times, values)
+    drain = getattr(source, 'drain', None)
+    if drain is not None:
+        for times, values in drain():
+            if len(times):
+                process(times, values)
+    return pipeline.rows - rows
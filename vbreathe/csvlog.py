@@ -0,0 +1,306 @@
+#==========================================================================
+# CSV session logs
+#--------------------------------------------------------------------------
+# Helpers for the CSV files written by the sensor scripts
+# (WSEN_readings_*.csv, Microforce_readings_*.csv).  Rows start with a
+# str(datetime.datetime.now()) timestamp followed by numeric columns.
+#
+# IndexedCsvWriter also keeps a sparse sidecar index '<log>.idx' with the
+# timestamp and byte offset of every INDEX_EVERY-th row, so CsvRangeReader
+# can seek straight to the part of a multi-GB log a query needs.
+#==========================================================================
+import csv
+import datetime
+import io
+import itertools
+import os
+
+import numpy as np
+
+from .sample import split
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+BLOCK_ROWS = 65536   # Rows per block when streaming a CSV file
+INDEX_EVERY = 256    # Rows between sparse index entries
+CHUNK_BYTES = 1 << 20   # Read size when scanning a file for lines
+
+# Sidecar index record: timestamp (POSIX seconds) and byte offset of the row
+INDEX_DTYPE = np.dtype([('t', '<f8'), ('offset', '<i8')])
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# Convert a str(datetime.datetime.now()) timestamp to POSIX seconds.
+# fromisoformat accepts both the '.ffffff' and the whole-second forms.
+def parse_timestamp (text):
+    return datetime.datetime.fromisoformat(text).timestamp()
+
+
+# Stream a session CSV as (times, values) blocks.  `columns` are the
+# indexes of the numeric columns to return; column 0 is the timestamp.
+# Rows that cannot be parsed (headers, a truncated last line) are skipped.
+# Rows are parsed straight into a sample block (vbreathe.sample) and
+# returned as views of it, so no per-row lists are kept.
+def read_csv_blocks (path, columns, block_rows=BLOCK_ROWS):
+    width = 1 + len(columns)
+    block = np.empty((block_rows, width))
+    n = 0
+    with open(path, newline='') as file:
+        for row in csv.reader(file):
+            try:
+                block[n] = [parse_timestamp(row[0])] + [float(row[c]) for c in columns]
+            except (ValueError, IndexError):
+                continue
+            n += 1
+            if n == block_rows:
+                yield split(block)
+                block = np.empty((block_rows, width))
+                n = 0
+    if n:
+        yield split(block[:n])
+
+
+# Timestamp of a row as POSIX seconds, or None for header/garbage lines
+def _row_time (line):
+    try:
+        return parse_timestamp(line[:line.index(b',')].decode())
+    except ValueError:
+        return None
+
+
+# Build the sparse index for a log that was recorded without one
+def build_index (path, every=INDEX_EVERY):
+    entries = []
+    rows = 0
+    offset = 0
+    with open(path, 'rb') as file:
+        for line in file:
+            t = _row_time(line)
+            if t is not None:
+                if rows % every == 0:
+                    entries.append((t, offset))
+                rows += 1
+            offset += len(line)
+    np.array(entries, dtype=INDEX_DTYPE).tofile(path + '.idx')
+
+
+#==========================================================================
+# WRITER
+#==========================================================================
+# Appends rows to a CSV log, keeping one open file for the whole run and
+# writing an index entry every `every` rows.  The data file is flushed
+# before each index entry, so an entry never points past the data on disk.
+class IndexedCsvWriter:
+    def __init__ (self, path, fields=None, every=INDEX_EVERY):
+        self.path   = path
+        self.every  = every
+        self._file  = open(path, 'ab')
+        self._index = open(path + '.idx', 'ab')
+        self._text  = io.StringIO()
+        self._csv   = csv.writer(self._text)
+        self._rows  = 0
+        self._offset = self._file.tell()
+        self._entry = np.zeros(1, dtype=INDEX_DTYPE)
+        if fields is not None and self._offset == 0:
+            self._write(fields)
+
+    def _write (self, row):
+        self._text.seek(0)
+        self._text.truncate()
+        self._csv.writerow(row)
+        data = self._text.getvalue().encode()
+        self._file.write(data)
+        self._offset += len(data)
+
+    # Append one row.  `t` is the row time in POSIX seconds; when omitted it
+    # is taken from a datetime in the first column.
+    def writerow (self, row, t=None):
+        if self._rows % self.every == 0:
+            if t is None:
+                t = row[0].timestamp()
+            self._file.flush()
+            self._entry['t'] = t
+            self._entry['offset'] = self._offset
+            self._entry.tofile(self._index)
+            self._index.flush()
+        self._rows += 1
+        self._write(row)
+
+    # Append a block of samples as 'timestamp,value,...' rows, the
+    # timestamp as str(datetime) like the other rows.  The text of the
+    # whole block is built in one pass and written at once, and its index
+    # entries follow in one write, instead of a csv.writer round trip per
+    # row.  `times` (N,) in POSIX seconds, `values` (N x channels).
+    def write_block (self, times, values):
+        n = len(times)
+        if n == 0:
+            return
+        fromtimestamp = datetime.datetime.fromtimestamp
+        join = ','.join
+        lines = ["%s,%s\r\n" % (fromtimestamp(t), join(map(repr, row)))
+                 for t, row in zip(times.tolist(), values.tolist())]
+        data = ''.join(lines).encode()
+
+        # Rows of this block that get an index entry, and their offsets
+        first = (-self._rows) % self.every
+        indexed = range(first, n, self.every)
+        if len(indexed):
+            starts = list(itertools.accumulate(map(len, lines), initial=self._offset))
+            entries = np.empty(len(indexed), dtype=INDEX_DTYPE)
+            entries['t'] = times[first::self.every]
+            entries['offset'] = [starts[i] for i in indexed]
+
+        self._file.write(data)
+        self._offset += len(data)
+        self._rows += n
+        if len(indexed):
+            self._file.flush()
+            entries.tofile(self._index)
+            self._index.flush()
+
+    # Bytes written to the log so far
+    @property
+    def size (self):
+        return self._offset
+
+    @property
+    def rows (self):
+        return self._rows
+
+    def flush (self):
+        self._file.flush()
+        self._index.flush()
+
+    def close (self):
+        self._file.close()
+        self._index.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+# Offset just past the last newline before `end` (0 if there is none),
+# found by reading backwards a chunk at a time
+def _last_newline (file, end):
+    pos = end
+    while pos > 0:
+        step = min(CHUNK_BYTES, pos)
+        pos -= step
+        file.seek(pos)
+        i = file.read(step).rfind(b'\n')
+        if i >= 0:
+            return pos + i + 1
+    return 0
+
+
+# Times of the first and last parseable rows of a log (None when there
+# are none), reading only the head and the tail of the file
+def time_span (path):
+    first = last = None
+    with open(path, 'rb') as file:
+        for line in file:
+            first = _row_time(line)
+            if first is not None:
+                break
+        end = file.seek(0, os.SEEK_END)
+        while end > 0 and last is None:
+            start = _last_newline(file, end - 1)
+            file.seek(start)
+            last = _row_time(file.read(end - start))
+            end = start
+    return first, last
+
+
+# Repair a log after a crash: cut a partially written last line and drop
+# index entries (and a partial index record) that point past the data.
+# Returns the number of complete rows left.  With an index written every
+# `every` rows only the tail is read: the rows before the last surviving
+# entry are counted from the index and the rest are parsed.  A log
+# without an index is scanned from the start.
+def recover_tail (path, every=INDEX_EVERY):
+    index_path = path + '.idx'
+    index = np.zeros(0, dtype=INDEX_DTYPE)
+    with open(path, 'rb+') as file:
+        size = file.seek(0, os.SEEK_END)
+        end = _last_newline(file, size)
+        if end < size:
+            file.truncate(end)
+        if os.path.exists(index_path):
+            records = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+            index = np.fromfile(index_path, dtype=INDEX_DTYPE, count=records)
+            index = index[index['offset'] < end]
+            index.tofile(index_path)
+        rows = (len(index) - 1) * every if len(index) else 0
+        file.seek(int(index['offset'][-1]) if len(index) else 0)
+        remaining = file.tell()
+        for line in file:
+            remaining += len(line)
+            if remaining > end:
+                break
+            if _row_time(line) is not None:
+                rows += 1
+    return rows
+
+
+#==========================================================================
+# READER
+#==========================================================================
+class CsvRangeReader:
+    def __init__ (self, path):
+        self.path = path
+        if not os.path.exists(path + '.idx'):
+            build_index(path)
+        self._index = np.fromfile(path + '.idx', dtype=INDEX_DTYPE)
+
+    # Raw lines (bytes) of the rows with t0 <= time <= t1, lazily.  Reading
+    # starts at the last index entry at or before t0 and stops at the first
+    # row after t1, so at most `every` rows outside the range are parsed.
+    def iter_lines (self, t0, t1):
+        start = np.searchsorted(self._index['t'], t0, side='right') - 1
+        offset = int(self._index['offset'][start]) if start >= 0 else 0
+        with open(self.path, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                t = _row_time(line)
+                if t is None:
+                    continue
+                if t > t1:
+                    break
+                if t >= t0:
+                    yield line
+
+    def lines (self, t0, t1):
+        return list(self.iter_lines(t0, t1))
+
+    # Rows in [t0, t1] streamed as (times, values) blocks of the given
+    # columns, parsed into sample blocks like read_csv_blocks
+    def blocks (self, t0, t1, columns, block_rows=BLOCK_ROWS):
+        width = 1 + len(columns)
+        block = np.empty((block_rows, width))
+        n = 0
+        for row in csv.reader(line.decode() for line in self.iter_lines(t0, t1)):
+            try:
+                block[n] = [parse_timestamp(row[0])] + [float(row[c]) for c in columns]
+            except (ValueError, IndexError):
+                continue
+            n += 1
+            if n == block_rows:
+                yield split(block)
+                block = np.empty((block_rows, width))
+                n = 0
+        if n:
+            yield split(block[:n])
+
+    # Parsed rows in [t0, t1] as one (times, values) pair
+    def query (self, t0, t1, columns):
+        parts = list(self.blocks(t0, t1, columns))
+        if not parts:
+            return np.empty(0), np.empty((0, len(columns)))
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
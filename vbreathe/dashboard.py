@@ -0,0 +1,138 @@
+#==========================================================================
+# Live view
+#--------------------------------------------------------------------------
+# Separate process that attaches to a SampleRing and redraws decimated
+# traces plus running statistics at a fixed refresh rate.  It is started
+# with launch() as a fresh interpreter running this module (not
+# multiprocessing.Process), so the child never re-imports the script that
+# started it, only vbreathe.dashboard and its ring.
+#
+# Usage: python -m vbreathe.dashboard RING_NAME [--channels "Force (N)" ...]
+#
+# Without --channels the names published in the ring header are used, so a
+# second viewer can be attached to a running script by ring name alone.
+#==========================================================================
+import argparse
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from .ringbuffer import SampleRing
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+DEFAULT_REFRESH_HZ = 10       # Redraws per second
+DEFAULT_WINDOW_S   = 30.0     # Seconds of history shown
+MAX_POINTS         = 2000     # Points per trace after decimation
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# Reduce a trace to at most `points` values by keeping the min and max of
+# each bucket, so spikes stay visible after decimation.
+def decimate_minmax (t, y, points=MAX_POINTS):
+    n = len(y)
+    buckets = points // 2
+    if n <= points or buckets == 0:
+        return t, y
+    per = n // buckets
+    used = per * buckets
+    tb = t[n - used:].reshape(buckets, per)
+    yb = y[n - used:].reshape(buckets, per)
+    lo = yb.argmin(axis=1)
+    hi = yb.argmax(axis=1)
+    rows = np.arange(buckets)
+    first = np.minimum(lo, hi)
+    second = np.maximum(lo, hi)
+    t_out = np.column_stack((tb[rows, first], tb[rows, second])).ravel()
+    y_out = np.column_stack((yb[rows, first], yb[rows, second])).ravel()
+    return t_out, y_out
+
+
+# Start the live view for `ring` in its own interpreter.  Returns the
+# Popen handle; the caller should terminate() it on exit.
+def launch (ring, channels, refresh_hz=DEFAULT_REFRESH_HZ, window_s=DEFAULT_WINDOW_S, rate_hz=None):
+    cmd = [sys.executable, '-m', 'vbreathe.dashboard', ring.name,
+           '--refresh', str(refresh_hz), '--window', str(window_s)]
+    if rate_hz:
+        cmd += ['--rate', str(rate_hz)]
+    cmd += ['--channels'] + list(channels)
+    return subprocess.Popen(cmd)
+
+
+def run (name, channels, refresh_hz=DEFAULT_REFRESH_HZ, window_s=DEFAULT_WINDOW_S, rate_hz=None):
+    import matplotlib.pyplot as plt
+
+    ring = SampleRing.attach(name)
+    nchan = ring.width - 1
+    channels = list(channels or ring.channels)
+    channels = channels + ["ch%d" % i for i in range(len(channels), nchan)]
+
+    # Rows to fetch per redraw; without a nominal rate take the whole ring
+    rows = ring.capacity if not rate_hz else min(ring.capacity, int(window_s * rate_hz) + 1)
+
+    fig, axes = plt.subplots(nchan, 1, sharex=True, squeeze=False)
+    axes = axes[:, 0]
+    lines = []
+    texts = []
+    for ax, label in zip(axes, channels):
+        line, = ax.plot([], [], lw=0.8)
+        lines.append(line)
+        texts.append(ax.text(0.01, 0.95, "", transform=ax.transAxes, va='top', family='monospace'))
+        ax.set_ylabel(label)
+        ax.grid(True)
+    axes[-1].set_xlabel("Time (s)")
+    fig.tight_layout()
+    plt.show(block=False)
+
+    period = 1.0 / refresh_hz
+    last_count = ring.count
+    last_time = time.monotonic()
+    try:
+        while plt.fignum_exists(fig.number):
+            start = time.monotonic()
+            block = ring.latest(rows)
+            if len(block):
+                t = block[:, 0]
+                keep = t >= t[-1] - window_s
+                block = block[keep]
+                t = block[:, 0]
+
+                count = ring.count
+                rate = (count - last_count) / max(start - last_time, 1e-9)
+                last_count, last_time = count, start
+
+                for i, (ax, line, text) in enumerate(zip(axes, lines, texts)):
+                    y = block[:, i + 1]
+                    line.set_data(*decimate_minmax(t, y))
+                    text.set_text("mean %.3f  std %.3f  min %.3f  max %.3f  %.0f S/s"
+                                  % (y.mean(), y.std(), y.min(), y.max(), rate))
+                    ax.relim()
+                    ax.autoscale_view()
+
+            fig.canvas.draw_idle()
+            fig.canvas.flush_events()
+            time.sleep(max(0.0, period - (time.monotonic() - start)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Live view of a VBreathe sample ring")
+    parser.add_argument('name', help="shared memory name of the ring")
+    parser.add_argument('--channels', nargs='*', default=[])
+    parser.add_argument('--refresh', type=float, default=DEFAULT_REFRESH_HZ)
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW_S)
+    parser.add_argument('--rate', type=float, default=None, help="nominal sample rate (S/s)")
+    args = parser.parse_args()
+    run(args.name, args.channels, args.refresh, args.window, args.rate)
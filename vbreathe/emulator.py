@@ -0,0 +1,302 @@
+#==========================================================================
+# Sensor emulator
+#--------------------------------------------------------------------------
+# Fake differential pressure / force sensors for load testing the
+# acquisition code.  Waveforms come from a recorded session (or a
+# synthetic breathing trace) and are encoded into the sensors' I2C frames
+# once, up front, so answering a read is only a table lookup.
+#
+# AardvarkSensorEmulator turns a second Aardvark adapter into an I2C slave
+# that answers the master's reads with those frames.  SoftwareBus is a pure
+# software stand-in with the same frames and a configurable per-transaction
+# latency, so rate and latency tests can run without hardware.
+#==========================================================================
+import threading
+import time
+from array import array
+
+import numpy as np
+
+from .csvlog import read_csv_blocks
+from .honeywell import STATUS_NORMAL, STATUS_STALE
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+HONEYWELL_FRAME = 4       # Status/bridge MSB, bridge LSB, temperature MSB, temperature LSB
+SENSIRION_FRAME = 3       # Pressure MSB, pressure LSB, CRC
+
+CRC8_POLY = 0x31          # Sensirion CRC-8: polynomial 0x31, init 0xFF, no reflection
+CRC8_INIT = 0xFF
+
+
+#==========================================================================
+# WAVEFORMS
+#==========================================================================
+# Sensor counts from one column of a recorded session CSV
+def session_waveform (csv_path, column):
+    blocks = [values[:, 0] for _, values in read_csv_blocks(csv_path, [column])]
+    return np.concatenate(blocks) if blocks else np.empty(0)
+
+
+# Synthetic breathing trace in counts: `rate_bpm` breaths per minute around
+# `center` with the given amplitude, sampled at `fs` Hz
+def breathing_waveform (seconds=60.0, fs=100.0, rate_bpm=15.0, center=8192, amplitude=1500, noise=5.0):
+    t = np.arange(int(seconds * fs)) / fs
+    wave = center + amplitude * np.sin(2 * np.pi * rate_bpm / 60.0 * t)
+    wave += np.random.normal(0.0, noise, len(t))
+    return wave
+
+
+#==========================================================================
+# FRAME ENCODING
+#==========================================================================
+# Honeywell 4-byte frames: 2 status bits + 14-bit bridge value, then an
+# 11-bit temperature left-aligned in the last two bytes.  Returns (N x 4).
+def encode_honeywell (counts, temperature=1024, status=STATUS_NORMAL):
+    counts = np.clip(np.asarray(counts), 0, 0x3fff).astype(np.uint16)
+    temp = np.broadcast_to(np.clip(np.asarray(temperature), 0, 0x7ff).astype(np.uint16), counts.shape)
+    status = np.broadcast_to(np.asarray(status, dtype=np.uint16), counts.shape)
+    frames = np.empty((len(counts), HONEYWELL_FRAME), dtype=np.uint8)
+    frames[:, 0] = (status << 6) | (counts >> 8)
+    frames[:, 1] = counts & 0xff
+    frames[:, 2] = temp >> 3
+    frames[:, 3] = (temp & 0x7) << 5
+    return frames
+
+
+def crc8 (data):
+    crc = CRC8_INIT
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC8_POLY) & 0xff if crc & 0x80 else (crc << 1) & 0xff
+    return crc
+
+
+# CRC of every 16-bit word, built on first use, for vectorised encoding
+# and checking of Sensirion frames
+_crc8_table = None
+
+
+def crc8_table ():
+    global _crc8_table
+    if _crc8_table is None:
+        _crc8_table = np.array([crc8((i >> 8, i & 0xff)) for i in range(65536)], dtype=np.uint8)
+    return _crc8_table
+
+
+# Sensirion frames: signed 16-bit value followed by its CRC.  Returns (N x 3).
+def encode_sensirion (values):
+    raw = np.asarray(values).astype(np.int64) & 0xffff
+    frames = np.empty((len(raw), SENSIRION_FRAME), dtype=np.uint8)
+    frames[:, 0] = raw >> 8
+    frames[:, 1] = raw & 0xff
+    if len(raw) > 4096 or _crc8_table is not None:
+        frames[:, 2] = crc8_table()[raw]
+    else:
+        frames[:, 2] = [crc8(pair) for pair in frames[:, :2].tolist()]
+    return frames
+
+
+#==========================================================================
+# SOFTWARE STAND-IN
+#==========================================================================
+# One emulated sensor.  Frames advance on every read, or with the sensor's
+# update period when `update_hz` is given (reads in between return the
+# previous frame, like a real sensor polled too fast).
+class SoftwareSensor:
+    def __init__ (self, frames, update_hz=None, loop=True):
+        self.frames    = np.ascontiguousarray(frames, dtype=np.uint8)
+        self.update_hz = update_hz
+        self.loop      = loop
+        self.reads     = 0
+        self._index    = 0
+        self._start    = None
+
+    def next_frame (self):
+        n = len(self.frames)
+        if self.update_hz:
+            now = time.perf_counter()
+            if self._start is None:
+                self._start = now
+            i = int((now - self._start) * self.update_hz)
+        else:
+            i = self._index
+            self._index += 1
+        self.reads += 1
+        if i >= n:
+            i = i % n if self.loop else n - 1
+        return self.frames[i]
+
+    # Commands written by the master are accepted and ignored
+    def write (self, data):
+        return len(data)
+
+
+# Software I2C bus holding emulated sensors by address.  `latency` adds a
+# fixed busy-wait per transaction to model the USB round trip of a real
+# host adapter, on top of the time the bytes take on the wire at
+# `bitrate_khz`.  Above `max_khz` transactions fail with probability
+# `overspeed_errors`, so bus characterisation can be exercised in software.
+class SoftwareBus:
+    def __init__ (self, sensors, latency=0.0, bitrate_khz=100, max_khz=None, overspeed_errors=0.2):
+        self.sensors = dict(sensors)
+        self.latency = latency
+        self.bitrate_khz = bitrate_khz
+        self.max_khz = max_khz
+        self.overspeed_errors = overspeed_errors
+        self.transactions = 0
+        self._random = np.random.default_rng()
+
+    # Busy-wait for one transaction of `nbytes` data bytes (plus the
+    # address byte, 9 clocks per byte)
+    def _wait (self, nbytes=0):
+        self.transactions += 1
+        duration = self.latency + (nbytes + 1) * 9 / (self.bitrate_khz * 1000.0)
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            pass
+
+    def _failed (self):
+        return self.max_khz is not None and self.bitrate_khz > self.max_khz \
+            and self._random.random() < self.overspeed_errors
+
+    # Read `length` bytes from `addr`; returns bytes (empty on a NACK)
+    def read (self, addr, length):
+        self._wait(length)
+        sensor = self.sensors.get(addr)
+        if sensor is None or self._failed():
+            return b''
+        return sensor.next_frame()[:length].tobytes()
+
+    # `n` reads of `length` bytes in one transaction, as on an adapter that
+    # can queue reads.  Returns an (n x length) array, or None on a NACK
+    # (overspeed failures are drawn once per batch).
+    def read_batch (self, addr, length, n):
+        self._wait((length + 1) * n - 1)
+        sensor = self.sensors.get(addr)
+        if sensor is None or self._failed():
+            return None
+        return np.array([sensor.next_frame()[:length] for _ in range(n)], dtype=np.uint8).reshape(n, length)
+
+    def write (self, addr, data):
+        self._wait(len(data))
+        sensor = self.sensors.get(addr)
+        return sensor.write(data) if sensor is not None else 0
+
+
+#==========================================================================
+# AARDVARK SLAVE-MODE EMULATOR
+#==========================================================================
+# Runs a second Aardvark adapter as an I2C slave at `addr`.  The response
+# for the next read is always loaded before the master asks for it: as
+# soon as the adapter reports that a response was sent, the following
+# precomputed frame is installed.
+class AardvarkSensorEmulator:
+    def __init__ (self, port, addr, frames, loop=True, poll_ms=10):
+        import aardvark_py as aa
+        self._aa = aa
+
+        self.port    = port
+        self.addr    = addr
+        self.loop    = loop
+        self.poll_ms = poll_ms
+        self.served  = 0
+        self.commands = 0
+
+        # Frames as ready-to-send array('B') objects
+        self._responses = [array('B', row.tobytes()) for row in np.asarray(frames, dtype=np.uint8)]
+        self._index  = 0
+        self._thread = None
+        self._stop   = threading.Event()
+
+        self.handle = aa.aa_open(port)
+        if self.handle <= 0:
+            raise IOError("Unable to open Aardvark device on port %d (%s)"
+                          % (port, aa.aa_status_string(self.handle)))
+        aa.aa_configure(self.handle, aa.AA_CONFIG_SPI_I2C)
+        aa.aa_i2c_pullup(self.handle, aa.AA_I2C_PULLUP_NONE)
+
+    def _load_next (self):
+        if self._index >= len(self._responses):
+            if not self.loop:
+                return
+            self._index = 0
+        self._aa.aa_i2c_slave_set_response(self.handle, self._responses[self._index])
+        self._index += 1
+
+    def _serve (self):
+        aa = self._aa
+        rx = aa.array_u08(64)
+        while not self._stop.is_set():
+            events = aa.aa_async_poll(self.handle, self.poll_ms)
+            if events == aa.AA_ASYNC_NO_DATA:
+                continue
+            # Master wrote to us (e.g. a measurement command): drain it
+            if events & aa.AA_ASYNC_I2C_READ:
+                aa.aa_i2c_slave_read(self.handle, rx)
+                self.commands += 1
+            # Master read our response: install the next frame right away
+            if events & aa.AA_ASYNC_I2C_WRITE:
+                if aa.aa_i2c_slave_write_stats(self.handle) > 0:
+                    self.served += 1
+                    self._load_next()
+
+    def start (self):
+        aa = self._aa
+        self._load_next()
+        status = aa.aa_i2c_slave_enable(self.handle, self.addr, 0, 0)
+        if status < 0:
+            raise IOError("Unable to enable I2C slave mode: %s" % aa.aa_status_string(status))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, name='aardvark-emulator', daemon=True)
+        self._thread.start()
+
+    def stop (self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._aa.aa_i2c_slave_disable(self.handle)
+
+    def close (self):
+        self.stop()
+        self._aa.aa_close(self.handle)
+
+    def __enter__ (self):
+        self.start()
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+# python -m vbreathe.emulator PORT ADDR [SESSION.csv COLUMN]
+# Serves Honeywell frames from a recorded session (or a synthetic breathing
+# trace) on the Aardvark at PORT until interrupted.
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 3:
+        print("usage: python -m vbreathe.emulator PORT ADDR [SESSION.csv COLUMN]")
+        sys.exit(1)
+    port = int(sys.argv[1])
+    addr = int(sys.argv[2], 0)
+    if len(sys.argv) >= 5:
+        wave = session_waveform(sys.argv[3], int(sys.argv[4]))
+    else:
+        wave = breathing_waveform()
+
+    with AardvarkSensorEmulator(port, addr, encode_honeywell(wave)) as emulator:
+        print("Emulating sensor 0x%02x on port %d with %d frames" % (addr, port, len(wave)))
+        try:
+            while True:
+                time.sleep(1.0)
+                print("\rserved %d reads" % emulator.served, end='')
+        except KeyboardInterrupt:
+            print()
@@ -0,0 +1,245 @@
+#==========================================================================
+# Min/max/mean envelope pyramid
+#--------------------------------------------------------------------------
+# Streaming multi-resolution downsampler kept next to a raw session log.
+# Level k summarises FACTOR**(k+1) raw samples per bucket with the min,
+# max and mean of every channel, so a viewer can fetch any time range at
+# screen resolution by reading O(pixels) buckets from the right level
+# instead of parsing every raw sample.
+#
+# Files for a log 'WSEN_readings_<timestamp>.csv':
+#   WSEN_readings_<timestamp>.csv.env.json   channel names, factor, levels
+#   WSEN_readings_<timestamp>.csv.env<k>     float64 records, one per bucket
+#
+# Record layout: t_start, t_end, count, then min, max, mean per channel.
+#==========================================================================
+import json
+import os
+import sys
+
+import numpy as np
+
+from .csvlog import read_csv_blocks
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+FACTOR = 16      # Buckets of level k-1 (or raw samples) per bucket of level k
+LEVELS = 4       # 16, 256, 4096 and 65536 samples per bucket
+
+T_START = 0
+T_END   = 1
+COUNT   = 2
+FIELDS  = 3      # Leading fields before the per-channel min/max/mean
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def record_width (channels):
+    return FIELDS + 3 * channels
+
+
+# Reduce full groups of `factor` records into one record each
+def _combine (records, factor, channels):
+    groups = len(records) // factor
+    r = records[:groups * factor].reshape(groups, factor, -1)
+    out = np.empty((groups, record_width(channels)))
+    count = r[:, :, COUNT]
+    total = count.sum(axis=1)
+    out[:, T_START] = r[:, 0, T_START]
+    out[:, T_END] = r[:, -1, T_END]
+    out[:, COUNT] = total
+    mins = r[:, :, FIELDS::3]
+    maxs = r[:, :, FIELDS + 1::3]
+    means = r[:, :, FIELDS + 2::3]
+    out[:, FIELDS::3] = mins.min(axis=1)
+    out[:, FIELDS + 1::3] = maxs.max(axis=1)
+    out[:, FIELDS + 2::3] = (means * count[:, :, None]).sum(axis=1) / total[:, None]
+    return out
+
+
+# Turn raw samples into level-0 style records, one per sample
+def _raw_records (times, values):
+    n, channels = values.shape
+    rec = np.empty((n, record_width(channels)))
+    rec[:, T_START] = times
+    rec[:, T_END] = times
+    rec[:, COUNT] = 1
+    rec[:, FIELDS::3] = values
+    rec[:, FIELDS + 1::3] = values
+    rec[:, FIELDS + 2::3] = values
+    return rec
+
+
+#==========================================================================
+# WRITER
+#==========================================================================
+class EnvelopeWriter:
+    def __init__ (self, log_path, channels, factor=FACTOR, levels=LEVELS):
+        self.log_path = log_path
+        self.channels = list(channels)
+        self.factor   = factor
+        self.levels   = levels
+        self.width    = record_width(len(self.channels))
+
+        # Records not yet folded into a full bucket, per level.  Level 0
+        # holds raw samples; each list is bounded by `factor` records.
+        self._pending = [np.empty((0, self.width)) for _ in range(levels)]
+        self._files = [open(log_path + '.env%d' % k, 'ab') for k in range(levels)]
+
+        with open(log_path + '.env.json', 'w') as meta:
+            json.dump({'channels': self.channels, 'factor': factor, 'levels': levels}, meta)
+
+        # Single-sample appends go through a small staging buffer so the
+        # sensor loop does not pay for a NumPy concatenate per sample
+        self._stage_t = np.empty(factor)
+        self._stage_v = np.empty((factor, len(self.channels)))
+        self._staged  = 0
+
+    # Add one sample.  Cheap enough to call from the sensor loop.
+    def append_row (self, t, values):
+        i = self._staged
+        self._stage_t[i] = t
+        self._stage_v[i] = values
+        self._staged = i + 1
+        if self._staged == self.factor:
+            self._staged = 0
+            self.append(self._stage_t, self._stage_v)
+
+    # Add a block of samples: `times` (N,) and `values` (N x channels)
+    def append (self, times, values):
+        values = np.asarray(values, dtype=np.float64).reshape(len(times), -1)
+        self._feed(0, _raw_records(np.asarray(times, dtype=np.float64), values))
+
+    def _feed (self, level, records):
+        records = np.concatenate((self._pending[level], records))
+        full = (len(records) // self.factor) * self.factor
+        self._pending[level] = records[full:].copy()
+        if full == 0:
+            return
+        out = _combine(records[:full], self.factor, len(self.channels))
+        out.tofile(self._files[level])
+        if level + 1 < self.levels:
+            self._feed(level + 1, out)
+
+    def flush (self):
+        for f in self._files:
+            f.flush()
+
+    # Write out partial buckets so the tail of the session is covered too
+    def close (self):
+        if self._staged:
+            self.append(self._stage_t[:self._staged], self._stage_v[:self._staged])
+            self._staged = 0
+        carry = np.empty((0, self.width))
+        for level in range(self.levels):
+            records = np.concatenate((self._pending[level], carry))
+            carry = np.empty((0, self.width))
+            if len(records):
+                carry = _combine(records, len(records), len(self.channels))
+                carry.tofile(self._files[level])
+            self._pending[level] = np.empty((0, self.width))
+        for f in self._files:
+            f.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+#==========================================================================
+# READER
+#==========================================================================
+# np.searchsorted over column `col` of records, with scalar reads only:
+# searchsorted on a strided memmap column would copy the whole column
+# first, O(n) per query instead of O(log n)
+def search_column (records, col, value, side='left'):
+    lo, hi = 0, len(records)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        x = records[mid, col]
+        if x < value or (side == 'right' and x == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class EnvelopeReader:
+    def __init__ (self, log_path):
+        with open(log_path + '.env.json') as meta:
+            info = json.load(meta)
+        self.channels = info['channels']
+        self.factor   = info['factor']
+        self.width    = record_width(len(self.channels))
+        self._levels  = []
+        for k in range(info['levels']):
+            path = log_path + '.env%d' % k
+            rows = os.path.getsize(path) // (8 * self.width) if os.path.exists(path) else 0
+            if rows == 0:
+                self._levels.append(np.empty((0, self.width)))
+            else:
+                self._levels.append(np.memmap(path, dtype=np.float64, mode='r', shape=(rows, self.width)))
+
+    # Buckets covering [t0, t1] at no more than `pixels` buckets, taken from
+    # the finest level that fits.  Only the binary searches and the
+    # returned slice touch the files, so the cost is O(pixels + log n).
+    # Returns (level, records).
+    def query (self, t0, t1, pixels):
+        chosen = None
+        for level, rec in enumerate(self._levels):
+            if len(rec) == 0:
+                continue
+            lo = search_column(rec, T_END, t0, 'left')
+            hi = search_column(rec, T_START, t1, 'right')
+            chosen = (level, rec, lo, hi)
+            if hi - lo <= pixels:
+                break
+        if chosen is None:
+            return 0, np.empty((0, self.width))
+        level, rec, lo, hi = chosen
+        out = np.array(rec[lo:hi])
+
+        # Even the coarsest level is too fine: fold it down to `pixels`
+        if len(out) > pixels:
+            per = -(-len(out) // pixels)
+            pad = (-len(out)) % per
+            if pad:
+                tail = _combine(out[len(out) - (per - pad):], per - pad, len(self.channels))
+                out = np.concatenate((_combine(out[:len(out) - (per - pad)], per, len(self.channels)), tail))
+            else:
+                out = _combine(out, per, len(self.channels))
+        return level, out
+
+    # Convenience accessors on a query result
+    def channel (self, records, name):
+        c = self.channels.index(name)
+        return records[:, FIELDS + 3 * c], records[:, FIELDS + 3 * c + 1], records[:, FIELDS + 3 * c + 2]
+
+
+# Build the pyramid for an existing session CSV
+def build_from_csv (csv_path, columns, channels, factor=FACTOR, levels=LEVELS):
+    for k in range(levels):
+        path = csv_path + '.env%d' % k
+        if os.path.exists(path):
+            os.remove(path)
+    with EnvelopeWriter(csv_path, channels, factor, levels) as writer:
+        for times, values in read_csv_blocks(csv_path, columns):
+            writer.append(times, values)
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+# python -m vbreathe.envelope WSEN_readings_<timestamp>.csv
+# Builds the pyramid for the pressure columns of a WSEN session log.
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("usage: python -m vbreathe.envelope SESSION.csv [column ...]")
+        sys.exit(1)
+    cols = [int(c) for c in sys.argv[2:]] or [1, 2, 3]
+    build_from_csv(sys.argv[1], cols, ['column %d' % c for c in cols])
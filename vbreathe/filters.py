@@ -0,0 +1,194 @@
+#==========================================================================
+# Streaming filter bank
+#--------------------------------------------------------------------------
+# Filters that keep their state between blocks, so a stream can be fed in
+# blocks of any size (including single samples) and give the same output
+# as filtering the whole recording at once.  Blocks are (N,) or
+# (N x channels) arrays; every channel has its own state.
+#
+# IIR/FIR sections use scipy.signal.lfilter when SciPy is installed (one
+# vectorised call per block).  Without SciPy a NumPy fallback is used.
+#==========================================================================
+import math
+
+import numpy as np
+
+try:
+    from scipy.signal import lfilter as _lfilter
+except ImportError:
+    _lfilter = None
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# FIR case of the fallback: a convolution per channel, with the carried
+# state added to the first outputs and the convolution tail becoming the
+# new state (direct form II transposed).
+def _fir_numpy (b, x, zi):
+    n, order = len(x), len(zi)
+    y = np.empty_like(x)
+    zf = np.zeros_like(zi)
+    for c in range(x.shape[1]):
+        full = np.convolve(x[:, c], b)
+        y[:, c] = full[:n]
+        y[:min(n, order), c] += zi[:min(n, order), c]
+        zf[:, c] = full[n:n + order]
+        if n < order:
+            zf[:order - n, c] += zi[n:, c]
+    return y, zf
+
+
+# Direct form II transposed, same contract as scipy.signal.lfilter with zi
+# along axis 0.  Only used when SciPy is not available.
+def _lfilter_numpy (b, a, x, zi):
+    order = len(zi)
+    if order == 0:
+        return b[0] * x, zi
+    if not a[1:].any():
+        return _fir_numpy(b, x, zi)
+    b = [float(v) for v in b]
+    a = [float(v) for v in a]
+    y = np.empty_like(x)
+    zf = np.empty_like(zi)
+    for c in range(x.shape[1]):
+        z = [float(v) for v in zi[:, c]]
+        col = y[:, c]
+        for i, xi in enumerate(x[:, c].tolist()):
+            yi = b[0] * xi + z[0]
+            for k in range(order - 1):
+                z[k] = b[k + 1] * xi + z[k + 1] - a[k + 1] * yi
+            z[order - 1] = b[order] * xi - a[order] * yi
+            col[i] = yi
+        zf[:, c] = z
+    return y, zf
+
+
+def lfilter (b, a, x, zi):
+    if _lfilter is not None:
+        return _lfilter(b, a, x, axis=0, zi=zi)
+    return _lfilter_numpy(b, a, x, zi)
+
+
+# RBJ audio-EQ-cookbook biquads, normalised so that a[0] == 1
+def design_lowpass (fc, fs, q=1 / math.sqrt(2)):
+    w0 = 2 * math.pi * fc / fs
+    alpha = math.sin(w0) / (2 * q)
+    cw = math.cos(w0)
+    b = [(1 - cw) / 2, 1 - cw, (1 - cw) / 2]
+    a = [1 + alpha, -2 * cw, 1 - alpha]
+    return np.array(b) / a[0], np.array(a) / a[0]
+
+
+def design_notch (f0, fs, q=30.0):
+    w0 = 2 * math.pi * f0 / fs
+    alpha = math.sin(w0) / (2 * q)
+    cw = math.cos(w0)
+    b = [1, -2 * cw, 1]
+    a = [1 + alpha, -2 * cw, 1 - alpha]
+    return np.array(b) / a[0], np.array(a) / a[0]
+
+
+def _as_2d (block):
+    block = np.asarray(block, dtype=np.float64)
+    return block.reshape(len(block), -1), block.ndim == 1
+
+
+#==========================================================================
+# FILTERS
+#==========================================================================
+# Generic IIR/FIR section y = lfilter(b, a, x) with carried state.  The
+# state is initialised from the first sample so the output starts at the
+# signal level instead of ringing up from zero.
+class LinearFilter:
+    def __init__ (self, b, a=(1.0,)):
+        b = np.asarray(b, dtype=np.float64)
+        a = np.asarray(a, dtype=np.float64)
+        n = max(len(a), len(b))
+        self.b = np.pad(b, (0, n - len(b))) / a[0]
+        self.a = np.pad(a, (0, n - len(a))) / a[0]
+        self._zi = None
+
+    # Steady-state initial conditions for a unit step (as lfilter_zi)
+    def _step_state (self):
+        n = len(self.a) - 1
+        if n == 0:
+            return np.zeros(0)
+        companion = np.zeros((n, n))
+        companion[:, 0] = -self.a[1:]
+        companion[:-1, 1:] = np.eye(n - 1)
+        rhs = self.b[1:] - self.a[1:] * self.b[0]
+        return np.linalg.solve(np.eye(n) - companion, rhs)
+
+    def process (self, block):
+        x, flat = _as_2d(block)
+        if len(x) == 0:
+            return np.asarray(block, dtype=np.float64)
+        if self._zi is None:
+            self._zi = np.outer(self._step_state(), x[0])
+        y, self._zi = lfilter(self.b, self.a, x, self._zi)
+        return y[:, 0] if flat else y
+
+    def reset (self):
+        self._zi = None
+
+
+class LowPass(LinearFilter):
+    def __init__ (self, fc, fs, q=1 / math.sqrt(2)):
+        LinearFilter.__init__(self, *design_lowpass(fc, fs, q))
+
+
+class Notch(LinearFilter):
+    def __init__ (self, f0, fs, q=30.0):
+        LinearFilter.__init__(self, *design_notch(f0, fs, q))
+
+
+class MovingAverage(LinearFilter):
+    def __init__ (self, length):
+        LinearFilter.__init__(self, np.full(int(length), 1.0 / int(length)))
+
+
+# Replace samples that are more than `threshold` scaled MADs away from the
+# median of the surrounding `window` samples (trailing window, so the
+# filter stays causal).  The last window-1 samples are carried over.
+class MedianDespike:
+    def __init__ (self, window=5, threshold=3.0):
+        self.window = int(window)
+        self.threshold = threshold
+        self.replaced = 0
+        self._tail = None
+
+    def process (self, block):
+        x, flat = _as_2d(block)
+        if len(x) == 0:
+            return np.asarray(block, dtype=np.float64)
+        if self._tail is None:
+            self._tail = np.repeat(x[:1], self.window - 1, axis=0)
+        ext = np.concatenate((self._tail, x))
+        self._tail = ext[len(ext) - (self.window - 1):]
+
+        windows = np.lib.stride_tricks.sliding_window_view(ext, self.window, axis=0)
+        med = np.median(windows, axis=-1)
+        mad = 1.4826 * np.median(np.abs(windows - med[..., None]), axis=-1)
+        spikes = np.abs(x - med) > self.threshold * np.maximum(mad, 1e-12)
+        self.replaced += int(spikes.sum())
+        y = np.where(spikes, med, x)
+        return y[:, 0] if flat else y
+
+    def reset (self):
+        self._tail = None
+
+
+# Filters applied in order
+class FilterChain:
+    def __init__ (self, *filters):
+        self.filters = list(filters)
+
+    def process (self, block):
+        for f in self.filters:
+            block = f.process(block)
+        return block
+
+    def reset (self):
+        for f in self.filters:
+            f.reset()
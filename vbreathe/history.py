@@ -0,0 +1,152 @@
+#==========================================================================
+# Fixed-capacity sample history
+#--------------------------------------------------------------------------
+# Circular NumPy arrays holding the most recent rows of a stream, for live
+# statistics and plots over a bounded window.  Memory is allocated once,
+# when the history is created, so a multi-day run on a Raspberry Pi stays
+# flat instead of growing a Python list per sample.
+#
+# Rows leave the history when it is full, or when they are older than
+# `retention_s` seconds behind the newest row.  Without a spill file they
+# are dropped (counted in `dropped`).  With one they are appended to it as
+# raw float64 records (time, then the values), and the retained rows
+# follow on close, so the spill file holds the whole stream; read it back
+# with read_spill().
+#
+# Times are expected in increasing order, as every source produces them.
+#==========================================================================
+import numpy as np
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+CAPACITY = 65536        # Rows kept by default (about 1 min at 1 kHz)
+
+
+#==========================================================================
+# HISTORY
+#==========================================================================
+class History:
+    def __init__ (self, width, capacity=CAPACITY, retention_s=None, spill_path=None):
+        self.width       = width
+        self.capacity    = capacity
+        self.retention_s = retention_s
+        self.spill_path  = spill_path
+        self.spilled     = 0
+        self.dropped     = 0
+        self._t = np.empty(capacity)
+        self._v = np.empty((capacity, width))
+        self._start = 0     # Absolute index of the oldest retained row
+        self._end   = 0     # Absolute index one past the newest row
+        self._spill = open(spill_path, 'ab') if spill_path else None
+
+    def __len__ (self):
+        return self._end - self._start
+
+    # Bytes held by the arrays: constant for the life of the history
+    @property
+    def nbytes (self):
+        return self._t.nbytes + self._v.nbytes
+
+    # Positions in the arrays of absolute rows [a, b), at most two slices
+    def _slices (self, a, b):
+        i = a % self.capacity
+        j = i + (b - a)
+        if j <= self.capacity:
+            return [slice(i, j)]
+        return [slice(i, self.capacity), slice(0, j - self.capacity)]
+
+    # Let go of the rows before absolute index `upto`
+    def _evict (self, upto):
+        if upto <= self._start:
+            return
+        if self._spill is not None:
+            for s in self._slices(self._start, upto):
+                np.column_stack((self._t[s], self._v[s])).tofile(self._spill)
+            self.spilled += upto - self._start
+        else:
+            self.dropped += upto - self._start
+        self._start = upto
+
+    # Add a block: `times` (N,), `values` (N x width)
+    def append (self, times, values):
+        n = len(times)
+        if n == 0:
+            return
+        values = np.asarray(values, dtype=np.float64).reshape(n, self.width)
+        if n > self.capacity:
+            # Only the newest `capacity` rows can be kept; the rest go
+            # straight to the spill file
+            head = n - self.capacity
+            self._evict(self._end)
+            if self._spill is not None:
+                np.column_stack((times[:head], values[:head])).tofile(self._spill)
+                self.spilled += head
+            else:
+                self.dropped += head
+            self._start = self._end = self._end + head
+            times, values, n = times[head:], values[head:], self.capacity
+
+        self._evict(self._end + n - self.capacity)
+        offset = 0
+        for s in self._slices(self._end, self._end + n):
+            k = s.stop - s.start
+            self._t[s] = times[offset:offset + k]
+            self._v[s] = values[offset:offset + k]
+            offset += k
+        self._end += n
+
+        if self.retention_s is not None:
+            cutoff = times[-1] - self.retention_s
+            old = sum(int(np.searchsorted(self._t[s], cutoff)) for s in self._slices(self._start, self._end))
+            self._evict(self._start + old)
+
+    # The newest `n` rows (all by default) in time order, as (times, values).
+    # Views into the arrays when they do not wrap, copies otherwise.
+    def view (self, n=None):
+        n = len(self) if n is None else min(n, len(self))
+        slices = self._slices(self._end - n, self._end)
+        if len(slices) == 1:
+            return self._t[slices[0]], self._v[slices[0]]
+        return (np.concatenate([self._t[s] for s in slices]),
+                np.concatenate([self._v[s] for s in slices]))
+
+    # Rows of the last `seconds` seconds (all rows when None)
+    def window (self, seconds=None):
+        times, values = self.view()
+        if seconds is None or not len(times):
+            return times, values
+        i = np.searchsorted(times, times[-1] - seconds)
+        return times[i:], values[i:]
+
+    # Count and per-column mean, std, min and max over window(seconds)
+    def stats (self, seconds=None):
+        _, values = self.window(seconds)
+        if not len(values):
+            return 0, None, None, None, None
+        return len(values), values.mean(axis=0), values.std(axis=0), values.min(axis=0), values.max(axis=0)
+
+    # Forget every row (spilling them first when there is a spill file)
+    def clear (self):
+        if self._spill is not None:
+            self._evict(self._end)
+        self._start = self._end
+
+    def close (self):
+        if self._spill is not None:
+            self._evict(self._end)
+            self._spill.close()
+            self._spill = None
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+# (times, values) of a spill file written by a History of `width` columns
+def read_spill (path, width):
+    records = np.fromfile(path, dtype=np.float64).reshape(-1, width + 1)
+    return records[:, 0], records[:, 1:]
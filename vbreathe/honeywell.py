@@ -0,0 +1,137 @@
+#==========================================================================
+# Honeywell 4-byte frame decoding and stale-data tracking
+#--------------------------------------------------------------------------
+# Honeywell digital sensors (the microforce sensor in Microforce.py) answer
+# a 4-byte read with:
+#
+#   byte 0   S1 S0 B13..B8     two status bits, bridge data MSBs
+#   byte 1   B7..B0            bridge data LSBs
+#   byte 2   T10..T3           temperature MSBs
+#   byte 3   T2 T1 T0 x x x x x
+#
+# Status 0 is fresh data, 2 means the sample was already read (stale) and
+# 3 is a diagnostic condition.  Reading faster than the sensor updates only
+# returns stale frames, so StaleTracker drops them and estimates the
+# sensor's real update period to pace the polling.
+#==========================================================================
+import numpy as np
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+FRAME_LENGTH = 4
+
+STATUS_NORMAL     = 0
+STATUS_COMMAND    = 1
+STATUS_STALE      = 2
+STATUS_DIAGNOSTIC = 3
+
+BRIDGE_MASK = 0x3fff
+TEMP_BITS   = 11
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# Decode an (N x 4) frame block (or a single 4-byte frame).  Returns the
+# status, 14-bit bridge and 11-bit temperature arrays.
+def decode (frames):
+    f = np.asarray(frames, dtype=np.uint16).reshape(-1, FRAME_LENGTH)
+    status = f[:, 0] >> 6
+    bridge = ((f[:, 0] << 8) | f[:, 1]) & BRIDGE_MASK
+    temperature = (f[:, 2] << 3) | (f[:, 3] >> 5)
+    return status, bridge, temperature
+
+
+# 11-bit temperature counts to degrees Celsius (transfer function from the
+# Honeywell I2C application note: -50 C at 0, 150 C at 2047)
+def temperature_c (counts):
+    return np.asarray(counts) * (200.0 / 2047.0) - 50.0
+
+
+#==========================================================================
+# STALE TRACKER
+#==========================================================================
+# Marks which frames of a block are new samples and estimates the sensor's
+# update period from them.
+#
+# mode='status' uses the Honeywell status bits; mode='repeat' treats a
+# frame identical to the previous one as stale, for sensors without status
+# bits.  poll_interval() is the suggested time between reads: the measured
+# update period when stale frames show that we are polling too fast, and a
+# slowly shrinking probe when every read is fresh, so the loop settles at
+# about one read per sensor update.
+class StaleTracker:
+    def __init__ (self, mode='status', initial_interval=0.0, min_interval=0.0, smoothing=0.1, probe=0.9):
+        self.mode       = mode
+        self.interval   = initial_interval
+        self.min_interval = min_interval
+        self.smoothing  = smoothing
+        self.probe      = probe
+
+        self.fresh      = 0
+        self.stale      = 0
+        self.diagnostic = 0
+
+        self._last_frame = None
+        self._last_fresh_time = None
+        self._since_fresh = 0   # Reads since the last fresh frame
+
+    # Boolean mask of the fresh frames in `frames` (N x length), read at
+    # `times` (seconds)
+    def process (self, frames, times):
+        frames = np.asarray(frames, dtype=np.uint8)
+        times = np.asarray(times, dtype=np.float64)
+        n = len(frames)
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+
+        if self.mode == 'status':
+            status = frames[:, 0] >> 6
+            fresh = status == STATUS_NORMAL
+            self.diagnostic += int((status == STATUS_DIAGNOSTIC).sum())
+        else:
+            prev = np.concatenate((self._last_frame[None, :], frames[:-1])) if self._last_frame is not None \
+                else np.concatenate((frames[:1] ^ 0xff, frames[:-1]))
+            fresh = (frames != prev).any(axis=1)
+            self._last_frame = frames[-1].copy()
+
+        nfresh = int(fresh.sum())
+        self.fresh += nfresh
+        self.stale += n - nfresh
+        if nfresh:
+            index = np.flatnonzero(fresh)
+            self._update_period(index, times[fresh])
+            self._since_fresh = n - 1 - int(index[-1])
+        else:
+            self._since_fresh += n
+        return fresh
+
+    def _update_period (self, index, fresh_times):
+        # Reads between consecutive fresh frames, including the carry-over
+        gaps = np.diff(np.concatenate(([-self._since_fresh - 1], index)))
+        spans = np.diff(np.concatenate(([self._last_fresh_time if self._last_fresh_time is not None else np.nan], fresh_times)))
+        measured = spans[(gaps > 1) & ~np.isnan(spans)]
+
+        if len(measured):
+            # Polled faster than the sensor updates: follow the measured period
+            period = float(np.median(measured))
+            if self.interval:
+                self.interval += self.smoothing * (period - self.interval)
+            else:
+                self.interval = period
+        elif self._last_fresh_time is not None:
+            # Every read was fresh: poll a little faster to find the limit
+            self.interval = max(self.min_interval, self.interval * self.probe)
+
+        self._last_fresh_time = fresh_times[-1]
+
+    def poll_interval (self):
+        return self.interval
+
+    # Fraction of reads that returned stale data
+    @property
+    def stale_ratio (self):
+        total = self.fresh + self.stale
+        return self.stale / total if total else 0.0
@@ -0,0 +1,86 @@
+#==========================================================================
+# Device profiles
+#--------------------------------------------------------------------------
+# Per-adapter settings measured on the rig (currently the fastest reliable
+# I2C bitrate found by vbreathe.busspeed), stored in a JSON file keyed by
+# adapter identity and applied automatically when a script connects.
+#
+# {
+#   "aardvark-2237123456": {"i2c_khz": 400, "sensors": {"0x28": {...}}},
+#   "binho-0X8735CD...":   {"i2c_khz": 1000, ...}
+# }
+#==========================================================================
+import json
+import os
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+PROFILE_PATH = os.environ.get('VBREATHE_PROFILES', 'device_profiles.json')
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def load_profiles (path=PROFILE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+# Write atomically so a crash never leaves a half-written profile file
+def save_profiles (profiles, path=PROFILE_PATH):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(profiles, file, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def get_profile (adapter_id, path=PROFILE_PATH):
+    return load_profiles(path).get(adapter_id, {})
+
+
+def update_profile (adapter_id, values, path=PROFILE_PATH):
+    profiles = load_profiles(path)
+    profiles.setdefault(adapter_id, {}).update(values)
+    save_profiles(profiles, path)
+    return profiles[adapter_id]
+
+
+def aardvark_id (handle):
+    import aardvark_py as aa
+    return "aardvark-%d" % aa.aa_unique_id(handle)
+
+
+def binho_id (binho):
+    return "binho-%s" % binho.deviceID
+
+
+# Same ID for the pipelined transport (vbreathe.transport), which talks
+# to the adapter without the binho library
+def binho_link_id (link):
+    return "binho-%s" % link.device_id()
+
+
+# Set the Aardvark bitrate from its profile, or `default_khz` when the
+# adapter has not been characterised.  Returns the bitrate actually set.
+def apply_aardvark (handle, default_khz, path=PROFILE_PATH):
+    import aardvark_py as aa
+    khz = get_profile(aardvark_id(handle), path).get('i2c_khz', default_khz)
+    return aa.aa_i2c_bitrate(handle, int(khz))
+
+
+# Same for a Binho adapter; binho.i2c.frequency is in Hz
+def apply_binho (binho, default_hz, path=PROFILE_PATH):
+    khz = get_profile(binho_id(binho), path).get('i2c_khz')
+    binho.i2c.frequency = int(khz * 1000) if khz else default_hz
+    return binho.i2c.frequency
+
+
+# Same for the pipelined transport; configures it (mode, pull-ups and
+# bitrate) and returns the bitrate set in kHz
+def apply_binho_link (link, default_hz, path=PROFILE_PATH):
+    khz = get_profile(binho_link_id(link), path).get('i2c_khz')
+    return link.configure(int(khz * 1000) if khz else default_hz)
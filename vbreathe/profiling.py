@@ -0,0 +1,460 @@
+#==========================================================================
+# Profiling a running acquisition
+#--------------------------------------------------------------------------
+# For rigs that slow down after hours: profiles are taken from inside the
+# running core loop, without stopping it, and written next to the session
+# logs.  The hook is a sink (ProfileSink); it costs one queue check per
+# block until a profile is requested.
+#
+# Requests
+#   SIGUSR1                         cProfile for `duration` s
+#   SIGUSR2                         tracemalloc snapshot over `duration` s
+#   control socket (--control)      one command per connection:
+#     profile [S]     cProfile of the acquisition thread for S s
+#     sample [S]      sampling profiler (stack every SAMPLE_MS) for S s
+#     snapshot [S]    allocations made over S s and still held
+#     status          what is running and the per-stage times so far
+#
+# Every output is tagged with the pipeline stage.  While a profile runs
+# the pipeline is timed (core.Pipeline.timings, as replay reports them),
+# and the report opens with the time spent in each stage and sink over
+# the window; the rest of the loop is the source (adapter reads and
+# waits).  cProfile reports also break down what each stage's entry
+# point (__call__ or write) calls, samples are prefixed with the stage
+# running when they were taken (Pipeline.current), and allocations are
+# attributed to the innermost stage or sink method on their stack.
+#
+# Files for a prefix 'SESSION/profile' (one set per request):
+#   profile_<time>_cprofile.prof / .txt     pstats dump and report
+#   profile_<time>_sample.folded / .txt     folded stacks (flamegraph.pl,
+#                                           speedscope) and report
+#   profile_<time>_memory.tracemalloc / .txt  snapshot and report
+#
+# Usage: python -m vbreathe record rigs/wsen.json --control /tmp/vbreathe.ctl
+#        python -m vbreathe.profiling send /tmp/vbreathe.ctl profile 30
+#        kill -USR1 <pid>
+#==========================================================================
+import argparse
+import collections
+import os
+import queue
+import re
+import signal
+import socket
+import sys
+import threading
+import time
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+DURATION_S = 10         # Default profile length (s)
+SAMPLE_MS  = 5          # Sampling profiler interval
+TOP        = 40         # Functions / allocation sites per report
+FRAMES     = 25         # Frames kept per allocation by tracemalloc
+KINDS      = ('profile', 'sample', 'snapshot')
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def _stamp ():
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+# Code objects of a stage or sink: its entry point (write for sinks,
+# __call__ for stages) first, then the other methods of its class
+def _codes (item):
+    if hasattr(item, '__code__'):
+        return [item.__code__]
+    cls = type(item)
+    entry = getattr(cls, 'write', None) or getattr(cls, '__call__', None)
+    codes = [entry.__code__] if hasattr(entry, '__code__') else []
+    for klass in cls.__mro__[:-1]:
+        codes += [f.__code__ for f in vars(klass).values() if hasattr(f, '__code__') and f.__code__ not in codes]
+    return codes
+
+
+# (name, entry code) of every stage and sink of a pipeline
+def _entries (pipeline):
+    items = list(pipeline.stages) + list(pipeline.sinks)
+    return [(name, codes[0]) for name, codes in zip(pipeline.timings, map(_codes, items)) if codes]
+
+
+# Source spans of the stages and sinks: {file: [(first, last, name)]}
+def _stage_spans (pipeline):
+    spans = collections.defaultdict(list)
+    items = list(pipeline.stages) + list(pipeline.sinks)
+    for name, item in zip(pipeline.timings, items):
+        for code in _codes(item):
+            lines = [line for _, _, line in code.co_lines() if line is not None]
+            spans[os.path.abspath(code.co_filename)].append((code.co_firstlineno, max(lines, default=0), name))
+    return spans
+
+
+# The stage or sink whose code is innermost on a tracemalloc traceback
+def _stage_of (traceback, spans):
+    for frame in reversed(traceback):
+        for first, last, name in spans.get(os.path.abspath(frame.filename), ()):
+            if first <= frame.lineno <= last:
+                return name
+    return None
+
+
+# 'function (file:line)' for a frame, as in the folded stack format
+def _frame_label (code, line=None):
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), line or code.co_firstlineno)
+
+
+#==========================================================================
+# PROFILES
+#==========================================================================
+# One running profile: the window it covers and the stage times at its start
+class _Job:
+    def __init__ (self, kind, seconds, path, pipeline):
+        self.kind    = kind
+        self.seconds = seconds
+        self.path    = path
+        self.start   = time.perf_counter()
+        self.end     = self.start + seconds
+        self.rows    = 0
+        self.blocks  = 0
+        self._timings = dict(pipeline.timings)
+
+    # Header of every report: window, throughput and per-stage times
+    def header (self, pipeline, title):
+        elapsed = time.perf_counter() - self.start
+        lines = ["%s, %.1f s from %s, %d blocks, %d rows (%.0f rows/s)"
+                 % (title, elapsed, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() - elapsed)),
+                    self.blocks, self.rows, self.rows / elapsed if elapsed else 0), "",
+                 "%-32s %10s %7s %12s" % ("Stage", "time (s)", "%", "us/block")]
+        busy = 0.0
+        for name, total in pipeline.timings.items():
+            spent = total - self._timings.get(name, 0.0)
+            busy += spent
+            lines.append("%-32s %10.3f %6.1f%% %12.1f" % (name, spent, 100 * spent / elapsed if elapsed else 0,
+                                                          1e6 * spent / self.blocks if self.blocks else 0))
+        rest = max(elapsed - busy, 0.0)
+        lines.append("%-32s %10.3f %6.1f%%" % ("source (reads and waits)", rest, 100 * rest / elapsed if elapsed else 0))
+        return "\n".join(lines) + "\n\n"
+
+
+# Stacks of the acquisition thread every `interval` s, counted by stage
+# and folded stack, in a thread of its own
+class _Sampler:
+    def __init__ (self, ident, pipeline, interval=SAMPLE_MS / 1000.0):
+        self.ident    = ident
+        self.pipeline = pipeline
+        self.interval = interval
+        self.stacks   = collections.Counter()
+        self.stages   = collections.Counter()
+        self._stop    = threading.Event()
+        self._thread  = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run (self):
+        frames = sys._current_frames
+        while not self._stop.wait(self.interval):
+            stage = self.pipeline.current or 'source'
+            frame = frames().get(self.ident)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code, frame.f_lineno))
+                frame = frame.f_back
+            self.stages[stage] += 1
+            self.stacks[";".join([stage] + stack[::-1])] += 1
+
+    def stop (self):
+        self._stop.set()
+        self._thread.join(1.0)
+
+
+#==========================================================================
+# SINK
+#==========================================================================
+# `prefix` is where outputs go ('SESSION/profile'), `control` an optional
+# control socket address ('host:port', ':port' or a Unix socket path).
+# The pipeline is attached once it is built (attach()).  Signal handlers
+# are only installed from the main thread; finish(), which Pipeline.close
+# calls from the acquisition thread before closing the sinks, ends the
+# running profiles there and restores the previous handlers.
+class ProfileSink:
+    def __init__ (self, prefix, status=None, control=None, duration=DURATION_S, signals=True):
+        self.prefix   = prefix
+        self.status   = status
+        self.duration = duration
+        self.pipeline = None
+        self.written  = []
+        self._requests = queue.SimpleQueue()
+        self._notices  = collections.deque()
+        self._jobs     = {}
+        self._ident    = None
+        self._timed    = False
+        self._previous = {}
+        self._stop     = threading.Event()
+        self._listener = None
+        self._socket_path = None
+
+        if signals and threading.current_thread() is threading.main_thread():
+            for name, kind in (('SIGUSR1', 'profile'), ('SIGUSR2', 'snapshot')):
+                if hasattr(signal, name):
+                    signum = getattr(signal, name)
+                    self._previous[signum] = signal.signal(signum, self._signal_handler(kind))
+        if control:
+            self._listen(control)
+
+    def attach (self, pipeline):
+        self.pipeline = pipeline
+        self._timed = pipeline.timed
+        return self
+
+    def _signal_handler (self, kind):
+        def handle (signum, frame):
+            self._requests.put((kind, self.duration))
+        return handle
+
+    # Queue a profile; it starts with the next block
+    def request (self, kind, seconds=None):
+        if kind not in KINDS:
+            raise ValueError("unknown profile %r (one of %s)" % (kind, ", ".join(KINDS)))
+        self._requests.put((kind, float(seconds) if seconds else self.duration))
+
+    #----------------------------------------------------------------------
+    # Control socket
+    #----------------------------------------------------------------------
+    def _listen (self, address):
+        from .stream import parse_address
+        family, address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.unlink(address)
+            self._socket_path = address
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen()
+        self._listener.settimeout(0.2)
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop (self):
+        while not self._stop.is_set():
+            try:
+                sock, _ = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with sock:
+                sock.settimeout(2.0)
+                try:
+                    command = sock.makefile('r').readline().split()
+                    sock.sendall((self._command(command) + "\n").encode())
+                except OSError:
+                    pass
+
+    def _command (self, words):
+        if not words:
+            return "error: empty command"
+        if words[0] == 'status':
+            return self.describe()
+        try:
+            self.request(words[0], words[1] if len(words) > 1 else None)
+        except ValueError as e:
+            return "error: %s" % e
+        return "queued %s for %s s, output %s_*" % (words[0], words[1] if len(words) > 1 else self.duration,
+                                                    self.prefix)
+
+    def describe (self):
+        running = ", ".join("%s (%.0f s left)" % (job.kind, max(job.end - time.perf_counter(), 0))
+                            for job in self._jobs.values()) or "idle"
+        lines = ["profiling: %s; %d file(s) written" % (running, len(self.written))]
+        if self.pipeline is not None and self.pipeline.timed:
+            lines += ["  %-30s %10.3f s" % item for item in self.pipeline.timings.items()]
+        return "\n".join(lines)
+
+    #----------------------------------------------------------------------
+    # Acquisition thread
+    #----------------------------------------------------------------------
+    def write (self, times, values):
+        if self._ident is None:
+            self._ident = threading.get_ident()
+        while self._notices:
+            self.status.message(self._notices.popleft())
+        if self.pipeline is None:
+            return
+        while True:
+            try:
+                kind, seconds = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            self._start(kind, seconds)
+        if not self._jobs:
+            return
+        now = time.perf_counter()
+        for job in list(self._jobs.values()):
+            job.rows += len(times)
+            job.blocks += 1
+            if now >= job.end:
+                self._finish(job)
+
+    def _start (self, kind, seconds):
+        if kind in self._jobs:
+            self._notify("Profiling: %s already running" % kind)
+            return
+        job = _Job(kind, seconds, "%s_%s_%s" % (self.prefix, _stamp(), 'cprofile' if kind == 'profile'
+                                                  else 'memory' if kind == 'snapshot' else kind),
+                   self.pipeline)
+        if kind == 'profile':
+            import cProfile
+            job.profiler = cProfile.Profile()
+            job.profiler.enable()
+        elif kind == 'sample':
+            job.sampler = _Sampler(self._ident, self.pipeline)
+        else:
+            import tracemalloc
+            job.started = not tracemalloc.is_tracing()
+            if job.started:
+                tracemalloc.start(FRAMES)
+            job.baseline = tracemalloc.take_snapshot()
+        self._jobs[kind] = job
+        self.pipeline.timed = True
+        self._notify("Profiling: %s for %g s" % (kind, seconds))
+
+    def _finish (self, job):
+        del self._jobs[job.kind]
+        try:
+            getattr(self, '_finish_' + job.kind)(job)
+        except Exception as e:
+            self._notify("Profiling: %s failed: %s" % (job.kind, e))
+        finally:
+            if not self._jobs:
+                self.pipeline.timed = self._timed
+
+    def _report (self, job, path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+        self.written.append(path)
+        self._notify("Profiling: %s written to %s" % (job.kind, path))
+
+    def _finish_profile (self, job):
+        import io
+        import pstats
+        job.profiler.disable()
+        stats = pstats.Stats(job.profiler, stream=io.StringIO())
+        stats.dump_stats(job.path + '.prof')
+        self.written.append(job.path + '.prof')
+
+        out = io.StringIO()
+        out.write(job.header(self.pipeline, "cProfile of the acquisition thread"))
+        stats.stream = out
+        out.write("Top functions by cumulative time\n")
+        stats.sort_stats('cumulative').print_stats(TOP)
+        stats.sort_stats('cumulative')
+        for name, code in _entries(self.pipeline):
+            out.write("Stage %s: %s, what it calls\n" % (name, _frame_label(code)))
+            stats.print_callees(re.escape("%s:%d(%s)" % (code.co_filename, code.co_firstlineno, code.co_name)))
+        self._report(job, job.path + '.txt', out.getvalue())
+
+    def _finish_sample (self, job):
+        sampler = job.sampler
+        sampler.stop()
+        with open(job.path + '.folded', 'w') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+        self.written.append(job.path + '.folded')
+
+        total = sum(sampler.stages.values()) or 1
+        lines = [job.header(self.pipeline, "Sampled stacks every %d ms" % (sampler.interval * 1000)).rstrip(),
+                 "", "%-32s %8s %7s" % ("Stage", "samples", "%")]
+        lines += ["%-32s %8d %6.1f%%" % (stage, n, 100.0 * n / total) for stage, n in sampler.stages.most_common()]
+        lines += ["", "Hottest stacks (innermost frame, stage)"]
+        leaves = collections.Counter()
+        for stack, count in sampler.stacks.items():
+            frames = stack.split(";")
+            leaves["%-32s %s" % (frames[0], frames[-1])] += count
+        lines += ["%8d %6.1f%%  %s" % (n, 100.0 * n / total, leaf) for leaf, n in leaves.most_common(TOP)]
+        self._report(job, job.path + '.txt', "\n".join(lines) + "\n")
+
+    def _finish_snapshot (self, job):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        if job.started:
+            tracemalloc.stop()
+        snapshot.dump(job.path + '.tracemalloc')
+        self.written.append(job.path + '.tracemalloc')
+
+        # Leave out the profiler's own allocations
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+                  tracemalloc.Filter(False, '<frozen importlib._bootstrap*'))
+        snapshot = snapshot.filter_traces(ignore)
+        growth = snapshot.compare_to(job.baseline.filter_traces(ignore), 'lineno')
+        lines = [job.header(self.pipeline, "Allocations made over the window and still held").rstrip(), ""]
+
+        spans = _stage_spans(self.pipeline)
+        by_stage = collections.Counter()
+        for stat in snapshot.statistics('traceback'):
+            by_stage[_stage_of(stat.traceback, spans)
+                     or "(outside the stages: %s)" % os.path.basename(stat.traceback[-1].filename)] += stat.size
+        lines += ["%-48s %12s" % ("Stage", "held (kB)")]
+        lines += ["%-48s %12.1f" % (name, size / 1024) for name, size in by_stage.most_common(TOP)]
+        lines += ["", "Top allocation sites, growth over the window"]
+        lines += [str(stat) for stat in growth[:TOP]]
+        self._report(job, job.path + '.txt', "\n".join(lines) + "\n")
+
+    def _notify (self, text):
+        if self.status is not None:
+            self._notices.append(text)
+        else:
+            sys.stderr.write(text + "\n")
+
+    # Finish the running profiles with what they have and put the previous
+    # signal handlers back.  Called from the acquisition thread (see
+    # Pipeline.close), as cProfile only stops on the thread it profiles.
+    def finish (self):
+        for job in list(self._jobs.values()):
+            self._finish(job)
+        if threading.current_thread() is threading.main_thread():
+            for signum, handler in self._previous.items():
+                signal.signal(signum, handler)
+            self._previous = {}
+
+    def close (self):
+        self.finish()
+        self._stop.set()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        if self._socket_path and os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        while self._notices:
+            self.status.message(self._notices.popleft())
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+# Send one command to a running acquisition's control socket, returns the reply
+def send (address, command, timeout=5.0):
+    from .stream import parse_address
+    family, address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall((command.strip() + "\n").encode())
+        return sock.makefile('r').read().strip()
+
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Profile a running acquisition through its control socket")
+    parser.add_argument('command', choices=['send'])
+    parser.add_argument('address', help="control socket: host:port, :port or Unix socket path")
+    parser.add_argument('request', nargs='+', help="profile|sample|snapshot [SECONDS], or status")
+    args = parser.parse_args(argv)
+    print(send(args.address, " ".join(args.request)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
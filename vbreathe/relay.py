@@ -0,0 +1,114 @@
+#==========================================================================
+# Relay cycling (3-ch RPi Relay Board)
+#--------------------------------------------------------------------------
+# Presses a button (or squeezes the bag) through a relay channel on a
+# fixed cycle: released for `release_s`, pressed for `press_s`.  The relays
+# are active-low.
+#
+# RelayCycle is polled rather than sleeping, so it can run inside the
+# acquisition loop as a sink (one poll per block) as well as on its own
+# with run().
+#==========================================================================
+import time
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+RELAY1_PIN = 26         # BCM pin of relay channel 1 (channels 2 and 3 are 20 and 21, unused)
+RELEASE_S  = 3.0
+PRESS_S    = 5.0
+
+
+#==========================================================================
+# RELAY
+#==========================================================================
+class Relay:
+    def __init__ (self, pin=RELAY1_PIN, active_low=True):
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
+        self.pin = pin
+        self.active_low = active_low
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(pin, GPIO.OUT)
+
+    def set (self, pressed):
+        self._gpio.output(self.pin, not pressed if self.active_low else pressed)
+
+    def close (self):
+        self._gpio.cleanup()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+class RelayCycle:
+    def __init__ (self, relay, release_s=RELEASE_S, press_s=PRESS_S, status=None):
+        self.relay     = relay
+        self.release_s = release_s
+        self.press_s   = press_s
+        self.status    = status
+        self.presses   = 0
+        self.pressed   = False
+        self.halted    = False
+        self.relay.set(False)
+        self._next     = time.monotonic() + release_s
+
+    # Advance the cycle; returns the time of the next transition
+    def poll (self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.halted:
+            return now + self.release_s
+        if now >= self._next:
+            if self.pressed:
+                self.presses += 1
+                self.pressed = False
+                self._next = now + self.release_s
+            else:
+                if self.status is not None:
+                    self.status.message("Cycling relays # %d" % self.presses)
+                self.pressed = True
+                self._next = now + self.press_s
+            self.relay.set(self.pressed)
+        return self._next
+
+    # Release the relay and stop cycling it (an alarm's relay_off action)
+    def halt (self):
+        self.halted = True
+        self.pressed = False
+        self.relay.set(False)
+        if self.status is not None:
+            self.status.message("Relay cycling stopped after %d presses" % self.presses)
+
+    # Sink interface: one poll per acquired block
+    def write (self, times, values):
+        self.poll()
+
+    # Release the relay and free the GPIO pins
+    def close (self):
+        try:
+            self.relay.set(False)
+        finally:
+            self.relay.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+# Cycle the relay on its own until `stop()` returns True or Ctrl-C.  The
+# relay is released and the GPIO pins freed on any exit.
+def run (cycle, stop=None):
+    with cycle:
+        try:
+            while stop is None or not stop():
+                time.sleep(max(0.0, min(0.1, cycle.poll() - time.monotonic())))
+        except KeyboardInterrupt:
+            pass
+    return cycle.presses
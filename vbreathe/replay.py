@@ -0,0 +1,177 @@
+#==========================================================================
+# Replay engine
+#--------------------------------------------------------------------------
+# Feeds recorded sessions back into the core loop (vbreathe.core) as if
+# they were coming from the adapter: same blocks, same stages, same sinks.
+# Used to develop processing offline and to measure how fast the
+# downstream stages are (Pipeline.timed) without the hardware.
+#
+# Sources:
+#   session directories written by record mode (segments in order)
+#   CSV logs (header: timestamp + channel names)
+#   compressed archives (vbreathe.archive, *.vba): the archived counts,
+#     decoded back into the rig's channels when a rig is given
+#
+# Pacing: speed=1 replays in real time, speed=N N times faster, and
+# speed=None as fast as the pipeline can take it.
+#==========================================================================
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+BLOCK_ROWS = 256        # Rows per replayed block, about one adapter burst
+
+
+#==========================================================================
+# PACING
+#==========================================================================
+# Maps log time to wall time at `speed` and waits until each block is due.
+# `lag` is how far the replay is behind schedule (s): a pipeline that
+# cannot keep up at this speed shows a growing lag.
+class Pacer:
+    def __init__ (self, speed=1.0):
+        self.speed  = speed
+        self.lag    = 0.0
+        self._origin = None
+
+    def wait (self, t_log):
+        if not self.speed:
+            return
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = (t_log, now)
+        t0, w0 = self._origin
+        due = w0 + (t_log - t0) / self.speed
+        if due > now:
+            time.sleep(due - now)
+            self.lag = 0.0
+        else:
+            self.lag = now - due
+
+
+#==========================================================================
+# SOURCES
+#==========================================================================
+# A source is called by core.acquire and returns the next (times, values)
+# block, or None at the end of the recording.  Blocks are released when
+# their last sample is due.
+class ReplaySource:
+    def __init__ (self, blocks, speed=1.0):
+        self._blocks = blocks
+        self.pacer   = Pacer(speed)
+        self.rows    = 0
+
+    def __call__ (self):
+        block = next(self._blocks, None)
+        if block is None:
+            return None
+        times, values = block
+        self.pacer.wait(times[-1])
+        self.rows += len(times)
+        return times, values
+
+
+def _split (blocks, block_rows):
+    for times, values in blocks:
+        for i in range(0, len(times), block_rows):
+            yield times[i:i + block_rows], values[i:i + block_rows]
+
+
+# Column names of a log written by record mode
+def csv_channels (path):
+    with open(path, newline='') as file:
+        return next(csv.reader(file))[1:]
+
+
+def csv_source (path, channels, speed=1.0, block_rows=BLOCK_ROWS, t0=None, t1=None):
+    from .csvlog import CsvRangeReader, read_csv_blocks
+    header = ['timestamp'] + csv_channels(path)
+    missing = [c for c in channels if c not in header]
+    if missing:
+        raise ValueError("%s has no column %s" % (path, ", ".join(repr(c) for c in missing)))
+    columns = [header.index(c) for c in channels]
+
+    if t0 is None and t1 is None:
+        blocks = read_csv_blocks(path, columns)
+    else:
+        # Seek straight to the range with the sparse time index
+        reader = CsvRangeReader(path)
+        blocks = reader.blocks(t0 if t0 is not None else -np.inf, t1 if t1 is not None else np.inf, columns)
+    return ReplaySource(_split(blocks, block_rows), speed)
+
+
+# `counts`, when given, maps the archived channel names to a function
+# turning a count block into the `channels` block (Rig.counts_decoder);
+# without it the archive must hold every channel as such.
+def archive_source (path, channels, speed=1.0, block_rows=BLOCK_ROWS, t0=None, t1=None, counts=None):
+    from .archive import ArchiveReader
+    archive = ArchiveReader(path)
+    if counts is not None:
+        decode = counts(archive.channels)
+    else:
+        missing = [c for c in channels if c not in archive.channels]
+        if missing:
+            archive.close()
+            raise ValueError("%s has no channel %s" % (path, ", ".join(repr(c) for c in missing)))
+        columns = [archive.channels.index(c) for c in channels]
+
+        def decode (block):
+            return block[:, columns].astype(np.float64)
+
+    def blocks ():
+        try:
+            for times, block in archive.iter_range(t0, t1):
+                yield times, decode(block)
+        finally:
+            archive.close()
+    return ReplaySource(_split(blocks(), block_rows), speed)
+
+
+# All segments of a session, in recording order, as one source
+def session_source (directory, channels, speed=1.0, block_rows=BLOCK_ROWS, t0=None, t1=None):
+    from .session import load_manifest
+    segments = [s for s in load_manifest(directory)['segments']
+                if s.get('rows') or not s.get('closed')]
+    if t0 is not None:
+        segments = [s for s in segments if s.get('end') is None or s['end'] >= t0]
+    if t1 is not None:
+        segments = [s for s in segments if s.get('start') is None or s['start'] <= t1]
+
+    def blocks ():
+        for segment in segments:
+            source = csv_source(os.path.join(directory, segment['file']), channels, None, block_rows, t0, t1)
+            yield from source._blocks
+    return ReplaySource(blocks(), speed)
+
+
+# Source for a recording, chosen by type.  `counts` is only used for
+# archives, see archive_source.
+def open_source (path, channels, speed=1.0, block_rows=BLOCK_ROWS, t0=None, t1=None, counts=None):
+    if os.path.isdir(path):
+        return session_source(path, channels, speed, block_rows, t0, t1)
+    if path.endswith('.vba'):
+        return archive_source(path, channels, speed, block_rows, t0, t1, counts)
+    return csv_source(path, channels, speed, block_rows, t0, t1)
+
+
+#==========================================================================
+# REPORT
+#==========================================================================
+# Per-stage throughput of a timed pipeline after a replay
+def report (pipeline, elapsed, source=None, out=sys.stdout):
+    rows = pipeline.rows
+    out.write("Replayed %d rows in %.2f s: %.0f rows/s end to end\n" % (rows, elapsed, rows / max(elapsed, 1e-9)))
+    if source is not None and source.pacer.speed:
+        out.write("Pacing %gx real time, final lag %.3f s\n" % (source.pacer.speed, source.pacer.lag))
+    out.write("  %-28s %10s %14s %7s\n" % ("stage", "time (s)", "rows/s", "share"))
+    total = sum(pipeline.timings.values()) or 1e-9
+    for name, seconds in pipeline.timings.items():
+        out.write("  %-28s %10.3f %14.0f %6.1f%%\n"
+                  % (name, seconds, rows / max(seconds, 1e-9), 100.0 * seconds / total))
@@ -0,0 +1,435 @@
+#==========================================================================
+# Declarative rig configuration
+#--------------------------------------------------------------------------
+# A rig file (JSON, or TOML on Python 3.11+ / with tomli installed)
+# describes the adapter and the sensors on its bus:
+#
+#   {
+#     "name": "wsen",
+#     "adapter": {"type": "binho", "i2c_khz": 100},
+#     "burst": 32,
+#     "sensors": [
+#       {"name": "pressure", "address": "0x6c", "length": 4, "decoder": "wsen", "stale": "repeat"}
+#     ]
+#   }
+#
+# compile_rig() turns it into a Rig: a tuple of transaction closures, one
+# per sensor, with the address, command, buffer sizes and decoder
+# constants bound as locals.  The acquisition loop then only calls
+# closures; no configuration dictionary is consulted while sampling.
+#
+# Adapter types (all take "delay_ms", the sensor delay removed from read
+# times, see vbreathe.align): 'aardvark' (port, i2c_khz, sensor_power), 'binho'
+# (device_id, i2c_khz; with "port" the serial port is driven directly with
+# "pipeline_depth" commands in flight, see transport.BinhoPipelinedTransport)
+# and 'software' (the emulator.SoftwareBus stand-in,
+# fed with a synthetic breathing waveform).
+#
+# Decoders: 'honeywell' (force sensor, output_min/output_max/full_scale),
+# 'sensirion' (signed 16-bit value / scale, e.g. SDP differential
+# pressure; "crc": true drops frames failing the CRC), 'wsen' (WSEN-PDUS pressure and temperature) and 'raw'
+# (big-endian 16-bit words).
+#
+# Optional sections: 'filters' (filtered copies of channels), 'breaths'
+# (breath detection on a channel), 'record' (envelopes, 1 s / 1 min / 1 h
+# rollups, raw count archive, segment rotation after segment_mb /
+# segment_minutes), 'relay' (relay cycling in the same loop), 'alarms'
+# (rules checked on every block, see vbreathe.alarms) and 'calibration'
+# (the Microforce gel weight procedure).  "session_dir" overrides the
+# record-mode session directory pattern ('{name}_{time}').  See rigs/ for examples and
+# vbreathe.cli for how each mode uses them.
+#==========================================================================
+import contextlib
+import json
+import time
+
+import numpy as np
+
+from . import emulator
+from . import honeywell
+from . import profile
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+DEFAULT_BURST   = 1
+DEFAULT_BUS     = 'vbreathe-rig'
+DEFAULT_SESSION = '{name}_{time}'
+
+
+#==========================================================================
+# CONFIG LOADING
+#==========================================================================
+def load_config (path):
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        with open(path, 'rb') as file:
+            return tomllib.load(file)
+    with open(path) as file:
+        return json.load(file)
+
+
+# Addresses may be written as "0x28" or 40
+def _int (value):
+    return int(value, 0) if isinstance(value, str) else int(value)
+
+
+#==========================================================================
+# DECODERS
+#==========================================================================
+# Each factory takes the sensor's config and returns (decode, channels,
+# derived): decode maps an (N x length) uint8 frame block to an
+# (N x len(channels)) float64 block, and derived maps a decoded channel to
+# (count channel, function) for rebuilding it from archived integer counts
+# (see Rig.counts_decoder).  Constants are bound once here, outside the
+# hot loop.
+def _honeywell (spec):
+    out_min = float(spec.get('output_min', 3277))
+    gain = float(spec.get('full_scale', 15)) / (float(spec.get('output_max', 13107)) - out_min)
+    unit = spec.get('unit', 'N')
+    name = spec['name']
+    decode_frames = honeywell.decode
+    temperature_c = honeywell.temperature_c
+
+    def decode (frames):
+        _, bridge, temperature = decode_frames(frames)
+        return np.column_stack(((bridge - out_min) * gain, bridge, temperature_c(temperature)))
+    channels = ['%s (%s)' % (name, unit), '%s (counts)' % name, '%s temperature (C)' % name]
+    return decode, channels, {channels[0]: (channels[1], lambda bridge: (bridge - out_min) * gain)}
+
+
+def _sensirion (spec):
+    scale = 1.0 / float(spec.get('scale', 187))
+    name = spec['name']
+
+    def decode (frames):
+        raw = (frames[:, 0].astype(np.int16) << 8) | frames[:, 1]
+        return (raw.astype(np.float64) * scale)[:, None]
+    return decode, ['%s (Pa)' % name], {}
+
+
+def _wsen (spec):
+    offset = float(spec.get('offset', 3277))
+    gain = float(spec.get('gain_pa', 7.63e-3))
+    zero = float(spec.get('zero_pa', -100.0))
+    name = spec['name']
+
+    def decode (frames):
+        f = frames.astype(np.int64)
+        raw = (f[:, 0] << 8) | f[:, 1]
+        temperature = (f[:, 2] << 8) | f[:, 3]
+        return np.column_stack(((raw - offset) * gain + zero, raw, temperature))
+    channels = ['%s (Pa)' % name, '%s raw' % name, '%s temperature raw' % name]
+    return decode, channels, {channels[0]: (channels[1], lambda raw: (raw - offset) * gain + zero)}
+
+
+def _raw (spec):
+    words = spec['length'] // 2
+    name = spec['name']
+
+    def decode (frames):
+        f = frames[:, :words * 2].astype(np.uint16)
+        return ((f[:, 0::2] << 8) | f[:, 1::2]).astype(np.float64)
+    return decode, ['%s word %d' % (name, i) for i in range(words)], {}
+
+
+DECODERS = {
+    'honeywell': _honeywell,
+    'sensirion': _sensirion,
+    'wsen':      _wsen,
+    'raw':       _raw,
+}
+
+
+# Emulated frames for the software adapter, matching each decoder
+def _emulated_frames (spec):
+    decoder = spec.get('decoder', 'raw')
+    wave = emulator.breathing_waveform(seconds=60.0, fs=float(spec.get('update_hz', 100)))
+    if decoder == 'honeywell':
+        return emulator.encode_honeywell(wave)
+    if decoder == 'sensirion':
+        return emulator.encode_sensirion(wave - wave.mean())
+    if decoder == 'wsen':
+        # Centred on the count that decodes to 0 Pa, so flow changes sign
+        zero = float(spec.get('offset', 3277)) - float(spec.get('zero_pa', -100.0)) / float(spec.get('gain_pa', 7.63e-3))
+        wave = wave - wave.mean() + zero
+    counts = np.round(wave).astype(np.uint16)
+    frames = np.zeros((len(counts), spec['length']), dtype=np.uint8)
+    frames[:, 0] = counts >> 8
+    frames[:, 1] = counts & 0xff
+    if spec['length'] >= 4:
+        frames[:, 2:4] = (0x19, 0x00)
+    return frames
+
+
+#==========================================================================
+# TRANSACTION PLANS
+#==========================================================================
+# Compile one sensor into a closure `read(link)` that performs its burst
+# and returns (times, values, valid, fresh): monotonic read times, the
+# decoded (N x channels) block, the mask of complete reads and the mask of
+# reads that brought a new sample.  Returns (read, channels, tracker,
+# derived), derived as from the decoder factory.
+def compile_sensor (spec, burst):
+    addr = _int(spec['address'])
+    length = int(spec['length'])
+    command = bytes.fromhex(spec['command']) if spec.get('command') else None
+    delay = float(spec.get('delay_ms', 0)) / 1000.0
+    n = int(spec.get('burst', burst))
+    decoder = spec.get('decoder', 'raw')
+    if decoder not in DECODERS:
+        raise ValueError("sensor %s: unknown decoder %r" % (spec['name'], decoder))
+    decode, channels, derived = DECODERS[decoder](spec)
+
+    # Sensirion CRC over the first data word
+    check = None
+    if spec.get('crc'):
+        table = emulator.crc8_table()
+
+        def check (frames):
+            return table[(frames[:, 0].astype(np.intp) << 8) | frames[:, 1]] == frames[:, 2]
+
+    mode = spec.get('stale')
+    tracker = honeywell.StaleTracker(mode=mode) if mode else None
+    process = tracker.process if tracker else None
+    fixed_interval = float(spec.get('interval_ms', 0)) / 1000.0
+    if tracker is None:
+        interval = lambda: fixed_interval
+    elif fixed_interval:
+        interval = lambda: max(fixed_interval, tracker.poll_interval())
+    else:
+        interval = tracker.poll_interval
+
+    if command is None:
+        def read (link):
+            frames, times, valid = link.read_burst(addr, length, n, interval())
+            if check is not None:
+                valid &= check(frames)
+            fresh = valid if process is None else valid & process(frames, times)
+            return times, decode(frames), valid, fresh
+    else:
+        # Triggered sensors: write the command, wait for the conversion, read
+        def read (link):
+            frames = np.zeros((n, length), dtype=np.uint8)
+            times = np.empty(n)
+            valid = np.zeros(n, dtype=bool)
+            write = link.write
+            get = link.read
+            for i in range(n):
+                if write(addr, command) == len(command):
+                    if delay:
+                        time.sleep(delay)
+                    data = get(addr, length)
+                    if len(data) == length:
+                        frames[i] = np.frombuffer(data, dtype=np.uint8)
+                        valid[i] = True
+                times[i] = time.monotonic()
+            if check is not None:
+                valid &= check(frames)
+            return times, decode(frames), valid, valid
+    return read, channels, tracker, derived
+
+
+# Compile a filter spec into a core.FilterStage on the named channel
+def compile_filter (spec, channels):
+    from .core import FilterStage
+    from .filters import FilterChain, LowPass, MedianDespike, MovingAverage, Notch
+    if spec['channel'] not in channels:
+        raise ValueError("filter on unknown channel %r" % spec['channel'])
+    fs = float(spec.get('rate_hz', 100))
+    chain = []
+    if spec.get('despike'):
+        chain.append(MedianDespike(int(spec['despike'])))
+    if spec.get('notch_hz'):
+        notch = float(spec['notch_hz'])
+        if not 0 < notch < fs / 2:
+            raise ValueError("filter on %r: notch_hz %g must be between 0 and the Nyquist frequency of rate_hz %g"
+                             % (spec['channel'], notch, fs))
+        chain.append(Notch(notch, fs))
+    if spec.get('lowpass_hz'):
+        chain.append(LowPass(float(spec['lowpass_hz']), fs))
+    if spec.get('average'):
+        chain.append(MovingAverage(int(spec['average'])))
+    return FilterStage(channels.index(spec['channel']), FilterChain(*chain))
+
+
+class Rig:
+    def __init__ (self, config):
+        self.config  = config
+        self.name    = config.get('name', 'rig')
+        self.adapter = dict(config.get('adapter', {'type': 'software'}))
+        self.bus     = config.get('bus', 'vbreathe-%s' % self.name.lower() if 'name' in config else DEFAULT_BUS)
+        self.session = config.get('session_dir', DEFAULT_SESSION)
+        self.adapter_id = None
+        self.clock   = None
+        self.record  = dict(config.get('record', {}))
+        self.breaths = config.get('breaths')
+        self.relay   = config.get('relay')
+        self.alarms  = config.get('alarms')
+        self.calibration = config.get('calibration')
+        burst = int(config.get('burst', DEFAULT_BURST))
+
+        sensors = config.get('sensors', [])
+        if not sensors and not self.relay:
+            raise ValueError("rig %s has no sensors" % self.name)
+        plans = [compile_sensor(spec, burst) for spec in sensors]
+        self.sensors  = [spec['name'] for spec in sensors]
+        self.reads    = tuple(p[0] for p in plans)
+        self.trackers = [p[2] for p in plans]
+        self.specs    = sensors
+        self.derived  = {k: v for p in plans for k, v in p[3].items()}
+
+        # Sensor channels first, then one filtered column per filter stage
+        self.sensor_channels = [c for p in plans for c in p[1]]
+        self.channels = list(self.sensor_channels)
+        self.stages = []
+        for spec in config.get('filters', []):
+            self.stages.append(compile_filter(spec, self.channels))
+            self.channels.append(spec.get('output', spec['channel'] + ' filtered'))
+        self.width = 1 + len(self.channels)
+
+    def column (self, name):
+        try:
+            return self.channels.index(name)
+        except ValueError:
+            raise ValueError("rig %s has no channel %r (channels: %s)" % (self.name, name, ", ".join(self.channels)))
+
+    # Function turning a block of archived counts (vbreathe.archive, columns
+    # `names`) into the sensor channels: a channel archived as such is
+    # copied, a decoded one is computed from its count column, and a
+    # channel that cannot be rebuilt (e.g. a temperature that was not
+    # archived) is NaN.  Raises ValueError when none can be rebuilt.
+    def counts_decoder (self, names):
+        names = list(names)
+        plan = []
+        for channel in self.sensor_channels:
+            if channel in names:
+                plan.append((names.index(channel), None))
+            elif channel in self.derived and self.derived[channel][0] in names:
+                source, convert = self.derived[channel]
+                plan.append((names.index(source), convert))
+            else:
+                plan.append((None, None))
+        if all(column is None for column, _ in plan):
+            raise ValueError("rig %s: the archive (%s) holds none of its channels"
+                             % (self.name, ", ".join(names)))
+
+        def decode (counts):
+            out = np.full((len(counts), len(plan)), np.nan)
+            for i, (column, convert) in enumerate(plan):
+                if column is not None:
+                    c = counts[:, column].astype(np.float64)
+                    out[:, i] = c if convert is None else convert(c)
+            return out
+        return decode
+
+    #----------------------------------------------------------------------
+    # One acquisition cycle: every sensor's burst, combined row by row.
+    # Returns (monotonic times, values); a row is kept when every sensor's
+    # read was valid and at least one of them brought a new sample.
+    #----------------------------------------------------------------------
+    def cycle (self, link):
+        reads = self.reads
+        if len(reads) == 1:
+            times, values, _, fresh = reads[0](link)
+            return times[fresh], values[fresh]
+
+        parts = [read(link) for read in reads]
+        n = min(len(p[0]) for p in parts)
+        times = parts[0][0][:n]
+        values = np.hstack([p[1][:n] for p in parts])
+        valid = np.logical_and.reduce([p[2][:n] for p in parts])
+        fresh = np.logical_or.reduce([p[3][:n] for p in parts])
+        keep = valid & fresh
+        return times[keep], values[keep]
+
+    # Source for the core loop: cycles with read times on the wall clock,
+    # through the adapter's clock (vbreathe.align), kept as self.clock
+    def source (self, link):
+        from .align import AdapterClock
+        cycle = self.cycle
+        clock = self.clock = AdapterClock(self.adapter_id or self.adapter.get('type', 'software'),
+                                          float(self.adapter.get('delay_ms', 0)) / 1000.0)
+        observe = clock.observe
+        to_wall = clock.to_wall
+
+        def read ():
+            times, values = cycle(link)
+            observe(getattr(link, 'read_time', None), len(times))
+            return to_wall(times), values
+        return read
+
+    #----------------------------------------------------------------------
+    # Adapter setup
+    #----------------------------------------------------------------------
+    # The adapter link as a context manager: powered down and closed on
+    # any exit
+    @contextlib.contextmanager
+    def connect (self):
+        link, close = self.open()
+        try:
+            yield link
+        finally:
+            close()
+
+    # Returns (link, close) for the configured adapter
+    def open (self):
+        kind = self.adapter.get('type', 'software')
+        from .transport import AardvarkTransport, BinhoPipelinedTransport, BinhoTransport, SoftwareTransport
+
+        if kind == 'aardvark':
+            import aardvark_py as aa
+            port = int(self.adapter.get('port', 0))
+            handle = aa.aa_open(port)
+            if handle <= 0:
+                raise IOError("Unable to open Aardvark device on port %d (error %d)" % (port, handle))
+            aa.aa_configure(handle, aa.AA_CONFIG_GPIO_I2C)
+            aa.aa_i2c_pullup(handle, aa.AA_I2C_PULLUP_BOTH)
+            if self.adapter.get('sensor_power', True):
+                aa.aa_gpio_set(handle, aa.AA_GPIO_SCK)   # GPIO 03 (pin 7) powers the sensor at 3.3 V
+            profile.apply_aardvark(handle, self.adapter.get('i2c_khz', 100))
+            self.adapter_id = profile.aardvark_id(handle)
+
+            def close ():
+                # Power the sensor down before letting go of the adapter
+                if self.adapter.get('sensor_power', True):
+                    aa.aa_gpio_set(handle, 0x00)
+                aa.aa_close(handle)
+            return AardvarkTransport(handle), close
+
+        if kind == 'binho' and self.adapter.get('port'):
+            # The sensor addresses are pinned in the config, so no bus scan is needed
+            link = BinhoPipelinedTransport(self.adapter['port'], int(self.adapter.get('pipeline_depth', 8)))
+            profile.apply_binho_link(link, int(self.adapter.get('i2c_khz', 100)) * 1000)
+            self.adapter_id = profile.binho_link_id(link)
+            return link, link.close
+
+        if kind == 'binho':
+            from binho import binhoHostAdapter
+            device_id = self.adapter.get('device_id')
+            binho = binhoHostAdapter(deviceID=device_id) if device_id else binhoHostAdapter()
+            binho.operationMode = "I2C"
+            binho.i2c.useInternalPullUps = True
+            profile.apply_binho(binho, int(self.adapter.get('i2c_khz', 100)) * 1000)
+            self.adapter_id = profile.binho_id(binho)
+            return BinhoTransport(binho), binho.close
+
+        if kind == 'software':
+            sensors = {_int(spec['address']): emulator.SoftwareSensor(_emulated_frames(spec), spec.get('update_hz'))
+                       for spec in self.specs}
+            bus = emulator.SoftwareBus(sensors, latency=float(self.adapter.get('latency_ms', 0)) / 1000.0,
+                                       bitrate_khz=self.adapter.get('i2c_khz', 400))
+            self.adapter_id = 'software'
+            return SoftwareTransport(bus), lambda: None
+
+        raise ValueError("unknown adapter type %r" % kind)
+
+
+def compile_rig (config):
+    if isinstance(config, str):
+        config = load_config(config)
+    return Rig(config)
@@ -0,0 +1,301 @@
+#==========================================================================
+# Shared-memory sample bus
+#--------------------------------------------------------------------------
+# Single-writer / multi-reader ring of float64 rows (time + channels) in a
+# multiprocessing.shared_memory block.  The acquisition process owns the
+# adapter and is the only writer; any number of local consumers (live view,
+# recorder, breath detector, alarms) attach to the ring by name and read
+# from it without touching the adapter.
+#
+# There are no locks; the header works as a seqlock.  Before storing rows
+# the writer publishes the count it is about to reach (write begin), and
+# only after storing them advances the write count.  Readers take rows up
+# to the write count, and after looking at the data compare their
+# sequence numbers with write begin: a row older than write begin minus
+# the capacity was being overwritten, even if the count has not moved
+# yet.  The writer never waits for a reader, so a slow or frozen consumer
+# can never stall sampling.
+#
+# Memory layout:
+#   header    int64[8]    write count, capacity, width, closed flag,
+#                         write begin, reserved
+#   channels  1024 bytes  JSON list of channel names (after the time column)
+#   data      float64[capacity, width]
+#==========================================================================
+import json
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+HEADER_WORDS   = 8
+CHANNEL_BYTES  = 1024
+DATA_OFFSET    = HEADER_WORDS * 8 + CHANNEL_BYTES
+
+HDR_COUNT    = 0
+HDR_CAPACITY = 1
+HDR_WIDTH    = 2
+HDR_CLOSED   = 3
+HDR_BEGIN    = 4
+
+
+#==========================================================================
+# HELPERS
+#==========================================================================
+# On POSIX the resource tracker unlinks every segment a process has
+# attached to when that process exits, which would remove the ring from
+# under the writer as soon as a viewer closes.  Only the creator should
+# own the segment.
+def _untrack (shm):
+    if os.name != 'posix':
+        return
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+# Create a named segment, replacing one left behind by a crashed writer
+def _create (name, size):
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        old = shared_memory.SharedMemory(name=name, create=False)
+        old.close()
+        old.unlink()
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+
+#==========================================================================
+# SAMPLE RING (writer, and attach point for readers)
+#==========================================================================
+class SampleRing:
+    def __init__ (self, name=None, capacity=65536, width=2, channels=None, create=True):
+        if create:
+            size = DATA_OFFSET + capacity * width * 8
+            self._shm = _create(name, size) if name else shared_memory.SharedMemory(create=True, size=size)
+            self._header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=self._shm.buf)
+            self._header[:] = 0
+            self._header[HDR_CAPACITY] = capacity
+            self._header[HDR_WIDTH] = width
+            names = json.dumps(list(channels or [])).encode()[:CHANNEL_BYTES]
+            self._shm.buf[HEADER_WORDS * 8:HEADER_WORDS * 8 + CHANNEL_BYTES] = names.ljust(CHANNEL_BYTES, b' ')
+        else:
+            self._shm = shared_memory.SharedMemory(name=name, create=False)
+            _untrack(self._shm)
+            self._header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=self._shm.buf)
+            capacity = int(self._header[HDR_CAPACITY])
+            width = int(self._header[HDR_WIDTH])
+
+        self.owner    = create
+        self.capacity = capacity
+        self.width    = width
+        self._data    = np.ndarray((capacity, width), dtype=np.float64,
+                                   buffer=self._shm.buf, offset=DATA_OFFSET)
+
+    # Attach to a ring created by another process
+    @classmethod
+    def attach (cls, name):
+        return cls(name=name, create=False)
+
+    @property
+    def name (self):
+        return self._shm.name
+
+    # Names of the columns after the time column
+    @property
+    def channels (self):
+        raw = bytes(self._shm.buf[HEADER_WORDS * 8:HEADER_WORDS * 8 + CHANNEL_BYTES]).strip()
+        try:
+            return json.loads(raw.decode()) if raw else []
+        except ValueError:
+            return []
+
+    # Total number of rows ever written (the sequence number of the next row)
+    @property
+    def count (self):
+        return int(self._header[HDR_COUNT])
+
+    # Count the writer is writing up to: rows older than this minus the
+    # capacity may already be overwritten
+    @property
+    def written (self):
+        header = self._header
+        return max(int(header[HDR_BEGIN]), int(header[HDR_COUNT]))
+
+    # True once the writer has shut down
+    @property
+    def closed (self):
+        return self._header is None or bool(self._header[HDR_CLOSED])
+
+    #----------------------------------------------------------------------
+    # Writer side
+    #----------------------------------------------------------------------
+    # Store one row.  Write begin is raised before the slot is touched and
+    # the count only after the row is in place, so a reader can tell a
+    # slot that is being refilled.
+    def push (self, row):
+        n = int(self._header[HDR_COUNT])
+        self._header[HDR_BEGIN] = n + 1
+        self._data[n % self.capacity] = row
+        self._header[HDR_COUNT] = n + 1
+
+    # Store an (N x width) block with at most two slice copies
+    def push_block (self, block):
+        block = np.asarray(block, dtype=np.float64)
+        rows = len(block)
+        if rows == 0:
+            return
+        n = int(self._header[HDR_COUNT])
+        self._header[HDR_BEGIN] = n + rows
+        if rows > self.capacity:
+            # Only the last `capacity` rows survive
+            n += rows - self.capacity
+            block = block[-self.capacity:]
+            rows = self.capacity
+        start = n % self.capacity
+        first = min(rows, self.capacity - start)
+        self._data[start:start + first] = block[:first]
+        if first < rows:
+            self._data[:rows - first] = block[first:]
+        self._header[HDR_COUNT] = n + rows
+
+    #----------------------------------------------------------------------
+    # Reader side
+    #----------------------------------------------------------------------
+    # Copy of the most recent `n` rows, oldest first.  Rows that were
+    # overwritten by the writer while copying are dropped from the front.
+    def latest (self, n):
+        end = int(self._header[HDR_COUNT])
+        n = min(n, end, self.capacity)
+        if n <= 0:
+            return np.empty((0, self.width))
+        begin = end - n
+        idx = np.arange(begin, end) % self.capacity
+        out = self._data[idx]
+
+        # The writer may have lapped the start of the copy
+        lapped = self.written - self.capacity - begin
+        if lapped > 0:
+            out = out[lapped:]
+        return out
+
+    # Zero-copy views of rows [begin, end) as at most two slices of the
+    # shared buffer.  Only valid until the writer laps `begin`; see
+    # RingReader.still_valid.
+    def views (self, begin, end):
+        if end <= begin:
+            return []
+        start = begin % self.capacity
+        stop = start + (end - begin)
+        if stop <= self.capacity:
+            return [self._data[start:stop]]
+        return [self._data[start:], self._data[:stop - self.capacity]]
+
+    # Structured dtype of a row ('time' + channels, see vbreathe.sample):
+    # ring.read(...).view(ring.dtype)[:, 0] gives named columns, no copy
+    @property
+    def dtype (self):
+        from .sample import block_dtype
+        channels = self.channels
+        return block_dtype(channels + ['column %d' % i for i in range(len(channels) + 1, self.width)])
+
+    def reader (self, from_start=False):
+        return RingReader(self, from_start)
+
+    def close (self):
+        if self.owner and self._header is not None:
+            self._header[HDR_CLOSED] = 1
+        self._header = None
+        self._data = None
+        self._shm.close()
+        if self.owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+#==========================================================================
+# RING READER
+#==========================================================================
+# One consumer's cursor on a ring.  Every reader keeps its own position, so
+# consumers run independently and a slow one only loses its own rows.
+#
+#   reader = RingReader.attach('vbreathe-wsen')
+#   while not reader.ring.closed:
+#       for view in reader.read_views():
+#           process(view)               # zero-copy NumPy view
+#       if not reader.still_valid():
+#           ...                         # writer lapped us while processing
+class RingReader:
+    def __init__ (self, ring, from_start=False):
+        self.ring  = ring
+        self.lost  = 0      # Rows overwritten before this reader got to them
+        self.first = 0      # Sequence number of the first row of the last read
+        self._next = max(0, ring.count - ring.capacity) if from_start else ring.count
+        self._held = self._next
+
+    @classmethod
+    def attach (cls, name, from_start=False):
+        return cls(SampleRing.attach(name), from_start)
+
+    # Rows written since the last read
+    @property
+    def pending (self):
+        return self.ring.count - self._next
+
+    def _advance (self, max_rows):
+        end = self.ring.count
+        oldest = end - self.ring.capacity
+        if self._next < oldest:
+            self.lost += oldest - self._next
+            self._next = oldest
+        if max_rows is not None:
+            end = min(end, self._next + max_rows)
+        begin = self._next
+        self._next = end
+        self._held = begin
+        self.first = begin
+        return begin, end
+
+    # Zero-copy views (at most two) of the rows written since the last
+    # call.  The views alias the shared buffer: use them before the writer
+    # gets `capacity` rows further, and check still_valid() afterwards.
+    def read_views (self, max_rows=None):
+        begin, end = self._advance(max_rows)
+        return self.ring.views(begin, end)
+
+    # True if the rows returned by the last read_views() have not been
+    # overwritten yet
+    def still_valid (self):
+        return self.ring.written - self.ring.capacity <= self._held
+
+    # Copy of the rows written since the last call, with any rows the
+    # writer overwrote during the copy dropped from the front
+    def read (self, max_rows=None):
+        views = self.read_views(max_rows)
+        if not views:
+            return np.empty((0, self.ring.width))
+        out = np.concatenate(views) if len(views) > 1 else views[0].copy()
+        overrun = self.ring.written - self.ring.capacity - self._held
+        if overrun > 0:
+            self.lost += min(overrun, len(out))
+            out = out[overrun:]
+            self.first += overrun
+        return out
+
+    def close (self):
+        if not self.ring.owner:
+            self.ring.close()
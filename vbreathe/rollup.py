@@ -0,0 +1,274 @@
+#==========================================================================
+# Time-bucket rollups
+#--------------------------------------------------------------------------
+# Per-channel count, mean, std, min and max over fixed wall-clock buckets
+# (1 s, 1 min and 1 h by default), maintained incrementally while
+# acquiring and kept next to the raw log.  Trend reviews and reports read
+# hours of data as O(buckets) records instead of recomputing statistics
+# over whole CSVs.
+#
+# Unlike the envelope pyramid (vbreathe.envelope), which groups a fixed
+# number of samples, buckets are aligned to the clock: the 1 min bucket
+# starting at 10:15:00 covers [10:15:00, 10:16:00) whatever the sample
+# rate, so rollups of different rigs and sessions line up.
+#
+# Files for a prefix 'SESSION/readings':
+#   readings.roll.json    channel names and periods
+#   readings.roll<p>      float64 records, one per non-empty bucket of p s
+#
+# Record layout: t_start, count, then mean, std, min, max per channel.
+# Each level is built from the level below with the parallel variance
+# merge, so a coarse bucket costs one record per finer bucket.
+#
+# Usage: python -m vbreathe.rollup build SESSION_DIR|LOG.csv
+#        python -m vbreathe.rollup show  SESSION_DIR|PREFIX [--period 60]
+#==========================================================================
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+
+from .envelope import search_column
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+PERIODS = (1, 60, 3600)     # Bucket lengths (s); each a multiple of the previous
+
+T_START = 0
+COUNT   = 1
+FIELDS  = 2                 # Leading fields before the per-channel statistics
+STATS   = 4                 # mean, std, min, max
+MEAN, STD, MIN, MAX = range(STATS)
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def record_width (channels):
+    return FIELDS + STATS * channels
+
+
+# Merge runs of equal `ids` (contiguous, as times only move forward) of
+# partial statistics: counts n (N,), and mean, m2 (sum of squared
+# deviations), min, max (N x channels).  Returns the same for each run,
+# with the id of the run.
+def _reduce (ids, n, mean, m2, mins, maxs):
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    count = np.add.reduceat(n, starts)
+    total = np.add.reduceat(mean * n[:, None], starts) / count[:, None]
+    spread = mean - np.repeat(total, np.diff(np.r_[starts, len(ids)]), axis=0)
+    m2 = np.add.reduceat(m2 + n[:, None] * spread * spread, starts)
+    return (ids[starts], count, total, m2,
+            np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts))
+
+
+# One level of buckets: the bucket still open and the output file
+class _Level:
+    def __init__ (self, period, path, channels):
+        self.period = period
+        self.file   = open(path, 'ab')
+        self.open   = None      # (id, n, mean, m2, min, max) of the current bucket
+        self.channels = channels
+
+    # Fold partial statistics in; returns the buckets completed by them
+    def feed (self, ids, n, mean, m2, mins, maxs):
+        if self.open is not None:
+            ids  = np.r_[self.open[0], ids]
+            n    = np.r_[self.open[1], n]
+            mean, m2, mins, maxs = (np.vstack((o, a)) for o, a in zip(self.open[2:], (mean, m2, mins, maxs)))
+        ids, n, mean, m2, mins, maxs = _reduce(ids, n, mean, m2, mins, maxs)
+        self.open = (ids[-1:], n[-1:], mean[-1:], m2[-1:], mins[-1:], maxs[-1:])
+        return ids[:-1], n[:-1], mean[:-1], m2[:-1], mins[:-1], maxs[:-1]
+
+    def write (self, ids, n, mean, m2, mins, maxs):
+        if not len(ids):
+            return
+        rec = np.empty((len(ids), record_width(self.channels)))
+        rec[:, T_START] = ids * self.period
+        rec[:, COUNT] = n
+        rec[:, FIELDS + MEAN::STATS] = mean
+        rec[:, FIELDS + STD::STATS] = np.sqrt(m2 / n[:, None])
+        rec[:, FIELDS + MIN::STATS] = mins
+        rec[:, FIELDS + MAX::STATS] = maxs
+        rec.tofile(self.file)
+        self.file.flush()
+
+
+#==========================================================================
+# WRITER
+#==========================================================================
+class RollupWriter:
+    def __init__ (self, prefix, channels, periods=PERIODS):
+        periods = sorted(int(p) for p in periods)
+        if any(b % a for a, b in zip(periods, periods[1:])):
+            raise ValueError("rollup periods %s must each divide the next" % periods)
+        self.prefix   = prefix
+        self.channels = list(channels)
+        self.periods  = periods
+        self._levels  = [_Level(p, prefix + '.roll%d' % p, len(self.channels)) for p in periods]
+        with open(prefix + '.roll.json', 'w') as meta:
+            json.dump({'channels': self.channels, 'periods': periods}, meta)
+
+    # Add a block of samples: `times` (N,) in POSIX s, `values` (N x channels)
+    def append (self, times, values):
+        if not len(times):
+            return
+        values = np.asarray(values, dtype=np.float64).reshape(len(times), -1)
+        n = np.ones(len(times))
+        partial = (np.floor_divide(times, self.periods[0]).astype(np.int64), n,
+                   values, np.zeros_like(values), values, values)
+        self._cascade(0, partial)
+
+    # Feed a level, write the buckets it completes and pass them up
+    def _cascade (self, k, partial):
+        level = self._levels[k]
+        done = level.feed(*partial)
+        level.write(*done)
+        if k + 1 < len(self._levels) and len(done[0]):
+            self._cascade(k + 1, (done[0] // (self.periods[k + 1] // level.period),) + done[1:])
+
+    # Write out the open buckets so the tail of the session is covered too.
+    # Each one is passed up like a completed bucket, so a bucket it
+    # completes in the level above is cascaded further up as well.
+    def close (self):
+        for k, level in enumerate(self._levels):
+            partial, level.open = level.open, None
+            if partial is not None:
+                level.write(*partial)
+                if k + 1 < len(self._levels):
+                    self._cascade(k + 1, (partial[0] // (self.periods[k + 1] // level.period),) + partial[1:])
+            level.file.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+#==========================================================================
+# READER
+#==========================================================================
+class RollupReader:
+    def __init__ (self, prefix):
+        with open(prefix + '.roll.json') as meta:
+            info = json.load(meta)
+        self.channels = info['channels']
+        self.periods  = info['periods']
+        self.width    = record_width(len(self.channels))
+        self._levels  = {}
+        for p in self.periods:
+            path = prefix + '.roll%d' % p
+            rows = os.path.getsize(path) // (8 * self.width) if os.path.exists(path) else 0
+            self._levels[p] = (np.memmap(path, dtype=np.float64, mode='r', shape=(rows, self.width))
+                               if rows else np.empty((0, self.width)))
+
+    # Bucket records of `period` s overlapping [t0, t1].  Without a period,
+    # the finest one giving at most `max_buckets` buckets.  Only the binary
+    # searches and the returned slice touch the files.  Returns
+    # (period, records).
+    def query (self, t0=-np.inf, t1=np.inf, period=None, max_buckets=1000):
+        if period is None:
+            span = t1 - t0 if np.isfinite(t1 - t0) else None
+            period = self.periods[-1]
+            for p in self.periods:
+                rec = self._levels[p]
+                if span is None and len(rec):
+                    span = rec[-1, T_START] - rec[0, T_START] + p
+                if span is not None and span / p <= max_buckets:
+                    period = p
+                    break
+        rec = self._levels[period]
+        lo = search_column(rec, T_START, t0 - period, 'right')
+        hi = search_column(rec, T_START, t1, 'right')
+        return period, np.array(rec[lo:hi])
+
+    # Statistics over [t0, t1] from the coarsest level that resolves it,
+    # merged into one record
+    def summary (self, t0=-np.inf, t1=np.inf, period=None):
+        period, rec = self.query(t0, t1, period)
+        if not len(rec):
+            return rec
+        n = rec[:, COUNT]
+        mean = rec[:, FIELDS + MEAN::STATS]
+        std = rec[:, FIELDS + STD::STATS]
+        _, count, mean, m2, mins, maxs = _reduce(np.zeros(len(rec)), n, mean, std * std * n[:, None],
+                                                 rec[:, FIELDS + MIN::STATS], rec[:, FIELDS + MAX::STATS])
+        out = np.empty((1, self.width))
+        out[:, T_START] = rec[0, T_START]
+        out[:, COUNT] = count
+        out[:, FIELDS + MEAN::STATS] = mean
+        out[:, FIELDS + STD::STATS] = np.sqrt(m2 / count[:, None])
+        out[:, FIELDS + MIN::STATS] = mins
+        out[:, FIELDS + MAX::STATS] = maxs
+        return out
+
+    # Samples counted by each level, {period: count}; all equal for a
+    # complete set of rollups
+    def counts (self):
+        return {p: int(rec[:, COUNT].sum()) for p, rec in self._levels.items()}
+
+    # Convenience accessor on a query result: (mean, std, min, max)
+    def channel (self, records, name):
+        c = FIELDS + STATS * self.channels.index(name)
+        return tuple(records[:, c + s] for s in range(STATS))
+
+
+# Rollup prefix of a session directory or a CSV log
+def prefix_for (path):
+    if os.path.isdir(path):
+        return os.path.join(path, 'readings')
+    return path
+
+
+# Build the rollups for an existing session directory or CSV log
+def build (path, periods=PERIODS):
+    from .csvlog import read_csv_blocks
+    from .replay import csv_channels
+    from .session import segment_paths
+    logs = segment_paths(path) if os.path.isdir(path) else [path]
+    channels = csv_channels(logs[0])
+    prefix = prefix_for(path)
+    for p in periods:
+        if os.path.exists(prefix + '.roll%d' % p):
+            os.remove(prefix + '.roll%d' % p)
+    with RollupWriter(prefix, channels, periods) as writer:
+        for log in logs:
+            for times, values in read_csv_blocks(log, range(1, len(channels) + 1)):
+                writer.append(times, values)
+    return prefix
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Build or show time-bucket rollups")
+    parser.add_argument('command', choices=['build', 'show'])
+    parser.add_argument('path', help="session directory, CSV log or rollup prefix")
+    parser.add_argument('--period', type=int, default=None, help="bucket length (s), default chosen by span")
+    args = parser.parse_args(argv)
+
+    prefix = build(args.path) if args.command == 'build' else prefix_for(args.path)
+    reader = RollupReader(prefix)
+    counts = reader.counts()
+    if len(set(counts.values())) > 1:
+        print("Inconsistent rollups, samples per level: %s" % ", ".join("%d s: %d" % item for item in counts.items()))
+    period, rec = reader.query(period=args.period, max_buckets=60)
+    print("%d buckets of %d s" % (len(rec), period))
+    for name in reader.channels:
+        print("  %s" % name)
+        for r, (mean, std, lo, hi) in zip(rec, zip(*reader.channel(rec, name))):
+            print("    %s  n %6d  mean %10.3f  std %8.3f  min %10.3f  max %10.3f"
+                  % (datetime.datetime.fromtimestamp(r[T_START]).isoformat(' ', 'seconds'),
+                     r[COUNT], mean, std, lo, hi))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#==========================================================================
+# Sample representation
+#--------------------------------------------------------------------------
+# The one layout samples take between drivers and sinks.  A block is an
+# (N x 1+channels) C-contiguous float64 array: POSIX time in column 0,
+# then one column per channel, the row layout of the sample bus
+# (vbreathe.ringbuffer) and the stream frames (vbreathe.stream).  Drivers
+# hand the core loop (times, values) pairs; pack() makes them a block with
+# one copy (the sample bus) and split() gives the pair back as views (CSV
+# parsing, vbreathe.csvlog).  block.view(block_dtype(channels)) names the
+# columns without copying (SampleRing.dtype).
+#
+# Sample uses __slots__ and only refers to its row of a block, so a single
+# sample costs one small object (under 90 bytes with its index) instead of a list of
+# boxed floats, a datetime and a string (about 150 bytes for the original
+# per-sample `row_contents` lists), and the values stay in the block.
+# Single samples are shown with it (the stream client's latest row).
+#==========================================================================
+import numpy as np
+
+
+#==========================================================================
+# SINGLE SAMPLES
+#==========================================================================
+class Sample:
+    __slots__ = ('block', 'index')
+
+    def __init__ (self, block, index=0):
+        self.block = block
+        self.index = index
+
+    # A sample of its own (a one-row block)
+    @classmethod
+    def of (cls, time, values):
+        return cls(pack([time], [values]))
+
+    @property
+    def time (self):
+        return float(self.block[self.index, 0])
+
+    # View of the channel values in the block
+    @property
+    def values (self):
+        return self.block[self.index, 1:]
+
+    def __iter__ (self):
+        return iter(self.block[self.index].tolist())
+
+    def __repr__ (self):
+        return "Sample(%r, %s)" % (self.time, np.array2string(self.values, separator=', '))
+
+
+#==========================================================================
+# BLOCKS
+#==========================================================================
+# Structured dtype of one row: 'time' then one float64 field per channel
+def block_dtype (channels):
+    return np.dtype([('time', '<f8')] + [(name, '<f8') for name in channels])
+
+
+# One block from separate times and values (the only copy on the way in),
+# into `out` when given
+def pack (times, values, out=None):
+    n = len(times)
+    values = np.asarray(values, dtype=np.float64).reshape(n, -1)
+    if out is None:
+        out = np.empty((n, 1 + values.shape[1]))
+    out[:, 0] = times
+    out[:, 1:] = values
+    return out
+
+
+# Times and values of a block, as views
+def split (block):
+    return block[:, 0], block[:, 1:]
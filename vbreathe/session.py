@@ -0,0 +1,195 @@
+#==========================================================================
+# Recording sessions
+#--------------------------------------------------------------------------
+# A record-mode run writes a session directory instead of one ever-growing
+# CSV file:
+#
+#   WSEN_20240301-101500/
+#     manifest.json          rig config, adapter id, device profile, adapter
+#                            clocks (vbreathe.align), segments
+#     segment_0000.csv       readings (+ .idx sparse time index)
+#     segment_0001.csv       ...started when the previous one reached
+#                            max_bytes or max_seconds
+#     readings.env*, readings.vba, breaths.csv   session-wide sidecars
+#
+# Only the readings are bounded per file.  The sidecars are not rotated:
+# they span the whole session and grow with it (the archive and the finest
+# envelope level fastest), so a multi-day session has multi-day sidecars.
+#
+# The manifest is rewritten atomically whenever a segment opens or closes,
+# so after a crash it still lists every segment; the ones not marked
+# closed get their partial last line cut off by recover().
+#
+# Usage: python -m vbreathe.session recover SESSION_DIR
+#        python -m vbreathe.session info SESSION_DIR
+#==========================================================================
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+from .csvlog import IndexedCsvWriter, recover_tail, time_span
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+MANIFEST        = 'manifest.json'
+SEGMENT_NAME    = 'segment_%04d.csv'
+SEGMENT_BYTES   = 256 * 1024 * 1024      # Rotate after this many bytes...
+SEGMENT_SECONDS = 3600.0                 # ...or this many seconds, whichever comes first
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+def load_manifest (directory):
+    with open(os.path.join(directory, MANIFEST)) as file:
+        return json.load(file)
+
+
+# Atomic rewrite, like profile.save_profiles
+def save_manifest (directory, manifest):
+    path = os.path.join(directory, MANIFEST)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp, path)
+
+
+# Paths of the session's segments in recording order
+def segment_paths (directory):
+    return [os.path.join(directory, s['file']) for s in load_manifest(directory)['segments']]
+
+
+def is_session (path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST))
+
+
+# Repair a session after a crash: truncate the partial tail of every
+# segment that was not closed and mark it recovered.  Returns the list of
+# repaired segment files.
+def recover (directory):
+    manifest = load_manifest(directory)
+    repaired = []
+    for segment in manifest['segments']:
+        if segment.get('closed'):
+            continue
+        path = os.path.join(directory, segment['file'])
+        if os.path.exists(path):
+            segment['rows'] = recover_tail(path)
+            segment['start'], segment['end'] = time_span(path)
+        else:
+            segment['rows'] = 0
+        segment['closed'] = True
+        segment['recovered'] = True
+        repaired.append(segment['file'])
+    if repaired:
+        manifest['recovered'] = datetime.datetime.now().isoformat()
+        save_manifest(directory, manifest)
+    return repaired
+
+
+#==========================================================================
+# SESSION WRITER
+#==========================================================================
+# Core loop sink writing readings into rotating segment files.  Rotation
+# is checked between blocks, so a block never straddles two segments.
+class SessionWriter:
+    def __init__ (self, directory, channels, config=None, adapter_id=None, profile=None,
+                  max_bytes=SEGMENT_BYTES, max_seconds=SEGMENT_SECONDS, clocks=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory   = directory
+        self.fields      = ['timestamp'] + list(channels)
+        self.max_bytes   = max_bytes
+        self.max_seconds = max_seconds
+        self.manifest = {
+            'created':    datetime.datetime.now().isoformat(),
+            'channels':   list(channels),
+            'adapter_id': adapter_id,
+            'profile':    profile,
+            'rig':        config,
+            'segments':   [],
+        }
+        self.clocks = clocks or []
+        self._log = None
+        self._opened = 0.0
+        self._open_segment()
+
+    # Path prefix for session-wide sidecar files (envelopes, archive)
+    def sidecar (self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def segment (self):
+        return self.manifest['segments'][-1]
+
+    def _open_segment (self):
+        name = SEGMENT_NAME % len(self.manifest['segments'])
+        self._log = IndexedCsvWriter(os.path.join(self.directory, name), self.fields)
+        self._opened = time.monotonic()
+        self.manifest['segments'].append({'file': name, 'start': None, 'end': None, 'rows': 0, 'closed': False})
+        save_manifest(self.directory, self.manifest)
+
+    def _close_segment (self):
+        self._log.close()
+        self.segment['rows'] = self._log.rows
+        self.segment['closed'] = True
+        if self.clocks:
+            self.manifest['clocks'] = [clock.describe() for clock in self.clocks]
+        save_manifest(self.directory, self.manifest)
+
+    def rotate (self):
+        self._close_segment()
+        self._open_segment()
+
+    def write (self, times, values):
+        if self._log.size >= self.max_bytes or time.monotonic() - self._opened >= self.max_seconds:
+            self.rotate()
+        segment = self.segment
+        if segment['start'] is None:
+            segment['start'] = float(times[0])
+        segment['end'] = float(times[-1])
+
+        self._log.write_block(times, values)
+
+    def flush (self):
+        self._log.flush()
+
+    def close (self):
+        if self._log is not None:
+            self._close_segment()
+            self.manifest['closed'] = datetime.datetime.now().isoformat()
+            save_manifest(self.directory, self.manifest)
+            self._log = None
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or repair a recording session")
+    parser.add_argument('command', choices=['recover', 'info'])
+    parser.add_argument('directory')
+    args = parser.parse_args(argv)
+
+    if args.command == 'recover':
+        repaired = recover(args.directory)
+        print("Recovered %d segment(s)%s" % (len(repaired), ": " + ", ".join(repaired) if repaired else ""))
+        return 0
+
+    manifest = load_manifest(args.directory)
+    print("Session %s (%s)" % (args.directory, "closed" if manifest.get('closed') else "not closed"))
+    print("Adapter %s, channels: %s" % (manifest.get('adapter_id'), ", ".join(manifest['channels'])))
+    for segment in manifest['segments']:
+        span = (segment['end'] - segment['start']) if segment.get('start') is not None else 0.0
+        print("  %s  %8d rows  %8.1f s  %s" % (segment['file'], segment['rows'], span,
+                                             "recovered" if segment.get('recovered') else
+                                             "closed" if segment['closed'] else "open"))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
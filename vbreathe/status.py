@@ -0,0 +1,46 @@
+#==========================================================================
+# Rate-limited console status line
+#--------------------------------------------------------------------------
+# Printing several lines per sample costs more than the I2C read itself at
+# high sample rates.  StatusLine keeps the console down to a single line
+# that is rewritten in place at most every `interval` seconds.
+#==========================================================================
+import sys
+import time
+
+
+class StatusLine:
+    def __init__ (self, interval=0.5, stream=None):
+        self.interval = interval
+        self.stream   = stream or sys.stdout
+        self._next    = 0.0
+        self._width   = 0
+
+    # Format and print the status line if the interval has elapsed.
+    # Formatting is skipped entirely otherwise, so calling this every
+    # sample is cheap.  Returns True when the line was written.
+    def update (self, fmt, *args):
+        now = time.monotonic()
+        if now < self._next:
+            return False
+        self._next = now + self.interval
+        self._write(fmt % args if args else fmt)
+        return True
+
+    # Print a normal message line without losing the status line
+    def message (self, text):
+        self.clear()
+        self.stream.write(text + "\n")
+        self.stream.flush()
+        self._next = 0.0
+
+    def clear (self):
+        if self._width:
+            self.stream.write("\r" + " " * self._width + "\r")
+            self._width = 0
+
+    def _write (self, line):
+        pad = max(0, self._width - len(line))
+        self.stream.write("\r" + line + " " * pad)
+        self.stream.flush()
+        self._width = len(line)
@@ -0,0 +1,347 @@
+#==========================================================================
+# Local sample streaming
+#--------------------------------------------------------------------------
+# Serves the rows of a sample bus (vbreathe.ringbuffer) to clients over TCP
+# or a Unix socket, and decodes them back into NumPy blocks on the client
+# side.  The server follows the bus with its own RingReader, so it can run
+# in the acquisition process or as a separate process attached by name;
+# either way a slow client never stalls sampling.  Each client has a
+# bounded queue and loses its oldest batches when it falls behind.
+#
+# Wire format (little endian):
+#   hello   magic 'VBS1', uint32 length, JSON {"width", "channels"}
+#   frame   magic 'VBSF', uint8 flags, uint8 reserved, uint16 width,
+#           uint32 rows, uint64 first sequence number, uint32 payload bytes,
+#           payload = float64[rows, width], zlib compressed if flags & 1
+#
+# Usage:
+#   python -m vbreathe.stream serve vbreathe-wsen --port 5555 --compress
+#   python -m vbreathe.stream client localhost:5555
+#==========================================================================
+import argparse
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from .ringbuffer import RingReader
+from .sample import Sample
+
+
+#==========================================================================
+# CONSTANTS
+#==========================================================================
+DEFAULT_PORT     = 5555
+DEFAULT_BATCH_MS = 20          # Rows are gathered for this long per frame
+CLIENT_QUEUE     = 256         # Frames held per client before dropping the oldest
+COMPRESS_LEVEL   = 1
+
+HELLO_MAGIC = b'VBS1'
+FRAME_MAGIC = b'VBSF'
+HELLO_HEADER = struct.Struct('<4sI')
+FRAME_HEADER = struct.Struct('<4sBBHIQI')
+FLAG_ZLIB = 1
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# 'host:port', ':port' or a Unix socket path
+def parse_address (address):
+    if isinstance(address, tuple):
+        return socket.AF_INET, address
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return socket.AF_INET, (host or 'localhost', int(port))
+    return socket.AF_UNIX, address
+
+
+def encode_frame (block, first_seq, compress=False):
+    block = np.ascontiguousarray(block, dtype='<f8')
+    payload = block.tobytes()
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload, COMPRESS_LEVEL)
+        flags |= FLAG_ZLIB
+    rows, width = block.shape
+    return FRAME_HEADER.pack(FRAME_MAGIC, flags, 0, width, rows, first_seq, len(payload)) + payload
+
+
+def _recv_exact (sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if k == 0:
+            raise ConnectionError("stream closed")
+        got += k
+    return buf
+
+
+#==========================================================================
+# SERVER
+#==========================================================================
+class _Client:
+    def __init__ (self, sock, address, depth):
+        self.sock    = sock
+        self.address = address
+        self.queue   = queue.Queue(depth)
+        self.dropped = 0
+        self.thread  = None
+
+    # Never blocks: a full queue loses its oldest frame
+    def offer (self, frame):
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class StreamServer:
+    def __init__ (self, ring, address=('localhost', DEFAULT_PORT), batch_ms=DEFAULT_BATCH_MS,
+                  compress=False, queue_depth=CLIENT_QUEUE):
+        self.ring        = ring
+        self.batch       = batch_ms / 1000.0
+        self.compress    = compress
+        self.queue_depth = queue_depth
+        self.frames      = 0
+
+        family, self.address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(self.address)
+        self._listener.listen()
+        self._listener.settimeout(0.2)
+
+        self._hello = json.dumps({'width': ring.width, 'channels': ring.channels}).encode()
+        self._clients = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def clients (self):
+        with self._lock:
+            return list(self._clients)
+
+    def start (self):
+        for target in (self._accept_loop, self._publish_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def serve_forever (self):
+        self.start()
+        try:
+            while not self._stop.is_set() and not self.ring.closed:
+                time.sleep(0.2)
+        finally:
+            self.stop()
+
+    def _accept_loop (self):
+        while not self._stop.is_set():
+            try:
+                sock, address = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            sock.settimeout(None)
+            if sock.family == socket.AF_INET:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                sock.sendall(HELLO_HEADER.pack(HELLO_MAGIC, len(self._hello)) + self._hello)
+            except OSError:
+                sock.close()
+                continue
+            client = _Client(sock, address, self.queue_depth)
+            client.thread = threading.Thread(target=self._send_loop, args=(client,), daemon=True)
+            with self._lock:
+                self._clients.append(client)
+            client.thread.start()
+
+    # Gather the rows written during each batch period into one frame and
+    # hand it to every client queue
+    def _publish_loop (self):
+        reader = RingReader(self.ring)
+        next_batch = time.monotonic()
+        while not self._stop.is_set():
+            next_batch += self.batch
+            delay = next_batch - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_batch = time.monotonic()
+
+            self._publish(reader)
+        # Rows written since the last batch, so a clean stop loses nothing
+        self._publish(reader)
+
+    def _publish (self, reader):
+        block = reader.read()
+        if not len(block):
+            return
+        clients = self.clients
+        if not clients:
+            return
+        frame = encode_frame(block, reader.first, self.compress)
+        self.frames += 1
+        for client in clients:
+            client.offer(frame)
+
+    # Sends until stopped and the client's queue is drained
+    def _send_loop (self, client):
+        try:
+            while True:
+                try:
+                    frame = client.queue.get(timeout=0.2)
+                except queue.Empty:
+                    if self._stop.is_set():
+                        break
+                    continue
+                client.sock.sendall(frame)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                if client in self._clients:
+                    self._clients.remove(client)
+            client.sock.close()
+
+    # Stop accepting, publish the last rows and give the clients up to
+    # `drain_s` seconds to receive what is queued for them
+    def stop (self, drain_s=1.0):
+        self._stop.set()
+        self._listener.close()
+        for thread in self._threads:
+            thread.join(1.0)
+        deadline = time.monotonic() + drain_s
+        for client in self.clients:
+            client.thread.join(max(0.0, deadline - time.monotonic()))
+        for client in self.clients:
+            client.sock.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def __enter__ (self):
+        return self.start()
+
+    def __exit__ (self, *exc):
+        self.stop()
+
+
+#==========================================================================
+# CLIENT
+#==========================================================================
+# for first_seq, block in StreamClient('localhost:5555'):
+#     ...   # block is a float64 (rows x width) array: time, channels
+class StreamClient:
+    def __init__ (self, address=('localhost', DEFAULT_PORT), timeout=None):
+        family, address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+
+        magic, length = HELLO_HEADER.unpack(_recv_exact(self.sock, HELLO_HEADER.size))
+        if magic != HELLO_MAGIC:
+            raise ValueError("not a VBreathe sample stream")
+        info = json.loads(bytes(_recv_exact(self.sock, length)).decode())
+        self.width    = info['width']
+        self.channels = info['channels']
+        self.gaps     = 0       # Rows skipped by the server's queue or the bus
+        self._expect  = None
+
+    # One (first sequence number, block) pair
+    def read_block (self):
+        magic, flags, _, width, rows, first, size = FRAME_HEADER.unpack(_recv_exact(self.sock, FRAME_HEADER.size))
+        if magic != FRAME_MAGIC:
+            raise ValueError("stream out of sync")
+        payload = _recv_exact(self.sock, size)
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        block = np.frombuffer(payload, dtype='<f8').reshape(rows, width)
+        if self._expect is not None and first > self._expect:
+            self.gaps += first - self._expect
+        self._expect = first + rows
+        return first, block
+
+    def __iter__ (self):
+        try:
+            while True:
+                yield self.read_block()
+        except ConnectionError:
+            return
+
+    def close (self):
+        self.sock.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
+
+
+#==========================================================================
+# MAIN PROGRAM
+#==========================================================================
+def main (argv=None):
+    parser = argparse.ArgumentParser(description="Stream a VBreathe sample bus over a local socket")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help="serve a sample bus")
+    serve.add_argument('bus', help="shared memory name of the bus, e.g. vbreathe-wsen")
+    serve.add_argument('--address', default=':%d' % DEFAULT_PORT, help="host:port or Unix socket path")
+    serve.add_argument('--port', type=int, default=None)
+    serve.add_argument('--batch-ms', type=float, default=DEFAULT_BATCH_MS)
+    serve.add_argument('--compress', action='store_true')
+    client = sub.add_parser('client', help="print the rate of a running stream")
+    client.add_argument('address', nargs='?', default='localhost:%d' % DEFAULT_PORT)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        from .ringbuffer import SampleRing
+        address = ':%d' % args.port if args.port else args.address
+        ring = SampleRing.attach(args.bus)
+        server = StreamServer(ring, address, args.batch_ms, args.compress)
+        print("Serving %s on %s" % (args.bus, args.address if args.port is None else address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ring.close()
+        return 0
+
+    with StreamClient(args.address) as stream:
+        print("Channels: %s" % ", ".join(stream.channels))
+        rows = 0
+        start = time.monotonic()
+        for first, block in stream:
+            rows += len(block)
+            elapsed = time.monotonic() - start
+            sys.stdout.write("\r%d rows  %.0f rows/s  gaps %d  last %s   "
+                             % (rows, rows / max(elapsed, 1e-9), stream.gaps, Sample(block, len(block) - 1)))
+            sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
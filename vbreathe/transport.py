@@ -0,0 +1,450 @@
+#==========================================================================
+# I2C transports
+#--------------------------------------------------------------------------
+# Thin wrappers that give the Aardvark, the Binho adapter (through the
+# binho library or pipelined over its serial port) and the software sensor
+# bus the same read interface:
+#
+#   read(addr, length)            -> bytes of a single read (b'' on error)
+#   read_burst(addr, length, n, interval=0.0) -> (frames, times, valid)
+#   set_bitrate(khz)              -> bitrate actually set (kHz)
+#
+# read_burst queues n back-to-back reads of `length` bytes (spaced at least
+# `interval` seconds apart when given, to match the sensor update rate) and
+# returns them
+# as an (n x length) uint8 block, the time of each read in time.monotonic()
+# seconds, and a boolean mask of the reads that returned all their bytes.
+# Read times are interpolated across the burst from its start and end
+# instead of reading the clock per transaction.  `read_time` is the mean
+# duration of one read in the last burst that was not paced by `interval`
+# (the adapter latency seen by vbreathe.align), None until there is one.
+#
+# A burst is not faster on the bus.  The Aardvark's I2C master calls are
+# synchronous (its async API covers slave and monitor mode only), and the
+# sensors here answer one sample per transaction, so a longer read returns
+# no extra samples.  On the Aardvark and through the binho library a burst
+# is still n blocking round trips: it saves the Python work per read
+# (allocation, clock reads, per-row appends), and reads/s stays flat with
+# the burst size (benchmark.bench_burst_reads).  On hardware only the
+# pipelined Binho transport overlaps round trips.  The software bus can
+# answer a burst in one modelled round trip (SoftwareTransport(batched=True)),
+# a queueing adapter that none of the supported ones is.
+#==========================================================================
+import time
+
+import numpy as np
+
+
+#==========================================================================
+# FUNCTIONS
+#==========================================================================
+# Spread n read times evenly over [start, end], each at the midpoint of
+# its slot
+def interpolate_times (start, end, n):
+    return start + (np.arange(n) + 0.5) * ((end - start) / n)
+
+
+# Wait until time.monotonic() reaches `deadline`: sleep for the bulk of
+# long waits, spin for the last couple of milliseconds
+def wait_until (deadline):
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if remaining > 0.002:
+            time.sleep(remaining - 0.002)
+
+
+#==========================================================================
+# AARDVARK
+#==========================================================================
+# The Aardvark API has no command queue, so a burst is n synchronous reads
+# into one preallocated buffer with no per-read Python allocation.  Reads
+# go through an aardvark_py.AardvarkI2cSession per (address, length), which
+# calls the extension directly instead of the checking wrappers.
+class AardvarkTransport:
+    def __init__ (self, handle):
+        import aardvark_py as aa
+        self._aa = aa
+        self.handle = handle
+        self.errors = 0
+        self.read_time = None
+        self._sessions = {}
+
+    def _session (self, addr, length):
+        session = self._sessions.get((addr, length))
+        if session is None:
+            session = self._sessions[addr, length] = self._aa.AardvarkI2cSession(self.handle, addr, length)
+        return session
+
+    def read (self, addr, length):
+        session = self._session(addr, length)
+        if session.read() != length:
+            self.errors += 1
+            return b''
+        return session.data_in.tobytes()
+
+    def write (self, addr, data):
+        from array import array
+        return self._aa.aa_i2c_write(self.handle, addr, self._aa.AA_I2C_NO_FLAGS, array('B', data))
+
+    def set_bitrate (self, khz):
+        return self._aa.aa_i2c_bitrate(self.handle, int(khz))
+
+    def read_burst (self, addr, length, n, interval=0.0):
+        session = self._session(addr, length)
+        read = session.read
+        buf = session.data_in
+        frames = np.empty((n, length), dtype=np.uint8)
+        valid = np.empty(n, dtype=bool)
+        view = memoryview(frames).cast('B')
+
+        start = time.monotonic()
+        for i in range(n):
+            if interval and i:
+                wait_until(start + i * interval)
+            valid[i] = read() == length
+            view[i * length:(i + 1) * length] = buf
+        end = time.monotonic()
+        if not interval:
+            self.read_time = (end - start) / n
+
+        self.errors += n - int(valid.sum())
+        return frames, interpolate_times(start, end, n), valid
+
+
+#==========================================================================
+# BINHO
+#==========================================================================
+# binho.i2c.read is a blocking serial round trip per call, so a burst is
+# n sequential reads.
+class BinhoTransport:
+    def __init__ (self, binho):
+        from binho.errors import BinhoException
+        self._exception = BinhoException
+        self.binho = binho
+        self.errors = 0
+        self.read_time = None
+
+    def read (self, addr, length):
+        try:
+            return bytes(self.binho.i2c.read(addr, length))
+        except self._exception:
+            self.errors += 1
+            return b''
+
+    def write (self, addr, data):
+        try:
+            self.binho.i2c.write(addr, list(data))
+            return len(data)
+        except self._exception:
+            self.errors += 1
+            return 0
+
+    def set_bitrate (self, khz):
+        self.binho.i2c.frequency = int(khz * 1000)
+        return self.binho.i2c.frequency // 1000
+
+    def read_burst (self, addr, length, n, interval=0.0):
+        frames = np.zeros((n, length), dtype=np.uint8)
+        valid = np.zeros(n, dtype=bool)
+        read = self.binho.i2c.read
+        start = time.monotonic()
+        for i in range(n):
+            if interval and i:
+                wait_until(start + i * interval)
+            try:
+                data = read(addr, length)
+            except self._exception:
+                continue
+            if len(data) == length:
+                frames[i] = data
+                valid[i] = True
+        end = time.monotonic()
+        if not interval:
+            self.read_time = (end - start) / n
+        self.errors += n - int(valid.sum())
+        return frames, interpolate_times(start, end, n), valid
+
+
+#==========================================================================
+# BINHO, PIPELINED
+#==========================================================================
+# Talks to the Binho Nova's ASCII command interface directly over its
+# serial port instead of going through the binho library's one blocking
+# round trip per call.  Up to `depth` commands are kept in flight, and a
+# background thread reads and parses the responses, so the USB latency of
+# one read overlaps the next ones.  Responses come back in command order.
+#
+# The commands and replies are the ones the binho library (1.0.x,
+# binho/comms/drivers) sends and checks: "+ID" answered by "-ID <id>",
+# "+MODE 0 I2C", "I2C0 PULL 1" and "I2C0 CLK <hz>" answered by "-OK", and
+# reads and writes as "I2C0 WHR <addr> 1 <read> <write> <hex data>",
+# answered by "-I2C0 RXD <hex data>" or "-OK".  "-NG" reports a failure.
+#
+# Replies carry no request id, so each command is queued with its
+# sequence number and the reply it expects, and the reader tags every
+# reply with the sequence number at the head of that queue once it has
+# checked that the reply is of the expected kind (an RXD of the right
+# length for a read).  A timeout or a reply of the wrong kind means the
+# count is off: the transport fails the commands in flight and sends
+# "+ID" as a marker.  The adapter answers in order, so every reply before
+# the marker's "-ID" belongs to an abandoned command and is dropped, and
+# tagging restarts after it (`resyncs`).  No marker reply within
+# BINHO_RESYNC_S raises IOError.
+BINHO_BAUDRATE     = 1000000
+BINHO_RESYNC_S     = 2.0            # Longest wait for the resync marker reply
+BINHO_NEWLINE      = b'\n'
+BINHO_CMD_ID       = "+ID"
+BINHO_CMD_MODE     = "+MODE 0 I2C"
+BINHO_CMD_PULLUPS  = "I2C0 PULL {state}"           # 1 / 0
+BINHO_CMD_FREQ     = "I2C0 CLK {hz}"
+BINHO_CMD_TRANSFER = "I2C0 WHR 0x{addr:02x} 1 {read} {write} {data}"
+BINHO_RESP_OK      = "-OK"
+BINHO_RESP_NG      = "-NG"
+BINHO_RESP_ID      = "-ID "
+BINHO_RESP_RXD     = "-I2C0 RXD"
+
+
+# Parse one response line against the reply its command expects: `expect`
+# is the number of bytes of a read, 0 for an "-OK", None for the ID.
+# Returns (matched, value): value is the bytes read, b'' for OK, the ID
+# string, or None for "-NG" (a failed command, still in step).  matched is
+# False for a reply of another kind.
+def parse_binho_response (line, expect):
+    if line == BINHO_RESP_NG:
+        return True, None
+    if expect is None:
+        if line.startswith(BINHO_RESP_ID):
+            return True, line[len(BINHO_RESP_ID):].strip().upper()
+        return False, None
+    if expect == 0:
+        return line == BINHO_RESP_OK, b''
+    if line.startswith(BINHO_RESP_RXD):
+        try:
+            data = bytes.fromhex(line[len(BINHO_RESP_RXD):])
+        except ValueError:
+            return False, None
+        return len(data) == expect, data
+    return False, None
+
+
+class BinhoPipelinedTransport:
+    def __init__ (self, port, depth=8, timeout=1.0, baudrate=BINHO_BAUDRATE):
+        import collections
+        import queue
+        import threading
+        import serial
+        self.serial  = serial.Serial(port, baudrate, timeout=0.1)
+        self.depth   = depth
+        self.timeout = timeout
+        self.errors  = 0
+        self.resyncs = 0
+        self.read_time = None
+        self._empty  = queue.Empty
+        self._responses = queue.Queue()     # (sequence number, matched, value)
+        self._pending = collections.deque() # (sequence number, expected reply) in send order
+        self._slots  = threading.Semaphore(depth)
+        self._lock   = threading.Lock()
+        self._sent   = 0            # Sequence number of the next command
+        self._floor  = 0            # Commands before this were abandoned
+        self._marker = False        # Dropping replies until the marker's
+        self._synced = threading.Event()
+        self._stop   = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    # Background reader: tags each reply with the command at the head of
+    # the pending queue, or waits for the marker reply during a resync
+    def _read_loop (self):
+        buffer = b''
+        while not self._stop.is_set():
+            chunk = self.serial.read(self.serial.in_waiting or 1)
+            if not chunk:
+                continue
+            buffer += chunk
+            while BINHO_NEWLINE in buffer:
+                line, buffer = buffer.split(BINHO_NEWLINE, 1)
+                line = line.strip().decode('ascii', 'replace')
+                if not line.startswith('-'):
+                    continue
+                with self._lock:
+                    if self._marker:
+                        if line.startswith(BINHO_RESP_ID):
+                            self._marker = False
+                            self._synced.set()
+                        continue
+                    if not self._pending:
+                        continue
+                    seq, expect = self._pending.popleft()
+                matched, value = parse_binho_response(line, expect)
+                self._responses.put((seq, matched, value))
+
+    # Send a command expecting the reply `expect` (see
+    # parse_binho_response); returns its sequence number
+    def _send (self, command, expect=0):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise IOError("Binho adapter stopped answering")
+        with self._lock:
+            seq = self._sent
+            self._pending.append((seq, expect))
+            self._sent += 1
+            self.serial.write(command.encode('ascii') + BINHO_NEWLINE)
+        return seq
+
+    # Response to command `seq`, or None if it failed, timed out or was
+    # abandoned by a resync
+    def _receive (self, seq):
+        try:
+            deadline = time.monotonic() + self.timeout
+            while seq >= self._floor:
+                try:
+                    got, matched, value = self._responses.get(timeout=max(deadline - time.monotonic(), 0))
+                except self._empty:
+                    self._resync()
+                    return None
+                if got < self._floor:
+                    continue
+                if not matched:
+                    self._resync()
+                    return None
+                if got == seq:
+                    return value
+            return None
+        finally:
+            self._slots.release()
+
+    # Abandon the commands in flight and send the ID command as a marker;
+    # the reader drops every reply until the marker's
+    def _resync (self):
+        with self._lock:
+            self._pending.clear()
+            self._floor = self._sent
+            self._marker = True
+            self._synced.clear()
+            self.serial.write(BINHO_CMD_ID.encode('ascii') + BINHO_NEWLINE)
+        if not self._synced.wait(max(BINHO_RESYNC_S, self.timeout)):
+            raise IOError("Binho adapter stopped answering")
+        while True:
+            try:
+                self._responses.get_nowait()
+            except self._empty:
+                break
+        self.resyncs += 1
+
+    def command (self, command, expect=0):
+        return self._receive(self._send(command, expect))
+
+    # The adapter's device ID, as binhoHostAdapter.deviceID reports it
+    def device_id (self):
+        device_id = self.command(BINHO_CMD_ID, None)
+        if not device_id:
+            raise IOError("Binho adapter did not report its ID")
+        return device_id
+
+    # Adapter setup done by binhoHostAdapter in BinhoTransport
+    def configure (self, frequency_hz, pullups=True):
+        self.command(BINHO_CMD_MODE)
+        self.command(BINHO_CMD_PULLUPS.format(state=1 if pullups else 0))
+        return self.set_bitrate(frequency_hz / 1000.0)
+
+    def read (self, addr, length):
+        data = self.command(BINHO_CMD_TRANSFER.format(addr=addr, read=length, write=0, data='00'), length)
+        if data is None:
+            self.errors += 1
+            return b''
+        return data
+
+    def write (self, addr, data):
+        command = BINHO_CMD_TRANSFER.format(addr=addr, read=0, write=len(data), data=bytes(data).hex())
+        if self.command(command) is None:
+            self.errors += 1
+            return 0
+        return len(data)
+
+    def set_bitrate (self, khz):
+        self.command(BINHO_CMD_FREQ.format(hz=int(khz * 1000)))
+        return int(khz)
+
+    # Keeps `depth` reads in flight: command i+depth is sent as soon as the
+    # response to command i has been taken
+    def read_burst (self, addr, length, n, interval=0.0):
+        frames = np.zeros((n, length), dtype=np.uint8)
+        valid = np.zeros(n, dtype=bool)
+        command = BINHO_CMD_TRANSFER.format(addr=addr, read=length, write=0, data='00')
+        send = self._send
+        receive = self._receive
+        seqs = []
+        start = time.monotonic()
+        for i in range(n):
+            while len(seqs) < n and len(seqs) < i + self.depth:
+                if interval and seqs:
+                    wait_until(start + len(seqs) * interval)
+                seqs.append(send(command, length))
+            data = receive(seqs[i])
+            if data is not None:
+                frames[i] = np.frombuffer(data, dtype=np.uint8)
+                valid[i] = True
+        end = time.monotonic()
+        if not interval:
+            self.read_time = (end - start) / n
+        self.errors += n - int(valid.sum())
+        return frames, interpolate_times(start, end, n), valid
+
+    def close (self):
+        self._stop.set()
+        self._reader.join(1.0)
+        self.serial.close()
+
+
+#==========================================================================
+# SOFTWARE
+#==========================================================================
+# Transport over an emulator.SoftwareBus.  With batched=True a burst costs
+# one modelled round trip, as on an adapter that can queue transactions;
+# otherwise every read pays the bus latency.
+class SoftwareTransport:
+    def __init__ (self, bus, batched=True):
+        self.bus = bus
+        self.batched = batched
+        self.errors = 0
+        self.read_time = None
+
+    def read (self, addr, length):
+        data = self.bus.read(addr, length)
+        if len(data) != length:
+            self.errors += 1
+            return b''
+        return data
+
+    def write (self, addr, data):
+        return self.bus.write(addr, data)
+
+    def set_bitrate (self, khz):
+        self.bus.bitrate_khz = khz
+        return khz
+
+    def read_burst (self, addr, length, n, interval=0.0):
+        start = time.monotonic()
+        if interval:
+            rows = []
+            for i in range(n):
+                if i:
+                    wait_until(start + i * interval)
+                rows.append(self.bus.read(addr, length))
+            valid = np.array([len(r) == length for r in rows], dtype=bool)
+            frames = np.array([list(r) if len(r) == length else [0] * length for r in rows], dtype=np.uint8).reshape(n, length)
+        elif self.batched:
+            frames = self.bus.read_batch(addr, length, n)
+            valid = np.full(n, frames is not None)
+            if frames is None:
+                frames = np.zeros((n, length), dtype=np.uint8)
+        else:
+            rows = [self.bus.read(addr, length) for _ in range(n)]
+            valid = np.array([len(r) == length for r in rows], dtype=bool)
+            frames = np.array([list(r) if len(r) == length else [0] * length for r in rows], dtype=np.uint8).reshape(n, length)
+        end = time.monotonic()
+        if not interval:
+            self.read_time = (end - start) / n
+        self.errors += n - int(valid.sum())
+        return frames, interpolate_times(start, end, n), valid